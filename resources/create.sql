@@ -1,3 +1,7 @@
+-- The full current schema in one script. For an existing database prefer
+-- python Scheduler.py --migrate up, which applies resources/migrations/mssql
+-- and records the schema version.
+
 CREATE TABLE Caregivers (
     Username varchar(255),
     Salt BINARY(16),
@@ -5,10 +9,12 @@ CREATE TABLE Caregivers (
     PRIMARY KEY (Username)
 );
 
+-- one row per free slot; Slot is the start of the slot in minutes after midnight
 CREATE TABLE Availabilities (
     Time date,
     Username varchar(255) REFERENCES Caregivers,
-    PRIMARY KEY (Time, Username)
+    Slot int NOT NULL CONSTRAINT Availabilities_Slot_Default DEFAULT 0,
+    CONSTRAINT Availabilities_PK PRIMARY KEY (Time, Username, Slot)
 );
 
 CREATE TABLE Vaccines (
@@ -30,5 +36,68 @@ CREATE TABLE Reservations (
     Caregiver_Name VARCHAR(255) REFERENCES Caregivers(Username),
     Vaccine_Name VARCHAR(255) REFERENCES Vaccines(Name),
     Reservation_Time DATE,
-    UNIQUE (Caregiver_Name, Reservation_Time) --a caregiver can only have one reservation per day
-);
\ No newline at end of file
+    Slot int NOT NULL CONSTRAINT Reservations_Slot_Default DEFAULT 0,
+    CONSTRAINT Reservations_Caregiver_Slot UNIQUE (Caregiver_Name, Reservation_Time, Slot) --a caregiver can only have one reservation per slot
+);
+
+CREATE TABLE IdempotencyKeys (
+    Idempotency_Key varchar(255),
+    Username varchar(255),
+    Command varchar(300),
+    Outcome varchar(1024),
+    Created_At datetime,
+    PRIMARY KEY (Idempotency_Key, Username)
+);
+
+-- dose changes not yet compacted into Vaccines.Doses; the balance of a vaccine is Doses plus its deltas
+CREATE TABLE VaccineLedger (
+    ID INT IDENTITY(1,1) PRIMARY KEY,
+    Name varchar(255) REFERENCES Vaccines(Name),
+    Delta int,
+    Created_At datetime
+);
+
+CREATE INDEX VaccineLedger_Name ON VaccineLedger (Name, Delta);
+
+CREATE INDEX Reservations_Patient ON Reservations (Patient_Name, ID)
+    INCLUDE (Vaccine_Name, Reservation_Time, Slot, Caregiver_Name);
+CREATE INDEX Reservations_Caregiver ON Reservations (Caregiver_Name, ID)
+    INCLUDE (Vaccine_Name, Reservation_Time, Slot, Patient_Name);
+CREATE INDEX Availabilities_Username ON Availabilities (Username, Time);
+CREATE INDEX IdempotencyKeys_Created ON IdempotencyKeys (Created_At);
+
+-- bookings per caregiver per week (Week_Start is the Monday), kept up to date by reserve and cancel
+CREATE TABLE CaregiverLoad (
+    Username varchar(255) REFERENCES Caregivers,
+    Week_Start date,
+    Bookings int,
+    PRIMARY KEY (Username, Week_Start)
+);
+
+-- patients waiting for a vaccine on any date from From_Date to To_Date, served in ID order
+CREATE TABLE Waitlist (
+    ID INT IDENTITY(1,1) PRIMARY KEY,
+    Patient_Name varchar(255) REFERENCES Patients(Username),
+    Vaccine_Name varchar(255),
+    From_Date date,
+    To_Date date,
+    Created_At datetime
+);
+
+CREATE INDEX Waitlist_Patient ON Waitlist (Patient_Name, ID);
+
+-- bumped on the primary to measure how far behind each read replica is, see db/Replicas.py
+CREATE TABLE ReplicaHeartbeat (
+    ID int PRIMARY KEY,
+    Seq bigint NOT NULL
+);
+
+INSERT INTO ReplicaHeartbeat (ID, Seq) VALUES (1, 0);
+
+-- session tokens revoked by logout before they expired, see db/SessionTokens.py
+CREATE TABLE RevokedTokens (
+    Token_ID varchar(32) PRIMARY KEY,
+    Expires_At datetime
+);
+
+CREATE INDEX RevokedTokens_Expires ON RevokedTokens (Expires_At);
@@ -0,0 +1,5 @@
+DROP TABLE Reservations;
+DROP TABLE Patients;
+DROP TABLE Vaccines;
+DROP TABLE Availabilities;
+DROP TABLE Caregivers;
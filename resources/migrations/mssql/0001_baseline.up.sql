@@ -0,0 +1,34 @@
+IF OBJECT_ID('Caregivers') IS NULL CREATE TABLE Caregivers (
+    Username varchar(255),
+    Salt BINARY(16),
+    Hash BINARY(16),
+    PRIMARY KEY (Username)
+);
+
+IF OBJECT_ID('Availabilities') IS NULL CREATE TABLE Availabilities (
+    Time date,
+    Username varchar(255) REFERENCES Caregivers,
+    PRIMARY KEY (Time, Username)
+);
+
+IF OBJECT_ID('Vaccines') IS NULL CREATE TABLE Vaccines (
+    Name varchar(255),
+    Doses int,
+    PRIMARY KEY (Name)
+);
+
+IF OBJECT_ID('Patients') IS NULL CREATE TABLE Patients (
+    Username varchar(255),
+    Salt BINARY(16),
+    Hash BINARY(16),
+    PRIMARY KEY (Username)
+);
+
+IF OBJECT_ID('Reservations') IS NULL CREATE TABLE Reservations (
+    ID INT IDENTITY(1,1) PRIMARY KEY,
+    Patient_Name VARCHAR(255) REFERENCES Patients(Username),
+    Caregiver_Name VARCHAR(255) REFERENCES Caregivers(Username),
+    Vaccine_Name VARCHAR(255) REFERENCES Vaccines(Name),
+    Reservation_Time DATE,
+    UNIQUE (Caregiver_Name, Reservation_Time) --a caregiver can only have one reservation per day
+);
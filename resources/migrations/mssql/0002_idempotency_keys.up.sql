@@ -0,0 +1,8 @@
+IF OBJECT_ID('IdempotencyKeys') IS NULL CREATE TABLE IdempotencyKeys (
+    Idempotency_Key varchar(255),
+    Username varchar(255),
+    Command varchar(64),
+    Outcome varchar(1024),
+    Created_At datetime,
+    PRIMARY KEY (Idempotency_Key, Username)
+);
@@ -0,0 +1,10 @@
+-- dose changes not yet compacted into Vaccines.Doses; the balance of a vaccine is Doses plus its deltas
+IF OBJECT_ID('VaccineLedger') IS NULL CREATE TABLE VaccineLedger (
+    ID INT IDENTITY(1,1) PRIMARY KEY,
+    Name varchar(255) REFERENCES Vaccines(Name),
+    Delta int,
+    Created_At datetime
+);
+
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'VaccineLedger_Name')
+    CREATE INDEX VaccineLedger_Name ON VaccineLedger (Name, Delta);
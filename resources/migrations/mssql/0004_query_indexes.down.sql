@@ -0,0 +1,4 @@
+DROP INDEX IdempotencyKeys_Created ON IdempotencyKeys;
+DROP INDEX Availabilities_Username ON Availabilities;
+DROP INDEX Reservations_Caregiver ON Reservations;
+DROP INDEX Reservations_Patient ON Reservations;
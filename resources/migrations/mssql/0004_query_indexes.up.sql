@@ -0,0 +1,19 @@
+-- show_appointments for a patient: WHERE Patient_Name = %s ORDER BY ID
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'Reservations_Patient')
+    CREATE INDEX Reservations_Patient ON Reservations (Patient_Name, ID)
+    INCLUDE (Vaccine_Name, Reservation_Time, Caregiver_Name);
+
+-- show_appointments for a caregiver: WHERE Caregiver_Name = %s ORDER BY ID; the UNIQUE
+-- (Caregiver_Name, Reservation_Time) constraint finds the rows but not in ID order
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'Reservations_Caregiver')
+    CREATE INDEX Reservations_Caregiver ON Reservations (Caregiver_Name, ID)
+    INCLUDE (Vaccine_Name, Reservation_Time, Patient_Name);
+
+-- a caregiver's own dates (upload_availability: WHERE Username = %s AND Time BETWEEN ...), which the
+-- (Time, Username) primary key can only answer by scanning every date
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'Availabilities_Username')
+    CREATE INDEX Availabilities_Username ON Availabilities (Username, Time);
+
+-- purging expired idempotency keys: WHERE Created_At < %s
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IdempotencyKeys_Created')
+    CREATE INDEX IdempotencyKeys_Created ON IdempotencyKeys (Created_At);
@@ -0,0 +1,15 @@
+-- bookings per caregiver per week (Week_Start is the Monday), kept up to date by reserve and cancel so that
+-- the least-loaded assignment strategy never has to count Reservations
+IF OBJECT_ID('CaregiverLoad') IS NULL CREATE TABLE CaregiverLoad (
+    Username varchar(255) REFERENCES Caregivers,
+    Week_Start date,
+    Bookings int,
+    PRIMARY KEY (Username, Week_Start)
+);
+
+-- 1900-01-01 was a Monday
+IF NOT EXISTS (SELECT 1 FROM CaregiverLoad)
+    INSERT INTO CaregiverLoad (Username, Week_Start, Bookings)
+    SELECT Caregiver_Name, DATEADD(day, -(DATEDIFF(day, '19000101', Reservation_Time) % 7), Reservation_Time), COUNT(*)
+    FROM Reservations
+    GROUP BY Caregiver_Name, DATEADD(day, -(DATEDIFF(day, '19000101', Reservation_Time) % 7), Reservation_Time);
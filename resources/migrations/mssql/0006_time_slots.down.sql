@@ -0,0 +1,30 @@
+DROP INDEX Reservations_Caregiver ON Reservations;
+
+CREATE INDEX Reservations_Caregiver ON Reservations (Caregiver_Name, ID)
+    INCLUDE (Vaccine_Name, Reservation_Time, Patient_Name);
+
+DROP INDEX Reservations_Patient ON Reservations;
+
+CREATE INDEX Reservations_Patient ON Reservations (Patient_Name, ID)
+    INCLUDE (Vaccine_Name, Reservation_Time, Caregiver_Name);
+
+-- fails if a caregiver has more than one reservation on a day
+ALTER TABLE Reservations DROP CONSTRAINT Reservations_Caregiver_Slot;
+
+ALTER TABLE Reservations ADD UNIQUE (Caregiver_Name, Reservation_Time);
+
+ALTER TABLE Reservations DROP CONSTRAINT Reservations_Slot_Default;
+
+ALTER TABLE Reservations DROP COLUMN Slot;
+
+-- keep the earliest slot of each caregiver and day
+DELETE a FROM Availabilities a
+WHERE EXISTS (SELECT 1 FROM Availabilities b WHERE b.Time = a.Time AND b.Username = a.Username AND b.Slot < a.Slot);
+
+ALTER TABLE Availabilities DROP CONSTRAINT Availabilities_PK;
+
+ALTER TABLE Availabilities DROP CONSTRAINT Availabilities_Slot_Default;
+
+ALTER TABLE Availabilities DROP COLUMN Slot;
+
+ALTER TABLE Availabilities ADD PRIMARY KEY (Time, Username);
@@ -0,0 +1,34 @@
+-- availability is published as slots: Slot is the start of the slot in minutes after midnight, and a
+-- caregiver can be booked once per slot instead of once per day. Rows from before keep Slot 0.
+IF COL_LENGTH('Availabilities', 'Slot') IS NULL
+    ALTER TABLE Availabilities ADD Slot int NOT NULL CONSTRAINT Availabilities_Slot_Default DEFAULT 0;
+
+IF NOT EXISTS (SELECT 1 FROM sys.key_constraints WHERE name = 'Availabilities_PK')
+BEGIN
+    DECLARE @pk sysname = (SELECT name FROM sys.key_constraints
+                           WHERE parent_object_id = OBJECT_ID('Availabilities') AND type = 'PK')
+    IF @pk IS NOT NULL EXEC('ALTER TABLE Availabilities DROP CONSTRAINT ' + @pk)
+    ALTER TABLE Availabilities ADD CONSTRAINT Availabilities_PK PRIMARY KEY (Time, Username, Slot)
+END;
+
+IF COL_LENGTH('Reservations', 'Slot') IS NULL
+    ALTER TABLE Reservations ADD Slot int NOT NULL CONSTRAINT Reservations_Slot_Default DEFAULT 0;
+
+IF NOT EXISTS (SELECT 1 FROM sys.key_constraints WHERE name = 'Reservations_Caregiver_Slot')
+BEGIN
+    DECLARE @unique sysname = (SELECT name FROM sys.key_constraints
+                               WHERE parent_object_id = OBJECT_ID('Reservations') AND type = 'UQ')
+    IF @unique IS NOT NULL EXEC('ALTER TABLE Reservations DROP CONSTRAINT ' + @unique)
+    ALTER TABLE Reservations ADD CONSTRAINT Reservations_Caregiver_Slot UNIQUE (Caregiver_Name, Reservation_Time, Slot)
+END;
+
+-- show_appointments lists the slot too, so the covering indexes from 0004 include it
+DROP INDEX IF EXISTS Reservations_Patient ON Reservations;
+
+CREATE INDEX Reservations_Patient ON Reservations (Patient_Name, ID)
+    INCLUDE (Vaccine_Name, Reservation_Time, Slot, Caregiver_Name);
+
+DROP INDEX IF EXISTS Reservations_Caregiver ON Reservations;
+
+CREATE INDEX Reservations_Caregiver ON Reservations (Caregiver_Name, ID)
+    INCLUDE (Vaccine_Name, Reservation_Time, Slot, Patient_Name);
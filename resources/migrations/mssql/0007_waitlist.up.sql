@@ -0,0 +1,14 @@
+-- patients waiting for a vaccine on any date from From_Date to To_Date, served in ID order; the vaccine need
+-- not be in stock yet, so it is not a foreign key
+IF OBJECT_ID('Waitlist') IS NULL CREATE TABLE Waitlist (
+    ID INT IDENTITY(1,1) PRIMARY KEY,
+    Patient_Name varchar(255) REFERENCES Patients(Username),
+    Vaccine_Name varchar(255),
+    From_Date date,
+    To_Date date,
+    Created_At datetime
+);
+
+-- a patient's own entries: WHERE Patient_Name = %s ORDER BY ID
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'Waitlist_Patient')
+    CREATE INDEX Waitlist_Patient ON Waitlist (Patient_Name, ID);
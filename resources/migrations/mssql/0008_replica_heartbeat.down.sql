@@ -0,0 +1 @@
+DROP TABLE ReplicaHeartbeat;
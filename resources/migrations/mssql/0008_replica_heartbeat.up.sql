@@ -0,0 +1,8 @@
+-- a counter every process reading from replicas bumps on the primary once a ReplicaCheckInterval; the value a
+-- replica has got to shows which of those commits, and so everything committed before them, it has applied
+IF OBJECT_ID('ReplicaHeartbeat') IS NULL CREATE TABLE ReplicaHeartbeat (
+    ID int PRIMARY KEY,
+    Seq bigint NOT NULL
+);
+
+IF NOT EXISTS (SELECT 1 FROM ReplicaHeartbeat) INSERT INTO ReplicaHeartbeat (ID, Seq) VALUES (1, 0);
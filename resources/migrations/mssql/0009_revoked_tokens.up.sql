@@ -0,0 +1,10 @@
+-- session tokens revoked by logout before they expired; a row is only needed until Expires_At, after which
+-- the token is refused anyway and the row is purged
+IF OBJECT_ID('RevokedTokens') IS NULL CREATE TABLE RevokedTokens (
+    Token_ID varchar(32) PRIMARY KEY,
+    Expires_At datetime
+);
+
+-- the purge: WHERE Expires_At < %s
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'RevokedTokens_Expires')
+    CREATE INDEX RevokedTokens_Expires ON RevokedTokens (Expires_At);
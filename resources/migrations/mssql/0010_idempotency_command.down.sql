@@ -0,0 +1,4 @@
+-- keys are only remembered for IdempotencyTTL, so the ones whose command no longer fits are dropped
+DELETE FROM IdempotencyKeys WHERE LEN(Command) > 64;
+
+ALTER TABLE IdempotencyKeys ALTER COLUMN Command varchar(64);
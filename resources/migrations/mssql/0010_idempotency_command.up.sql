@@ -0,0 +1,3 @@
+-- the command recorded with an idempotency key names the whole request, e.g. a reservation's date, slot
+-- and vaccine, so that reusing the key for another request is rejected
+ALTER TABLE IdempotencyKeys ALTER COLUMN Command varchar(300);
@@ -0,0 +1,34 @@
+CREATE TABLE IF NOT EXISTS Caregivers (
+    Username varchar(255),
+    Salt BLOB,
+    Hash BLOB,
+    PRIMARY KEY (Username)
+);
+
+CREATE TABLE IF NOT EXISTS Availabilities (
+    Time date,
+    Username varchar(255) REFERENCES Caregivers,
+    PRIMARY KEY (Time, Username)
+);
+
+CREATE TABLE IF NOT EXISTS Vaccines (
+    Name varchar(255),
+    Doses int,
+    PRIMARY KEY (Name)
+);
+
+CREATE TABLE IF NOT EXISTS Patients (
+    Username varchar(255),
+    Salt BLOB,
+    Hash BLOB,
+    PRIMARY KEY (Username)
+);
+
+CREATE TABLE IF NOT EXISTS Reservations (
+    ID INTEGER PRIMARY KEY AUTOINCREMENT,
+    Patient_Name VARCHAR(255) REFERENCES Patients(Username),
+    Caregiver_Name VARCHAR(255) REFERENCES Caregivers(Username),
+    Vaccine_Name VARCHAR(255) REFERENCES Vaccines(Name),
+    Reservation_Time DATE,
+    UNIQUE (Caregiver_Name, Reservation_Time) --a caregiver can only have one reservation per day
+);
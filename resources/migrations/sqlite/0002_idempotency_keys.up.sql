@@ -0,0 +1,8 @@
+CREATE TABLE IF NOT EXISTS IdempotencyKeys (
+    Idempotency_Key varchar(255),
+    Username varchar(255),
+    Command varchar(64),
+    Outcome varchar(1024),
+    Created_At datetime,
+    PRIMARY KEY (Idempotency_Key, Username)
+);
@@ -0,0 +1,3 @@
+-- fold outstanding deltas back into the balance before dropping the ledger
+UPDATE Vaccines SET Doses = Doses + (SELECT COALESCE(SUM(l.Delta), 0) FROM VaccineLedger l WHERE l.Name = Vaccines.Name);
+DROP TABLE VaccineLedger;
@@ -0,0 +1,9 @@
+-- dose changes not yet compacted into Vaccines.Doses; the balance of a vaccine is Doses plus its deltas
+CREATE TABLE IF NOT EXISTS VaccineLedger (
+    ID INTEGER PRIMARY KEY AUTOINCREMENT,
+    Name varchar(255) REFERENCES Vaccines(Name),
+    Delta int,
+    Created_At datetime
+);
+
+CREATE INDEX IF NOT EXISTS VaccineLedger_Name ON VaccineLedger (Name, Delta);
@@ -0,0 +1,4 @@
+DROP INDEX IdempotencyKeys_Created;
+DROP INDEX Availabilities_Username;
+DROP INDEX Reservations_Caregiver;
+DROP INDEX Reservations_Patient;
@@ -0,0 +1,8 @@
+-- see mssql/0004_query_indexes.up.sql; ID is the rowid, so every index here already ends with it
+CREATE INDEX IF NOT EXISTS Reservations_Patient ON Reservations (Patient_Name, ID);
+
+CREATE INDEX IF NOT EXISTS Reservations_Caregiver ON Reservations (Caregiver_Name, ID);
+
+CREATE INDEX IF NOT EXISTS Availabilities_Username ON Availabilities (Username, Time);
+
+CREATE INDEX IF NOT EXISTS IdempotencyKeys_Created ON IdempotencyKeys (Created_At);
@@ -0,0 +1,14 @@
+-- see mssql/0005_caregiver_load.up.sql; Week_Start is the Monday of the booked date
+CREATE TABLE IF NOT EXISTS CaregiverLoad (
+    Username varchar(255) REFERENCES Caregivers,
+    Week_Start date,
+    Bookings int,
+    PRIMARY KEY (Username, Week_Start)
+);
+
+INSERT INTO CaregiverLoad (Username, Week_Start, Bookings)
+SELECT Caregiver_Name, date(Reservation_Time, '-' || (CAST(julianday(Reservation_Time) + 0.5 AS INTEGER) % 7) || ' days'),
+       COUNT(*)
+FROM Reservations
+WHERE NOT EXISTS (SELECT 1 FROM CaregiverLoad)
+GROUP BY Caregiver_Name, date(Reservation_Time, '-' || (CAST(julianday(Reservation_Time) + 0.5 AS INTEGER) % 7) || ' days');
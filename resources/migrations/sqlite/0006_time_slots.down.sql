@@ -0,0 +1,34 @@
+-- fails on the UNIQUE constraint if a caregiver has more than one reservation on a day
+CREATE TABLE Reservations_Days (
+    ID INTEGER PRIMARY KEY AUTOINCREMENT,
+    Patient_Name VARCHAR(255) REFERENCES Patients(Username),
+    Caregiver_Name VARCHAR(255) REFERENCES Caregivers(Username),
+    Vaccine_Name VARCHAR(255) REFERENCES Vaccines(Name),
+    Reservation_Time DATE,
+    UNIQUE (Caregiver_Name, Reservation_Time) --a caregiver can only have one reservation per day
+);
+
+INSERT INTO Reservations_Days (ID, Patient_Name, Caregiver_Name, Vaccine_Name, Reservation_Time)
+SELECT ID, Patient_Name, Caregiver_Name, Vaccine_Name, Reservation_Time FROM Reservations;
+
+DROP TABLE Reservations;
+
+ALTER TABLE Reservations_Days RENAME TO Reservations;
+
+CREATE INDEX Reservations_Patient ON Reservations (Patient_Name, ID);
+
+CREATE INDEX Reservations_Caregiver ON Reservations (Caregiver_Name, ID);
+
+CREATE TABLE Availabilities_Days (
+    Time date,
+    Username varchar(255) REFERENCES Caregivers,
+    PRIMARY KEY (Time, Username)
+);
+
+INSERT INTO Availabilities_Days (Time, Username) SELECT DISTINCT Time, Username FROM Availabilities;
+
+DROP TABLE Availabilities;
+
+ALTER TABLE Availabilities_Days RENAME TO Availabilities;
+
+CREATE INDEX Availabilities_Username ON Availabilities (Username, Time);
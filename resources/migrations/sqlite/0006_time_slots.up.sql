@@ -0,0 +1,37 @@
+-- see mssql/0006_time_slots.up.sql; SQLite cannot alter a primary key or UNIQUE constraint, so both tables
+-- are rebuilt with their rows, IDs and indexes
+CREATE TABLE Availabilities_Slots (
+    Time date,
+    Username varchar(255) REFERENCES Caregivers,
+    Slot int NOT NULL DEFAULT 0,
+    PRIMARY KEY (Time, Username, Slot)
+);
+
+INSERT INTO Availabilities_Slots (Time, Username, Slot) SELECT Time, Username, 0 FROM Availabilities;
+
+DROP TABLE Availabilities;
+
+ALTER TABLE Availabilities_Slots RENAME TO Availabilities;
+
+CREATE INDEX Availabilities_Username ON Availabilities (Username, Time);
+
+CREATE TABLE Reservations_Slots (
+    ID INTEGER PRIMARY KEY AUTOINCREMENT,
+    Patient_Name VARCHAR(255) REFERENCES Patients(Username),
+    Caregiver_Name VARCHAR(255) REFERENCES Caregivers(Username),
+    Vaccine_Name VARCHAR(255) REFERENCES Vaccines(Name),
+    Reservation_Time DATE,
+    Slot int NOT NULL DEFAULT 0,
+    UNIQUE (Caregiver_Name, Reservation_Time, Slot)
+);
+
+INSERT INTO Reservations_Slots (ID, Patient_Name, Caregiver_Name, Vaccine_Name, Reservation_Time, Slot)
+SELECT ID, Patient_Name, Caregiver_Name, Vaccine_Name, Reservation_Time, 0 FROM Reservations;
+
+DROP TABLE Reservations;
+
+ALTER TABLE Reservations_Slots RENAME TO Reservations;
+
+CREATE INDEX Reservations_Patient ON Reservations (Patient_Name, ID);
+
+CREATE INDEX Reservations_Caregiver ON Reservations (Caregiver_Name, ID);
@@ -0,0 +1,11 @@
+-- see mssql/0007_waitlist.up.sql
+CREATE TABLE IF NOT EXISTS Waitlist (
+    ID INTEGER PRIMARY KEY AUTOINCREMENT,
+    Patient_Name varchar(255) REFERENCES Patients(Username),
+    Vaccine_Name varchar(255),
+    From_Date date,
+    To_Date date,
+    Created_At datetime
+);
+
+CREATE INDEX IF NOT EXISTS Waitlist_Patient ON Waitlist (Patient_Name, ID);
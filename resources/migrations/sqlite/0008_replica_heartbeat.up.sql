@@ -0,0 +1,7 @@
+-- see mssql/0008_replica_heartbeat.up.sql
+CREATE TABLE IF NOT EXISTS ReplicaHeartbeat (
+    ID int PRIMARY KEY,
+    Seq bigint NOT NULL
+);
+
+INSERT OR IGNORE INTO ReplicaHeartbeat (ID, Seq) VALUES (1, 0);
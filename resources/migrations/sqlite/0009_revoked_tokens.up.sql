@@ -0,0 +1,7 @@
+-- see mssql/0009_revoked_tokens.up.sql
+CREATE TABLE IF NOT EXISTS RevokedTokens (
+    Token_ID varchar(32) PRIMARY KEY,
+    Expires_At datetime
+);
+
+CREATE INDEX IF NOT EXISTS RevokedTokens_Expires ON RevokedTokens (Expires_At);
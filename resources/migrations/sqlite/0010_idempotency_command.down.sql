@@ -0,0 +1 @@
+-- see sqlite/0010_idempotency_command.up.sql
@@ -0,0 +1 @@
+-- see mssql/0010_idempotency_command.up.sql; SQLite does not enforce varchar lengths, so there is nothing to do
@@ -1,40 +1,40 @@
 from model.Vaccine import Vaccine
 from model.Caregiver import Caregiver
 from model.Patient import Patient
+from model.Reservation import Reservation, ReservationError
+from model.Waitlist import Waitlist
 from util.Util import Util
-from db.ConnectionManager import ConnectionManager
-import pymssql
+from util.UserImport import UserImport
+from util.CampaignPlanner import CampaignPlanner, CampaignError
+from util.HashExecutor import get_hash_executor
+from util.Metrics import metrics, start_dump_from_env
+from db.ConnectionManager import ConnectionManager, retryable
+from db.Backend import DBError
+from db.Migrator import Migrator
+import db.Repository as Repository
+import db.ReadCache as ReadCache
+import db.SessionTokens as SessionTokens
+from db.ReadCache import read_cache
+from db.SQLTrace import sql_trace
+from db.SlotIndex import slot_index, format_slot, MINUTES_PER_DAY
+from db.UsernameIndex import patient_names, caregiver_names
+from Session import Session
+from Server import Server
+import argparse
 import datetime
+import os
 import re
-
-'''
-objects to keep track of the currently logged-in user
-Note: it is always true that at most one of currentCaregiver and currentPatient is not null
-        since only one user can be logged-in at a time
-'''
-current_patient = None
-
-current_caregiver = None
+import sys
+import time
 
 def is_strong_password(password):
-    if len(password) < 8:
-        print("Password length check failed. See Guideline a")
-        return False
-    if not re.search("[a-z]", password):
-        print("Lowercase letter check failed. See Guideline b")
-        return False
-    if not re.search("[A-Z]", password):
-        print("Uppercase letter check failed. See Guideline b")
-        return False
-    if not re.search("[0-9]", password):
-        print("Number check failed. See Guideline c")
-        return False
-    if not re.search("[!@#?]", password):
-        print("Special character check failed. See Guideline d")
+    failure = Util.check_password_strength(password)
+    if failure is not None:
+        print(failure)
         return False
     return True
 
-def create_patient(tokens):
+def create_patient(tokens, session):
     # TODO: Part 1
     # create_patient <username> <password>
     # check 1: the length for tokens need to be exactly 3 to include all information (with the operation name)
@@ -45,8 +45,8 @@ def create_patient(tokens):
     username = tokens[1]
     password = tokens[2]
 
-    # check 2: check if the username has been taken already
-    if username_exists_patient(username):
+    # check 2: check if the username has been taken already; a name the index has never seen needs no lookup
+    if patient_names.might_exist(username) and username_exists_patient(username):
         print("Username taken, try again!")
         return
 
@@ -60,40 +60,39 @@ def create_patient(tokens):
             "d. Inclusion of at least one special character, from “!”, “@”, “#”, “?” ")
         return
 
+    # hash only now that the name is known to be free
     salt = Util.generate_salt()
-    hash = Util.generate_hash(password, salt)
+    hash = get_hash_executor().generate_hash(password, salt)
 
     # create the patient
     patient = Patient(username, salt=salt, hash=hash)
 
     # save to patient information to our database
     try:
-        patient.save_to_db()
-    except pymssql.Error as e:
+        if not patient.save_to_db():
+            # taken since the check, e.g. by a concurrent sign-up
+            print("Username taken, try again!")
+            return
+    except DBError as e:
         print("Failed to create user.")
         print("Db-Error:", e)
-        quit()
+        return
     except Exception as e:
         print("Failed to create user.")
         print(e)
         return
     print("Created user ", username)
 
+@retryable
 def username_exists_patient(username):
-    cm = ConnectionManager()
+    cm = ConnectionManager(read_only=True)
     conn = cm.create_connection()
 
-    select_username = "SELECT * FROM Patients WHERE Username = %s"
     try:
-        cursor = conn.cursor(as_dict=True)
-        cursor.execute(select_username, username)
-        #  returns false if the cursor is not before the first record or if there are no rows in the ResultSet.
-        for row in cursor:
-            return row['Username'] is not None
-    except pymssql.Error as e:
-        print("Error occurred when checking username")
-        print("Db-Error:", e)
-        quit()
+        return Repository.patient_exists.one(conn, (username,)) is not None
+    except DBError:
+        # reported by dispatch(), after any retries
+        raise
     except Exception as e:
         print("Error occurred when checking username")
         print("Error:", e)
@@ -102,7 +101,7 @@ def username_exists_patient(username):
     return False
 
 
-def create_caregiver(tokens):
+def create_caregiver(tokens, session):
     # create_caregiver <username> <password>
     # check 1: the length for tokens need to be exactly 3 to include all information (with the operation name)
     if len(tokens) != 3:
@@ -111,8 +110,8 @@ def create_caregiver(tokens):
 
     username = tokens[1]
     password = tokens[2]
-    # check 2: check if the username has been taken already
-    if username_exists_caregiver(username):
+    # check 2: check if the username has been taken already; a name the index has never seen needs no lookup
+    if caregiver_names.might_exist(username) and username_exists_caregiver(username):
         print("Username taken, try again!")
         return
 
@@ -126,19 +125,23 @@ def create_caregiver(tokens):
             "d. Inclusion of at least one special character, from “!”, “@”, “#”, “?” ")
         return
 
+    # hash only now that the name is known to be free
     salt = Util.generate_salt()
-    hash = Util.generate_hash(password, salt)
+    hash = get_hash_executor().generate_hash(password, salt)
 
     # create the caregiver
     caregiver = Caregiver(username, salt=salt, hash=hash)
 
     # save to caregiver information to our database
     try:
-        caregiver.save_to_db()
-    except pymssql.Error as e:
+        if not caregiver.save_to_db():
+            # taken since the check, e.g. by a concurrent sign-up
+            print("Username taken, try again!")
+            return
+    except DBError as e:
         print("Failed to create user.")
         print("Db-Error:", e)
-        quit()
+        return
     except Exception as e:
         print("Failed to create user.")
         print(e)
@@ -146,21 +149,16 @@ def create_caregiver(tokens):
     print("Created user ", username)
 
 
+@retryable
 def username_exists_caregiver(username):
-    cm = ConnectionManager()
+    cm = ConnectionManager(read_only=True)
     conn = cm.create_connection()
 
-    select_username = "SELECT * FROM Caregivers WHERE Username = %s"
     try:
-        cursor = conn.cursor(as_dict=True)
-        cursor.execute(select_username, username)
-        #  returns false if the cursor is not before the first record or if there are no rows in the ResultSet.
-        for row in cursor:
-            return row['Username'] is not None
-    except pymssql.Error as e:
-        print("Error occurred when checking username")
-        print("Db-Error:", e)
-        quit()
+        return Repository.caregiver_exists.one(conn, (username,)) is not None
+    except DBError:
+        # reported by dispatch(), after any retries
+        raise
     except Exception as e:
         print("Error occurred when checking username")
         print("Error:", e)
@@ -169,17 +167,96 @@ def username_exists_caregiver(username):
     return False
 
 
-def login_patient(tokens):
+# commands that read and write files at paths the user names, which only the command line may run
+FILE_COMMANDS = ("import_users", "plan_campaign")
+
+
+def import_users(tokens, session):
+    # import_users <patient|caregiver> <csv file> [reject file]
+    # check 1: the length for tokens need to be 3 or 4 to include all information (with the operation name)
+    if len(tokens) not in (3, 4):
+        print("Please try again!")
+        return
+
+    kind = tokens[1]
+    csv_path = tokens[2]
+    reject_path = tokens[3] if len(tokens) == 4 else csv_path + ".rejects.csv"
+    if kind not in ("patient", "caregiver"):
+        print("User type must be patient or caregiver")
+        return
+
+    try:
+        imported, rejected = UserImport(kind).run(csv_path, reject_path)
+    except DBError as e:
+        print("Import failed.")
+        print("Db-Error:", e)
+        return
+    except Exception as e:
+        print("Import failed.")
+        print("Error:", e)
+        return
+    print(f"Imported {imported} {kind}(s), rejected {rejected}")
+    if rejected:
+        print("Rejected rows written to " + reject_path)
+
+
+def plan_campaign(tokens, session):
+    # plan_campaign <roster csv> [report file] [--commit]
+    # check 1: check if the current logged-in user is a caregiver
+    if session.current_caregiver is None:
+        print("Please login as a caregiver first!")
+        return
+
+    commit = "--commit" in tokens[1:]
+    tokens = [token for token in tokens if token != "--commit"]
+    # check 2: the length for tokens need to be 2 or 3 to include all information (with the operation name)
+    if len(tokens) not in (2, 3):
+        print("Please try again!")
+        return
+
+    csv_path = tokens[1]
+    report_path = tokens[2] if len(tokens) == 3 else csv_path + ".plan.csv"
+    try:
+        booked, unbooked, rejected = CampaignPlanner(csv_path, report_path).run(commit)
+    except CampaignError as e:
+        print("Campaign not booked.")
+        print(e)
+        return
+    except DBError as e:
+        print("Campaign failed.")
+        print("Db-Error:", e)
+        return
+    except Exception as e:
+        print("Campaign failed.")
+        print("Error:", e)
+        return
+    if commit:
+        print(f"Booked {booked} patient(s), {unbooked} without capacity, rejected {rejected}")
+    else:
+        print(f"Dry run: {booked} patient(s) can be booked, {unbooked} without capacity, rejected {rejected}")
+        print("Run again with --commit to book them")
+    print("Report written to " + report_path)
+
+
+def issue_token(kind, username, session):
+    # a session token for `resume`, which logs back in without the password
+    text, token = SessionTokens.issue(kind, username)
+    session.token = token
+    expires = datetime.datetime.fromtimestamp(token.expires).strftime("%Y-%m-%d %H:%M")
+    print("Session token (valid until " + expires + "): " + text)
+
+
+def login_patient(tokens, session):
     # TODO: Part 1
     # login_patient <username> <password>
     # check 1: if someone's already logged-in, they need to log out first
-    global current_patient
-    if current_caregiver is not None or current_patient is not None:
+    if session.current_caregiver is not None or session.current_patient is not None:
         print("User already logged in.")
         return
 
-    # check 2: the length for tokens need to be exactly 3 to include all information (with the operation name)
-    if len(tokens) != 3:
+    # check 2: the length for tokens need to be 3 to include all information (with the operation name),
+    # or 4 with --token
+    if len(tokens) not in (3, 4) or (len(tokens) == 4 and tokens[3] != "--token"):
         print("Login failed.")
         return
 
@@ -189,10 +266,10 @@ def login_patient(tokens):
     patient = None
     try:
         patient = Patient(username, password=password).get()
-    except pymssql.Error as e:
+    except DBError as e:
         print("Login failed.")
         print("Db-Error:", e)
-        quit()
+        return
     except Exception as e:
         print("Login failed.")
         print("Error:", e)
@@ -203,19 +280,21 @@ def login_patient(tokens):
         print("Login failed.")
     else:
         print("Logged in as: " + username)
-        current_patient = patient
+        session.current_patient = patient
+        if len(tokens) == 4:
+            issue_token("patient", username, session)
 
 
-def login_caregiver(tokens):
+def login_caregiver(tokens, session):
     # login_caregiver <username> <password>
     # check 1: if someone's already logged-in, they need to log out first
-    global current_caregiver
-    if current_caregiver is not None or current_patient is not None:
+    if session.current_caregiver is not None or session.current_patient is not None:
         print("User already logged in.")
         return
 
-    # check 2: the length for tokens need to be exactly 3 to include all information (with the operation name)
-    if len(tokens) != 3:
+    # check 2: the length for tokens need to be 3 to include all information (with the operation name),
+    # or 4 with --token
+    if len(tokens) not in (3, 4) or (len(tokens) == 4 and tokens[3] != "--token"):
         print("Login failed.")
         return
 
@@ -225,10 +304,10 @@ def login_caregiver(tokens):
     caregiver = None
     try:
         caregiver = Caregiver(username, password=password).get()
-    except pymssql.Error as e:
+    except DBError as e:
         print("Login failed.")
         print("Db-Error:", e)
-        quit()
+        return
     except Exception as e:
         print("Login failed.")
         print("Error:", e)
@@ -239,357 +318,636 @@ def login_caregiver(tokens):
         print("Login failed.")
     else:
         print("Logged in as: " + username)
-        current_caregiver = caregiver
+        session.current_caregiver = caregiver
+        if len(tokens) == 4:
+            issue_token("caregiver", username, session)
+
+
+def resume(tokens, session):
+    # resume <session token>: logs in as the user a login with --token issued the token to
+    if session.current_caregiver is not None or session.current_patient is not None:
+        print("User already logged in.")
+        return
+    if len(tokens) != 2:
+        print("Please try again!")
+        return
+
+    try:
+        token = SessionTokens.resume(tokens[1])
+    except DBError as e:
+        print("Login failed.")
+        print("Db-Error:", e)
+        return
+    if token is None:
+        print("Session token is invalid, expired or revoked, please log in again!")
+        return
+
+    if token.kind == "patient":
+        session.current_patient = Patient(token.username)
+    else:
+        session.current_caregiver = Caregiver(token.username)
+    session.token = token
+    print("Logged in as: " + token.username)
 
 
-def search_caregiver_schedule(tokens):
+def search_caregiver_schedule(tokens, session):
     # TODO: Part 2
-    # search_caregiver_schedule <date>
-    global current_patient
-    global current_caregiver
+    # search_caregiver_schedule <date> [<end date> | <HH:MM-HH:MM>]
     # check 1: if not logged in, they need to log in first
-    if current_caregiver is None and current_patient is None:
+    if session.current_caregiver is None and session.current_patient is None:
         print("Please login first")
         return
 
-    # check 2: the length for tokens need to be exactly 2 to include all information (with the operation name)
-    if len(tokens) != 2:
+    # check 2: the length for tokens need to be 2 or 3 to include all information (with the operation name)
+    if len(tokens) not in (2, 3):
         print("Please try again!")
         return
 
-    date = tokens[1]
-    # assume input is hyphenated in the format mm-dd-yyyy
-    date_tokens = date.split("-")
-    month = int(date_tokens[0])
-    day = int(date_tokens[1])
-    year = int(date_tokens[2])
+    end = None
+    window = (0, MINUTES_PER_DAY)
+    try:
+        d = parse_date(tokens[1])
+        if len(tokens) == 3 and ":" in tokens[2]:
+            window = parse_window(tokens[2])
+        elif len(tokens) == 3:
+            end = parse_date(tokens[2])
+    except ValueError:
+        print("Please enter a valid date!")
+        return
+    if end is not None and end < d:
+        print("Please enter an end date on or after the start date!")
+        return
 
-    # Retrieve available caregivers for the given date
-    get_caregivers = "SELECT Username FROM Availabilities WHERE Time = %s ORDER BY Username"
+    try:
+        if end is not None:
+            search_availability_range(d, end)
+            return False
+
+        # Retrieve the free slots for the given date and time window, and the vaccine inventory
+        free = slot_index.free_slots(d, lambda: load_free_slots(d), *window)
+        vaccines = read_cache.get(ReadCache.ALL_VACCINES, load_vaccines)
+
+        # Output the results: each available caregiver with their free slots
+        caregivers = {}
+        for slot, caregiver in free:
+            caregivers.setdefault(caregiver, []).append(format_slot(slot))
+        for caregiver in sorted(caregivers):
+            print(caregiver + " " + " ".join(caregivers[caregiver]))
+        for vaccine, doses in vaccines:
+            print(f"{vaccine} {doses}")
 
-    cm = ConnectionManager()
+    except DBError as e:
+        print("Please try again")
+        print("Db-Error:", e)
+        return
+    except Exception as e:
+        print("Please try again")
+        print("Error:", e)
+    return False
+
+
+def search_availability_range(start, end):
+    # one row per date with any free slot in [start, end], counted in a single grouped query over
+    # the Availabilities primary key; the dose columns come from the vaccine inventory
+    counts = load_availability_counts(start, end)
+    vaccines = read_cache.get(ReadCache.ALL_VACCINES, load_vaccines)
+    if not counts:
+        print(f"No caregivers available between {start.strftime('%m-%d-%Y')} and {end.strftime('%m-%d-%Y')}")
+        return
+    lines = [" ".join(["Date", "Caregivers", "Slots"] + [vaccine for vaccine, _ in vaccines])]
+    doses = [str(doses) for _, doses in vaccines]
+    for time, caregivers, slots in counts:
+        lines.append(" ".join([time.strftime('%m-%d-%Y'), str(caregivers), str(slots)] + doses))
+    print("\n".join(lines))
+
+
+@retryable
+def load_availability_counts(start, end):
+    cm = ConnectionManager(read_only=True)
     conn = cm.create_connection()
     try:
-        cursor = conn.cursor(as_dict=True)
-        d = datetime.datetime(year, month, day)
-        cursor.execute(get_caregivers, d)
-        caregivers = [row['Username'] for row in cursor]
+        return Repository.availability_counts.all(conn, (start, end))
+    finally:
+        cm.close_connection()
 
-        get_vaccines = "SELECT Name, Doses FROM Vaccines"
-        cursor.execute(get_vaccines)
-        vaccines = [(row['Name'], row['Doses']) for row in cursor]
 
-        # Output the results
-        for caregiver in caregivers:
-            print(caregiver)
-        for vaccine, doses in vaccines:
-            print(f"{vaccine} {doses}")
+def next_available(tokens, session):
+    # next_available <vaccine> [after]
+    # check 1: if not logged in, they need to log in first
+    if session.current_caregiver is None and session.current_patient is None:
+        print("Please login first")
+        return
 
-    except IndexError:
-        print("Please try again")
-    except pymssql.Error as e:
+    # check 2: the length for tokens need to be 2 or 3 to include all information (with the operation name)
+    if len(tokens) not in (2, 3):
+        print("Please try again!")
+        return
+
+    vaccine_name = tokens[1]
+    try:
+        after = parse_date(tokens[2]) if len(tokens) == 3 else None
+    except ValueError:
+        print("Please enter a valid date!")
+        return
+
+    # earliest date strictly after `after`, or from today on when it is omitted
+    if after is None:
+        find_date = Repository.next_slot_from
+        after = datetime.date.today()
+    else:
+        find_date = Repository.next_slot_after
+
+    try:
+        doses = dict(read_cache.get(ReadCache.ALL_VACCINES, load_vaccines)).get(vaccine_name)
+        if doses is None:
+            print("Please try again!")
+            print("Vaccine not found!")
+            return
+        if doses <= 0:
+            print("Not enough available doses!")
+            return
+
+        found = find_next_available(find_date, after)
+        if found is None:
+            print("No caregiver is available!")
+            return
+        print(f"Next available date for {vaccine_name}: {found.time.strftime('%m-%d-%Y')} {format_slot(found.slot)}")
+
+    except DBError as e:
         print("Please try again")
         print("Db-Error:", e)
-        quit()
+        return
     except Exception as e:
         print("Please try again")
         print("Error:", e)
+
+
+@retryable
+def find_next_available(find_date, after):
+    # a single seek on the Availabilities primary key (Time, Username, Slot)
+    cm = ConnectionManager(read_only=True)
+    conn = cm.create_connection()
+    try:
+        rows = find_date.all(conn, (after,), count=1)
+        return rows[0] if rows else None
     finally:
         cm.close_connection()
-    return False
 
-def reserve(tokens):
+
+@retryable
+def load_free_slots(d):
+    cm = ConnectionManager(read_only=True, cached=True)
+    conn = cm.create_connection()
+    try:
+        return Repository.free_slots.all(conn, (d,))
+    finally:
+        cm.close_connection()
+
+
+@retryable
+def load_vaccines():
+    cm = ConnectionManager(read_only=True, cached=True)
+    conn = cm.create_connection()
+    try:
+        return tuple(Repository.vaccine_balances.all(conn))
+    finally:
+        cm.close_connection()
+
+def reserve(tokens, session):
     """
     TODO: Part 2
     """
-    #  reserve <date> <vaccine>
-    global current_patient
-    global current_caregiver
+    #  reserve <date> [<HH:MM>] <vaccine> [idempotency key]
     # check 1: if not logged in, they need to log in first
-    if current_caregiver is None and current_patient is None:
+    if session.current_caregiver is None and session.current_patient is None:
         print("Please login first")
         return
     # check 2: check if the current logged-in user is a patient
-    if current_patient is None and current_caregiver is not None:
+    if session.current_patient is None and session.current_caregiver is not None:
         print("Please login as a patient first!")
         return
 
-    # check 3: the length for tokens need to be exactly 3 to include all information (with the operation name)
-    if len(tokens) != 3:
+    # check 3: the length for tokens need to be 3 to 5 to include all information (with the operation name)
+    slot = None
+    if len(tokens) > 2 and TIME.match(tokens[2]):
+        try:
+            slot = parse_time(tokens[2])
+        except ValueError:
+            print("Please enter a valid time!")
+            return
+        tokens = tokens[:2] + tokens[3:]
+    if len(tokens) not in (3, 4):
         print("Please try again!")
         return
 
-    date = tokens[1]
+    try:
+        d = parse_date(tokens[1])
+    except ValueError:
+        print("Please enter a valid date!")
+        return
     vaccine_name = tokens[2]
+    idempotency_key = tokens[3] if len(tokens) == 4 else None
+
+    try:
+        reservation = Reservation(session.current_patient.username, vaccine_name, d,
+                                  slot=slot).save_to_db(idempotency_key)
+    except ReservationError as e:
+        print(e)
+        if e.capacity:
+            print(f"To be booked as soon as there is capacity: waitlist {tokens[1]} {vaccine_name}")
+        return
+    except DBError as e:
+        print("Please try again")
+        print("Db-Error:", e)
+        return
+    except Exception as e:
+        print("Please try again")
+        print("Error:", e)
+        return
+
+    # Output the results
+    print(reservation.get_outcome())
+
+
+def parse_date(date):
     # assume input is hyphenated in the format mm-dd-yyyy
     date_tokens = date.split("-")
+    if len(date_tokens) != 3:
+        raise ValueError("Invalid date " + date)
     month = int(date_tokens[0])
     day = int(date_tokens[1])
     year = int(date_tokens[2])
+    return datetime.date(year, month, day)
+
+
+TIME = re.compile(r"^\d{1,2}:\d{2}$")
+
+
+def parse_time(time, latest=MINUTES_PER_DAY - 1):
+    # HH:MM, as minutes after midnight
+    if not TIME.match(time):
+        raise ValueError("Invalid time " + time)
+    hours, minutes = (int(part) for part in time.split(":"))
+    if minutes >= 60 or hours * 60 + minutes > latest:
+        raise ValueError("Invalid time " + time)
+    return hours * 60 + minutes
+
+
+def parse_window(window):
+    # HH:MM-HH:MM, as (start, end) minutes after midnight; the end may be 24:00
+    times = window.split("-")
+    if len(times) != 2:
+        raise ValueError("Invalid time window " + window)
+    start, end = parse_time(times[0]), parse_time(times[1], latest=MINUTES_PER_DAY)
+    if end <= start:
+        raise ValueError("Invalid time window " + window)
+    return start, end
+
+
+def parse_slot_options(tokens):
+    # splits off [--window HH:MM-HH:MM] [--slot <minutes>], defaulting to the AvailabilityWindow and SlotMinutes
+    # environment variables; returns the remaining tokens and the slot starts the window holds
+    options = {"--window": os.getenv("AvailabilityWindow", "09:00-17:00"), "--slot": os.getenv("SlotMinutes", "15")}
+    rest = []
+    i = 0
+    while i < len(tokens):
+        if tokens[i] in options:
+            if i + 1 == len(tokens):
+                raise ValueError("Missing value for " + tokens[i])
+            options[tokens[i]] = tokens[i + 1]
+            i += 2
+        else:
+            rest.append(tokens[i])
+            i += 1
+    start, end = parse_window(options["--window"])
+    length = int(options["--slot"])
+    if length <= 0 or length > end - start:
+        raise ValueError("Invalid slot length " + options["--slot"])
+    return rest, list(range(start, end - length + 1, length))
 
-    # Retrieve available caregivers for the given date
-    get_caregivers = "SELECT Username FROM Availabilities WHERE Time = %s ORDER BY Username"
 
-    cm = ConnectionManager()
-    conn = cm.create_connection()
+def upload_availability(tokens, session):
+    #  upload_availability <date> [<date> ...] [--window HH:MM-HH:MM] [--slot <minutes>]
+    #  check 1: check if the current logged-in user is a caregiver
+    if session.current_caregiver is None:
+        print("Please login as a caregiver first!")
+        return
 
     try:
-        cursor = conn.cursor(as_dict=True)
-        d = datetime.datetime(year, month, day)
-        cursor.execute(get_caregivers, d)
-        caregivers = [row['Username'] for row in cursor]
-        if not caregivers:
-            print("No caregiver is available")
-            return
-
-        # Check vaccine availability
-        select_vaccines = "SELECT Doses FROM Vaccines WHERE Name = %s"
-        cursor.execute(select_vaccines, vaccine_name)
-        vaccine = cursor.fetchone()
-        if not vaccine or vaccine['Doses'] <= 0:
-            print("Not enough available doses")
-            return
-
-        # Choose the caregiver by alphabetical order
-        selected_caregiver = caregivers[0]
-
-        # Create a reservation
-        insert_reservation = "INSERT INTO Reservations (Patient_Name, Caregiver_Name, Vaccine_Name, Reservation_Time) VALUES (%s, %s, %s, %s)"
-
-        cursor.execute(insert_reservation, (current_patient.username, selected_caregiver, vaccine_name, d))
-        conn.commit()
-
-        # Update caregiver availability and vaccine doses
-        delete_availability = "DELETE FROM Availabilities WHERE Username = %s AND Time = %s"
-        cursor.execute(delete_availability, (selected_caregiver, d))
+        tokens, slots = parse_slot_options(tokens)
+    except ValueError:
+        print("Please enter a valid time window and slot length!")
+        return
 
-        update_vaccine = "UPDATE Vaccines SET Doses = Doses - 1 WHERE Name = %s"
-        cursor.execute(update_vaccine, vaccine_name)
-        conn.commit()
+    # check 2: the tokens need to include at least one date (with the operation name)
+    if len(tokens) < 2:
+        print("Please try again!")
+        return
 
-        # Get the reservation ID
-        cursor.execute("SELECT SCOPE_IDENTITY() AS id")
-        reservation_id = cursor.fetchone()['id']
+    try:
+        dates = [parse_date(date) for date in tokens[1:]]
+    except ValueError:
+        print("Please enter a valid date!")
+        return
+    save_availabilities(dates, slots, session)
 
-        # Output the results
-        print(f"Appointment ID {reservation_id}, Caregiver username {selected_caregiver}")
 
-    except IndexError:
-        print("Please try again")
-    except pymssql.Error as e:
-        print("Please try again")
-        print("Db-Error:", e)
-        quit()
-    except Exception as e:
-        print("Please try again")
-        print("Error:", e)
-    finally:
-        cm.close_connection()
-    return False
+WEEKDAYS = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
 
 
-def upload_availability(tokens):
-    #  upload_availability <date>
+def upload_availability_range(tokens, session):
+    #  upload_availability_range <start date> <end date> [weekdays, e.g. mon,wed,fri]
+    #                            [--window HH:MM-HH:MM] [--slot <minutes>]
     #  check 1: check if the current logged-in user is a caregiver
-    global current_caregiver
-    if current_caregiver is None:
+    if session.current_caregiver is None:
         print("Please login as a caregiver first!")
         return
 
-    # check 2: the length for tokens need to be exactly 2 to include all information (with the operation name)
-    if len(tokens) != 2:
+    try:
+        tokens, slots = parse_slot_options(tokens)
+    except ValueError:
+        print("Please enter a valid time window and slot length!")
+        return
+
+    # check 2: the length for tokens need to be 3 or 4 to include all information (with the operation name)
+    if len(tokens) not in (3, 4):
         print("Please try again!")
         return
 
-    date = tokens[1]
-    # assume input is hyphenated in the format mm-dd-yyyy
-    date_tokens = date.split("-")
-    month = int(date_tokens[0])
-    day = int(date_tokens[1])
-    year = int(date_tokens[2])
     try:
-        d = datetime.datetime(year, month, day)
-        current_caregiver.upload_availability(d)
-    except pymssql.Error as e:
-        print("Upload Availability Failed")
-        print("Db-Error:", e)
-        quit()
+        start_date = parse_date(tokens[1])
+        end_date = parse_date(tokens[2])
     except ValueError:
         print("Please enter a valid date!")
         return
+    if end_date < start_date:
+        print("The end date must not be before the start date!")
+        return
+
+    weekdays = set(range(7))
+    if len(tokens) == 4:
+        names = tokens[3].lower().split(",")
+        if not all(name in WEEKDAYS for name in names):
+            print("Weekdays must be a comma separated list of: " + ",".join(WEEKDAYS))
+            return
+        weekdays = {WEEKDAYS.index(name) for name in names}
+
+    dates = []
+    d = start_date
+    while d <= end_date:
+        if d.weekday() in weekdays:
+            dates.append(d)
+        d += datetime.timedelta(days=1)
+    if not dates:
+        print("No dates in that range fall on the given weekdays")
+        return
+    save_availabilities(dates, slots, session)
+
+
+def save_availabilities(dates, slots, session):
+    try:
+        added, present = session.current_caregiver.upload_availabilities(dates, slots)
+    except DBError as e:
+        print("Upload Availability Failed")
+        print("Db-Error:", e)
+        return
     except Exception as e:
         print("Error occurred when uploading availability")
         print("Error:", e)
         return
     print("Availability uploaded!")
+    print(f"{added} slot(s) added, {present} already present")
+    if added:
+        match_waitlist(dates=dates)
 
 
-def cancel(tokens):
+def cancel(tokens, session):
     # TODO: Extra Credit
-    global current_patient
-    global current_caregiver
+    #  cancel <appointment_id> [idempotency key]
     # check 1: if not logged in, they need to log in first
-    if current_caregiver is None and current_patient is None:
+    if session.current_caregiver is None and session.current_patient is None:
         print("Please login first")
         return
 
-    #  check 2: the length for tokens need to be exactly 2 to include all information (with the operation name)
-    if len(tokens) != 2:
+    #  check 2: the length for tokens need to be 2 or 3 to include all information (with the operation name)
+    if len(tokens) not in (2, 3):
         print("Please try again!")
         return
 
-    id = int(tokens[1])
-
-    cm = ConnectionManager()
-    conn = cm.create_connection()
     try:
-        cursor = conn.cursor(as_dict=True)
-        # Retrieve the appointment details
-        get_appointment = "SELECT ID, Patient_Name, Caregiver_Name, Vaccine_Name, Reservation_Time FROM Reservations WHERE ID = %s"
-        cursor.execute(get_appointment, id)
-        appointment = cursor.fetchone()
-        if not appointment:
-            print("Please try again")
-            print("Error: Appointment not found")
-            return
-
-        # Ensure the logged-in user is authorized to cancel the appointment
-        if current_caregiver is not None and appointment['Caregiver_Name'] != current_caregiver.username:
-            print("Please try again")
-            print("Error: Unauthorized action")
-            return
-
-        if current_patient is not None and appointment['Patient_Name'] != current_patient.username:
-            print("Please try again")
-            print("Error: Unauthorized action")
-            return
-
-        # Delete the appointment
-        delete_appointment = "DELETE FROM Reservations WHERE ID = %s"
-        cursor.execute(delete_appointment, id)
-
-        # Update caregiver availability
-        insert_availability_query = "INSERT INTO Availabilities (Time, Username) VALUES (%s, %s)"
-        cursor.execute(insert_availability_query, (appointment['Reservation_Time'], appointment['Caregiver_Name']))
-
-        # Update vaccine doses
-        update_vaccine = "UPDATE Vaccines SET Doses = Doses + 1 WHERE Name = %s"
-        cursor.execute(update_vaccine, appointment['Vaccine_Name'])
-        conn.commit()
-
-        # Output the results
-        print(f"Appointment {id} canceled successfully")
+        id = int(tokens[1])
+    except ValueError:
+        print("Please try again!")
+        return
+    idempotency_key = tokens[2] if len(tokens) == 3 else None
+    username = session.current_caregiver.username if session.current_caregiver is not None \
+        else session.current_patient.username
 
-    except IndexError:
+    try:
+        outcome, appointment = Reservation.cancel(id, username, caregiver=session.current_caregiver is not None,
+                                                  idempotency_key=idempotency_key)
+    except ReservationError as e:
         print("Please try again")
-    except pymssql.Error as e:
+        print("Error:", e)
+        return
+    except DBError as e:
         print("Please try again")
         print("Db-Error:", e)
-        quit()
+        return
     except Exception as e:
         print("Please try again")
         print("Error:", e)
-    finally:
-        cm.close_connection()
-    return False
+        return
+
+    # Output the results
+    print(outcome)
+    if appointment is not None:
+        match_waitlist(dates=[appointment.reservation_time], vaccines=[appointment.vaccine_name])
 
 
-def add_doses(tokens):
-    #  add_doses <vaccine> <number>
+def add_doses(tokens, session):
+    #  add_doses <vaccine> <number> [<vaccine> <number> ...]
     #  check 1: check if the current logged-in user is a caregiver
-    global current_caregiver
-    if current_caregiver is None:
+    if session.current_caregiver is None:
         print("Please login as a caregiver first!")
         return
 
-    #  check 2: the length for tokens need to be exactly 3 to include all information (with the operation name)
-    if len(tokens) != 3:
+    #  check 2: the tokens need to include one or more vaccine and number pairs (with the operation name)
+    if len(tokens) < 3 or len(tokens) % 2 != 1:
         print("Please try again!")
         return
 
-    vaccine_name = tokens[1]
-    doses = int(tokens[2])
-    vaccine = None
     try:
-        vaccine = Vaccine(vaccine_name, doses).get()
-    except pymssql.Error as e:
+        receipts = [(tokens[i], int(tokens[i + 1])) for i in range(1, len(tokens), 2)]
+    except ValueError:
+        print("Please try again!")
+        return
+
+    # record every (vaccine, doses) pair in one transaction; vaccines not found in the database are added
+    try:
+        Vaccine.receive_doses(receipts)
+    except DBError as e:
         print("Error occurred when adding doses")
         print("Db-Error:", e)
-        quit()
+        return
     except Exception as e:
         print("Error occurred when adding doses")
         print("Error:", e)
         return
+    print("Doses updated!")
+    match_waitlist(vaccines=[vaccine_name for vaccine_name, _ in receipts])
+
+
+def waitlist(tokens, session):
+    #  waitlist [<date> [<end date>] <vaccine>]
+    #  check 1: check if the current logged-in user is a patient
+    if session.current_patient is None:
+        print("Please login as a patient first!")
+        return
 
-    # if the vaccine is not found in the database, add a new (vaccine, doses) entry.
-    # else, update the existing entry by adding the new doses
-    if vaccine is None:
-        vaccine = Vaccine(vaccine_name, doses)
+    # without arguments, list the patient's waiting entries
+    if len(tokens) == 1:
         try:
-            vaccine.save_to_db()
-        except pymssql.Error as e:
-            print("Error occurred when adding doses")
+            entries = Waitlist.entries(session.current_patient.username)
+        except DBError as e:
+            print("Please try again")
             print("Db-Error:", e)
-            quit()
-        except Exception as e:
-            print("Error occurred when adding doses")
-            print("Error:", e)
             return
-    else:
-        # if the vaccine is not null, meaning that the vaccine already exists in our table
-        try:
-            vaccine.increase_available_doses(doses)
-        except pymssql.Error as e:
-            print("Error occurred when adding doses")
-            print("Db-Error:", e)
-            quit()
-        except Exception as e:
-            print("Error occurred when adding doses")
-            print("Error:", e)
+        if not entries:
+            print("You are not on any waitlist")
+        for entry in entries:
+            print(f"{entry.id} {entry.vaccine_name} {entry.from_date.strftime('%m-%d-%Y')} "
+                  f"{entry.to_date.strftime('%m-%d-%Y')}")
+        return
+
+    #  check 2: the length for tokens need to be 3 or 4 to include all information (with the operation name)
+    if len(tokens) not in (3, 4):
+        print("Please try again!")
+        return
+
+    try:
+        from_date = parse_date(tokens[1])
+        to_date = parse_date(tokens[2]) if len(tokens) == 4 else from_date
+    except ValueError:
+        print("Please enter a valid date!")
+        return
+    if to_date < from_date:
+        print("The end date must not be before the start date!")
+        return
+    vaccine_name = tokens[-1]
+
+    entry = Waitlist(session.current_patient.username, vaccine_name, from_date, to_date)
+    try:
+        if not entry.save_to_db():
+            print(f"You are already on the waitlist for {vaccine_name} on those dates, entry {entry.get_id()}")
             return
-    print("Doses updated!")
+        # serve it right away if there is capacity, after anyone who was waiting before
+        matched = Waitlist.match(dates=[from_date, to_date], vaccines=[vaccine_name])
+    except ReservationError as e:
+        print("Please try again!")
+        print(e)
+        return
+    except DBError as e:
+        print("Please try again")
+        print("Db-Error:", e)
+        return
+    except Exception as e:
+        print("Please try again")
+        print("Error:", e)
+        return
 
+    for matched_entry, reservation in matched:
+        if matched_entry.id == entry.id:
+            print(reservation.get_outcome())
+            return
+    print(f"Added to the waitlist for {vaccine_name}, entry {entry.get_id()}")
 
-def show_appointments(tokens):
+
+def match_waitlist(dates=(), vaccines=()):
+    # books waiting patients into capacity the current command has just created
+    try:
+        matched = Waitlist.match(dates, vaccines)
+    except DBError as e:
+        print("Waitlist matching failed")
+        print("Db-Error:", e)
+        return
+    if matched:
+        print(f"Booked {len(matched)} patient(s) from the waitlist")
+
+
+# rows per keyset page of show_appointments, and per fetchmany() within a page
+APPOINTMENT_PAGE_SIZE = 500
+APPOINTMENT_FETCH_SIZE = 100
+
+
+def show_appointments(tokens, session):
     # TODO: Part 2
-    global current_patient
-    global current_caregiver
+    # show_appointments [--from <date>] [--to <date>] [--limit <number>] [--after <appointment_id>]
     # check : if not logged in, they need to log in first
-    if current_caregiver is None and current_patient is None:
+    if session.current_caregiver is None and session.current_patient is None:
         print("Please login first")
         return
 
-    cm = ConnectionManager()
+    options = {"--from": None, "--to": None, "--limit": None, "--after": None}
+    try:
+        if len(tokens) % 2 != 1:
+            raise ValueError("expected --option value pairs")
+        for i in range(1, len(tokens), 2):
+            if tokens[i] not in options:
+                raise ValueError("unknown option " + tokens[i])
+            options[tokens[i]] = tokens[i + 1]
+        from_date = parse_date(options["--from"]) if options["--from"] else None
+        to_date = parse_date(options["--to"]) if options["--to"] else None
+        limit = int(options["--limit"]) if options["--limit"] else None
+        last_id = int(options["--after"]) if options["--after"] else 0
+        if limit is not None and limit <= 0:
+            raise ValueError("--limit must be positive")
+    except ValueError:
+        print("Please try again!")
+        return
+
+    if session.current_caregiver is not None:
+        # Caregiver is logged in: list their patients
+        user_column, other_column, username = "Caregiver_Name", "Patient_Name", session.current_caregiver.username
+    else:
+        # Patient is logged in: list their caregivers
+        user_column, other_column, username = "Patient_Name", "Caregiver_Name", session.current_patient.username
+    show_appointments_page = Repository.appointments_page(user_column, other_column, from_date is not None,
+                                                          to_date is not None)
+    filters = tuple(d for d in (from_date, to_date) if d is not None)
+
+    cm = ConnectionManager(read_only=True)
     conn = cm.create_connection()
+    shown = 0
     try:
-        cursor = conn.cursor(as_dict=True)
-        if current_caregiver is not None:
-            # Caregiver is logged in
-            show_appointments_caregiver = "SELECT ID, Vaccine_Name, Reservation_Time, Patient_Name FROM Reservations WHERE Caregiver_Name = %s ORDER BY ID"
-            cursor.execute(show_appointments_caregiver, current_caregiver.username)
-            appointments = cursor.fetchall()
-            if not appointments:
-                print("No appointments found")
-                return
-            # Output the caregiver's appointments
-            for appointment in appointments:
-                print(f"{appointment['ID']} {appointment['Vaccine_Name']} "
-                        f"{appointment['Reservation_Time'].strftime('%m-%d-%Y')} {appointment['Patient_Name']}")
-
-        elif current_patient is not None:
-            # Patient is logged in
-            show_appointments_patient = "SELECT ID, Vaccine_Name, Reservation_Time, Caregiver_Name FROM Reservations WHERE Patient_Name = %s ORDER BY ID"
-            cursor.execute(show_appointments_patient, current_patient.username)
-            appointments = cursor.fetchall()
-            if not appointments:
-                print("No appointments found")
-                return
-            # Output the patient's appointments
-            for appointment in appointments:
-                print(f"{appointment['ID']} {appointment['Vaccine_Name']} "
-                        f"{appointment['Reservation_Time'].strftime('%m-%d-%Y')} {appointment['Caregiver_Name']}")
-
-    except pymssql.Error as db_error:
+        # keyset pagination on ID: each page starts after the last ID shown, so no page rereads earlier rows
+        while limit is None or shown < limit:
+            page_size = APPOINTMENT_PAGE_SIZE if limit is None else min(APPOINTMENT_PAGE_SIZE, limit - shown)
+            page_rows = 0
+            lines = []
+            for appointment in show_appointments_page.each(conn, (username, last_id) + filters, count=page_size,
+                                                           size=APPOINTMENT_FETCH_SIZE):
+                lines.append(f"{appointment.id} {appointment.vaccine_name} "
+                             f"{appointment.reservation_time.strftime('%m-%d-%Y')} {format_slot(appointment.slot)} "
+                             f"{appointment.other_name}")
+                last_id = appointment.id
+                page_rows += 1
+            if lines:
+                # Output the page of appointments in one write
+                print("\n".join(lines))
+            shown += page_rows
+            if page_rows < page_size:
+                break
+        else:
+            # stopped at --limit; check whether there is more to show
+            if show_appointments_page.all(conn, (username, last_id) + filters, count=1):
+                print(f"More appointments: show_appointments --after {last_id}"
+                      + "".join(f" {option} {value}" for option, value in options.items()
+                                if value is not None and option in ("--from", "--to", "--limit")))
+        if shown == 0:
+            print("No appointments found")
+
+    except DBError as db_error:
         print("Please try again")
         print("Database Error:", db_error)
     except Exception as e:
@@ -599,40 +957,75 @@ def show_appointments(tokens):
         cm.close_connection()
 
 
-def logout(tokens):
+def logout(tokens, session):
     # TODO: Part 2
-    global current_patient
-    global current_caregiver
     # check: if not logged in, they need to log in first
-    if current_caregiver is None and current_patient is None:
+    if session.current_caregiver is None and session.current_patient is None:
         print("Please login first")
     else:
         try:
-            current_caregiver = None
-            current_patient = None
+            # the session's token, if any, must not log anyone back in
+            if session.token is not None:
+                SessionTokens.revoke(session.token)
+                session.token = None
+            session.current_caregiver = None
+            session.current_patient = None
             print("Successfully logged out")
         except Exception as e:
             print("Please try again")
             print("Error:", e)
 
 
-def start():
-    stop = False
+def stats(tokens, session):
+    # stats: latency percentiles per command since start, and the pool, hash executor and cache counters
+    # stats sql [N]: the N statements (default 20) that took the most database time, see db.SQLTrace
+    if len(tokens) == 1:
+        print("\n".join(metrics.report()))
+        return
+    if tokens[1] != "sql" or len(tokens) > 3:
+        print("Please try again!")
+        return
+    if not sql_trace.enabled:
+        print("SQL tracing is off (SQLTrace=0)")
+        return
+    try:
+        top = int(tokens[2]) if len(tokens) == 3 else 20
+    except ValueError:
+        print("Please enter a valid number of statements!")
+        return
+    print("\n".join(sql_trace.report(top)))
+
+
+def print_commands():
     print()
     print(" *** Please enter one of the following commands *** ")
     print("> create_patient <username> <password>")  # //TODO: implement create_patient (Part 1)
     print("> create_caregiver <username> <password>")
-    print("> login_patient <username> <password>")  # // TODO: implement login_patient (Part 1)
-    print("> login_caregiver <username> <password>")
-    print("> search_caregiver_schedule <date>")  # // TODO: implement search_caregiver_schedule (Part 2)
-    print("> reserve <date> <vaccine>")  # // TODO: implement reserve (Part 2)
-    print("> upload_availability <date>")
-    print("> cancel <appointment_id>")  # // TODO: implement cancel (extra credit)
-    print("> add_doses <vaccine> <number>")
-    print("> show_appointments")  # // TODO: implement show_appointments (Part 2)
+    print("> import_users <patient|caregiver> <csv file> [reject file]")
+    print("> plan_campaign <roster csv> [report file] [--commit]")
+    print("> login_patient <username> <password> [--token]")  # // TODO: implement login_patient (Part 1)
+    print("> login_caregiver <username> <password> [--token]")
+    print("> resume <session token>")
+    print("> search_caregiver_schedule <date> [<end date> | <HH:MM-HH:MM>]")  # // TODO: implement search_caregiver_schedule (Part 2)
+    print("> next_available <vaccine> [<after date>]")
+    print("> reserve <date> [<HH:MM>] <vaccine> [idempotency key]")  # // TODO: implement reserve (Part 2)
+    print("> waitlist [<date> [<end date>] <vaccine>]")
+    print("> upload_availability <date> [<date> ...] [--window HH:MM-HH:MM] [--slot <minutes>]")
+    print("> upload_availability_range <start date> <end date> [weekdays, e.g. mon,wed,fri] "
+          "[--window HH:MM-HH:MM] [--slot <minutes>]")
+    print("> cancel <appointment_id> [idempotency key]")  # // TODO: implement cancel (extra credit)
+    print("> add_doses <vaccine> <number> [<vaccine> <number> ...]")
+    print("> show_appointments [--from <date>] [--to <date>] [--limit <number>] [--after <appointment_id>]")  # // TODO: implement show_appointments (Part 2)
     print("> logout")  # // TODO: implement logout (Part 2)
+    print("> stats [sql [<number of statements>]]")
     print("> Quit")
     print()
+
+
+def start():
+    session = Session()
+    stop = False
+    print_commands()
     while not stop:
         response = ""
         print("> ", end='')
@@ -648,34 +1041,148 @@ def start():
         if len(tokens) == 0:
             ValueError("Please try again!")
             continue
-        operation = tokens[0]
-        if operation == "create_patient":
-            create_patient(tokens)
-        elif operation == "create_caregiver":
-            create_caregiver(tokens)
-        elif operation == "login_patient":
-            login_patient(tokens)
-        elif operation == "login_caregiver":
-            login_caregiver(tokens)
-        elif operation == "search_caregiver_schedule":
-            search_caregiver_schedule(tokens)
-        elif operation == "reserve":
-            reserve(tokens)
-        elif operation == "upload_availability":
-            upload_availability(tokens)
-        elif operation == "cancel":
-            cancel(tokens)
-        elif operation == "add_doses":
-            add_doses(tokens)
-        elif operation == "show_appointments":
-            show_appointments(tokens)
-        elif operation == "logout":
-            logout(tokens)
-        elif operation == "quit":
-            print("Bye!")
+        if not dispatch(tokens, session):
             stop = True
-        else:
-            print("Invalid operation name!")
+
+
+def dispatch(tokens, session):
+    """
+    Runs one command, timed into util.Metrics; returns False once the user asked to quit.
+
+    A database error gives up the command, not the session: the user stays
+    logged in and can try again, see db.Retry.
+    """
+    operation = tokens[0]
+    with metrics.command(operation) as command, ConnectionManager.for_session(session):
+        try:
+            return run_command(operation, tokens, session, command)
+        except DBError as e:
+            metrics.observe_failure()
+            print("Please try again")
+            print("Db-Error:", e)
+            return True
+
+
+def run_command(operation, tokens, session, command):
+    """The body of dispatch(): runs the command named by operation."""
+    if operation == "create_patient":
+        create_patient(tokens, session)
+    elif operation == "create_caregiver":
+        create_caregiver(tokens, session)
+    elif operation == "import_users":
+        import_users(tokens, session)
+    elif operation == "plan_campaign":
+        plan_campaign(tokens, session)
+    elif operation == "login_patient":
+        login_patient(tokens, session)
+    elif operation == "login_caregiver":
+        login_caregiver(tokens, session)
+    elif operation == "resume":
+        resume(tokens, session)
+    elif operation == "search_caregiver_schedule":
+        search_caregiver_schedule(tokens, session)
+    elif operation == "next_available":
+        next_available(tokens, session)
+    elif operation == "reserve":
+        reserve(tokens, session)
+    elif operation == "waitlist":
+        waitlist(tokens, session)
+    elif operation == "upload_availability":
+        upload_availability(tokens, session)
+    elif operation == "upload_availability_range":
+        upload_availability_range(tokens, session)
+    elif operation == "cancel":
+        cancel(tokens, session)
+    elif operation == "add_doses":
+        add_doses(tokens, session)
+    elif operation == "show_appointments":
+        show_appointments(tokens, session)
+    elif operation == "logout":
+        logout(tokens, session)
+    elif operation == "stats":
+        stats(tokens, session)
+    elif operation == "quit":
+        print("Bye!")
+        return False
+    else:
+        command.discard()
+        print("Invalid operation name!")
+    return True
+
+
+def run_batch(stream, group_size=1):
+    """
+    Runs every command line from stream over one pinned connection, without prompts.
+
+    Write commands are committed in groups of group_size; a command that fails
+    is rolled back on its own and the batch carries on. Per-command timings and the overall rate are
+    reported on stderr at the end.
+    """
+    session = Session()
+    timings = {}
+    total = 0
+    failed = 0
+    started = time.perf_counter()
+    with ConnectionManager.pinned(group_size) as conn:
+        for line in stream:
+            response = line.rstrip("\r\n")
+            if not response.strip() or response.lstrip().startswith("#"):
+                continue
+            tokens = response.split(" ")
+            operation = tokens[0]
+            command_started = time.perf_counter()
+            failures = metrics.failures
+            keep_going = True
+            aborted = False
+            try:
+                conn.begin_command()
+                keep_going = dispatch(tokens, session)
+                conn.end_command()
+            except DBError as e:
+                # the connection was lost, or could not be replaced; the next command tries again
+                print("Please try again")
+                print("Db-Error:", e)
+                aborted = True
+            # a command that hit a database error was abandoned, and end_command() rolled it back
+            if aborted or metrics.failures > failures:
+                failed += 1
+            timings.setdefault(operation, []).append(time.perf_counter() - command_started)
+            total += 1
+            if not keep_going:
+                break
+    elapsed = time.perf_counter() - started
+
+    out = sys.stderr
+    print(file=out)
+    print(f"{'operation':<28}{'count':>8}{'total(s)':>10}{'mean(ms)':>10}{'max(ms)':>10}", file=out)
+    for operation, samples in sorted(timings.items()):
+        print(f"{operation:<28}{len(samples):>8}{sum(samples):>10.3f}"
+              f"{sum(samples) / len(samples) * 1000:>10.2f}{max(samples) * 1000:>10.2f}", file=out)
+    rate = total / elapsed if elapsed > 0 else 0.0
+    print(f"{total} commands in {elapsed:.3f}s ({rate:.1f} commands/s), {failed} aborted on database errors",
+          file=out)
+
+
+def migrate(action, target=None):
+    # migrate status|up|down, see db.Migrator
+    backend = ConnectionManager.get_backend()
+    # the SQLite backend would otherwise apply every pending migration on connecting, before a status or down
+    auto_migrate = getattr(backend, "auto_migrate", False)
+    if auto_migrate:
+        backend.auto_migrate = False
+    with ConnectionManager() as conn:
+        migrator = Migrator(backend, conn)
+        if action == "up":
+            applied = migrator.upgrade(target)
+            print("Applied migrations: " + (", ".join(map(str, applied)) or "none"))
+        elif action == "down":
+            rolled_back = migrator.downgrade(target if target is not None else migrator.current_version() - 1)
+            print("Rolled back migrations: " + (", ".join(map(str, rolled_back)) or "none"))
+            if rolled_back and auto_migrate:
+                print("Note: set DBAutoMigrate=0 to keep this version, otherwise the next start applies the "
+                      "rolled back migrations again")
+        for version, name, applied in migrator.status():
+            print(f"{version:04d} {name:<30} {'applied' if applied else 'pending'}")
 
 
 if __name__ == "__main__":
@@ -686,8 +1193,35 @@ if __name__ == "__main__":
     // and then construct a map of vaccineName -> vaccineObject
     '''
 
-    # start command line
-    print()
-    print("Welcome to the COVID-19 Vaccine Reservation Scheduling Application!")
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch", metavar="FILE",
+                        help="run the commands in FILE (- for stdin) non-interactively over one connection")
+    parser.add_argument("--group", type=int, default=1, metavar="N",
+                        help="in batch mode, commit write commands in transactions of N")
+    parser.add_argument("--serve", metavar="ADDRESS",
+                        help="serve many concurrent sessions on host:port or unix:/path instead of the terminal")
+    parser.add_argument("--migrate", choices=["status", "up", "down"],
+                        help="show, apply or roll back schema migrations, then exit")
+    parser.add_argument("--to", type=int, metavar="VERSION",
+                        help="with --migrate up/down, the schema version to stop at (down defaults to one step)")
+    args = parser.parse_args()
+    start_dump_from_env()
+
+    if args.migrate is not None:
+        migrate(args.migrate, args.to)
+    elif args.serve is not None:
+        Server(dispatch, greet=print_commands, local_only=FILE_COMMANDS).serve(args.serve)
+    elif args.batch is not None:
+        if args.batch == "-":
+            # a separate file object on fd 0, so that closing it leaves sys.stdin open
+            with open(sys.stdin.fileno(), closefd=False) as f:
+                run_batch(f, args.group)
+        else:
+            with open(args.batch) as f:
+                run_batch(f, args.group)
+    else:
+        # start command line
+        print()
+        print("Welcome to the COVID-19 Vaccine Reservation Scheduling Application!")
 
-    start()
+        start()
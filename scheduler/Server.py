@@ -0,0 +1,117 @@
+import asyncio
+import contextvars
+import io
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from Session import Session
+
+# where print() output of the command running in this context goes; None means the real stdout
+output = contextvars.ContextVar("output", default=None)
+
+
+class OutputRouter:
+    """Stands in for sys.stdout so the print() output of each command goes back to its own client."""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, text):
+        buffer = output.get()
+        return (self.stream if buffer is None else buffer).write(text)
+
+    def flush(self):
+        buffer = output.get()
+        (self.stream if buffer is None else buffer).flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+class Server:
+    """
+    Serves the command grammar to many terminals at once over TCP or a Unix socket.
+
+    Every client connection gets its own Session. Commands of one session run in
+    order, but commands of different sessions run concurrently: the asyncio loop
+    only does the socket I/O and hands each command, with its blocking database
+    and hashing work, to a thread pool of ServerWorkers threads (default 32).
+
+    The commands named in local_only are refused: they read or write files at
+    paths the client names, which would be the server's files.
+    """
+
+    def __init__(self, dispatch, greet=None, workers=None, local_only=()):
+        self.dispatch = dispatch
+        self.greet = greet
+        self.local_only = set(local_only)
+        self.executor = ThreadPoolExecutor(max_workers=workers or int(os.getenv("ServerWorkers", "32")),
+                                           thread_name_prefix="command")
+
+    def run_command(self, func, *args):
+        # runs on an executor thread; returns whether the session continues, and what the command printed
+        buffer = io.StringIO()
+        token = output.set(buffer)
+        try:
+            keep_going = func(*args) is not False
+        except Exception as e:
+            print("Please try again!")
+            print("Error:", e)
+            keep_going = True
+        finally:
+            output.reset(token)
+        return keep_going, buffer.getvalue()
+
+    async def handle(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        session = Session()
+        try:
+            if self.greet is not None:
+                _, text = await loop.run_in_executor(self.executor, self.run_command, self.greet)
+                writer.write(text.encode())
+            while True:
+                writer.write(b"> ")
+                await writer.drain()
+                line = await reader.readline()
+                if not line:
+                    break
+                tokens = line.decode("utf-8", "replace").rstrip("\r\n").split(" ")
+                if tokens[0] in self.local_only:
+                    writer.write((tokens[0] + " is not available over the server, run it from the command line\n")
+                                 .encode())
+                    continue
+                keep_going, text = await loop.run_in_executor(self.executor, self.run_command,
+                                                              self.dispatch, tokens, session)
+                writer.write(text.encode())
+                await writer.drain()
+                if not keep_going:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def serve_forever(self, address):
+        if address.startswith("unix:"):
+            server = await asyncio.start_unix_server(self.handle, path=address[len("unix:"):])
+        else:
+            host, _, port = address.rpartition(":")
+            server = await asyncio.start_server(self.handle, host=host or "127.0.0.1", port=int(port))
+        print("Listening on " + address)
+        async with server:
+            await server.serve_forever()
+
+    def serve(self, address):
+        """address is host:port, :port (localhost) or unix:/path/to/socket"""
+        sys.stdout = OutputRouter(sys.stdout)
+        try:
+            asyncio.run(self.serve_forever(address))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            sys.stdout = sys.stdout.stream
+            self.executor.shutdown(wait=False)
@@ -0,0 +1,14 @@
+class Session:
+    '''
+    objects to keep track of the user logged in at one terminal
+    Note: it is always true that at most one of current_caregiver and current_patient is not null
+            since only one user can be logged-in at a time per session
+    '''
+
+    def __init__(self):
+        self.current_patient = None
+        self.current_caregiver = None
+        # monotonic time of the session's last commit, so that its reads see its own writes, see db.Replicas
+        self.wrote_at = None
+        # the session token issued at login or resumed, revoked on logout, see db.SessionTokens
+        self.token = None
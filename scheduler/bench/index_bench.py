@@ -0,0 +1,142 @@
+"""
+Times the application's per-user queries without and with the indexes the migrations add.
+
+    python bench/index_bench.py --reservations 200000
+
+Builds a fresh SQLite database at the latest schema version and fills it, then drops the
+migrations' secondary indexes, times each query as db.Repository runs it, recreates the
+indexes and times them again. The slot queries (next_available and the free-slot load of
+reserve) seek the Availabilities primary key (Time, Username, Slot) from 0006_time_slots,
+which cannot be dropped, so they are expected to time the same both ways.
+"""
+import argparse
+import datetime
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# the app's page size for show_appointments, see Scheduler.APPOINTMENT_PAGE_SIZE
+PAGE_SIZE = 500
+# the slots each caregiver offers per day, in minutes after midnight
+SLOTS = (540, 570, 600, 630)
+
+
+def queries(Repository, IdempotencyKeys):
+    # (label, run(conn, rng)) per query, each run the way the command that owns it runs it
+    def purge(conn, rng):
+        conn.cursor().execute(IdempotencyKeys.purge_all, (rng.now - datetime.timedelta(days=1),))
+        conn.rollback()
+
+    return [
+        ("show_appointments (patient)",
+         lambda conn, rng: Repository.appointments_page("Patient_Name", "Caregiver_Name").all(
+             conn, (rng.choice(rng.patients), 0), count=PAGE_SIZE)),
+        ("show_appointments (caregiver)",
+         lambda conn, rng: Repository.appointments_page("Caregiver_Name", "Patient_Name").all(
+             conn, (rng.choice(rng.caregivers), 0), count=PAGE_SIZE)),
+        ("next_available",
+         lambda conn, rng: Repository.next_slot_from.all(conn, (rng.choice(rng.dates),), count=1)),
+        ("reserve (free-slot load)",
+         lambda conn, rng: Repository.free_slots.all(conn, (rng.choice(rng.dates[-180:]),))),
+        ("upload_availability (existing slots)",
+         lambda conn, rng: Repository.caregiver_slots.all(conn, (rng.choice(rng.caregivers), rng.dates[-60],
+                                                                  rng.dates[-30]) * 2)),
+        ("cancel (appointment lookup)",
+         lambda conn, rng: Repository.appointment.one(conn, (rng.randint(1, rng.reservations),))),
+        ("waitlist (entries)",
+         lambda conn, rng: Repository.waitlist_entries.all(conn, (rng.choice(rng.patients),))),
+        ("idempotency key purge", purge),
+    ]
+
+
+def time_queries(conn, rng, timed, repeats):
+    results = {}
+    for label, run in timed:
+        started = time.perf_counter()
+        for _ in range(repeats):
+            run(conn, rng)
+        results[label] = (time.perf_counter() - started) / repeats * 1000
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--caregivers", type=int, default=500)
+    parser.add_argument("--patients", type=int, default=20000)
+    parser.add_argument("--reservations", type=int, default=200000)
+    parser.add_argument("--repeats", type=int, default=50)
+    args = parser.parse_args()
+
+    os.environ["DBBackend"] = "sqlite"
+    os.environ["DBPath"] = os.path.join(tempfile.mkdtemp(), "bench.db")
+    os.environ["DBAutoMigrate"] = "0"
+    from db.ConnectionManager import ConnectionManager
+    from db.Migrator import Migrator
+    import db.IdempotencyKeys as IdempotencyKeys
+    import db.Repository as Repository
+
+    rng = random.Random(1)
+    rng.caregivers = ["cg%d" % i for i in range(args.caregivers)]
+    rng.patients = ["p%d" % i for i in range(args.patients)]
+    # the reserved slots, followed by half a year of open availability
+    days = -(-args.reservations // (args.caregivers * len(SLOTS))) + 180
+    rng.first_date = datetime.date(2030, 1, 1)
+    rng.dates = [rng.first_date + datetime.timedelta(days=i) for i in range(days)]
+    rng.reservations = args.reservations
+    rng.now = datetime.datetime(2030, 6, 1)
+    timed = queries(Repository, IdempotencyKeys)
+
+    with ConnectionManager() as conn:
+        Migrator(ConnectionManager.get_backend(), conn).upgrade()
+        cursor = conn.cursor()
+        Repository.add_patient.executemany(cursor, [(p, b"", b"", p) for p in rng.patients])
+        Repository.add_caregiver.executemany(cursor, [(c, b"", b"", c) for c in rng.caregivers])
+        cursor.execute("INSERT INTO Vaccines VALUES (%s, %d)", ("pfizer", 0))
+        slots = [(d, c, s) for d in rng.dates for c in rng.caregivers for s in SLOTS]
+        Repository.add_slot.executemany(cursor, slots[args.reservations:])
+        cursor.executemany("INSERT INTO Reservations (Patient_Name, Caregiver_Name, Vaccine_Name, Reservation_Time, "
+                           "Slot) VALUES (%s, %s, %s, %s, %d)",
+                           [(rng.choice(rng.patients), c, "pfizer", d, s) for d, c, s in slots[:args.reservations]])
+        cursor.executemany("INSERT INTO Waitlist (Patient_Name, Vaccine_Name, From_Date, To_Date, Created_At) "
+                           "VALUES (%s, %s, %s, %s, %s)",
+                           [(rng.choice(rng.patients), "pfizer", rng.dates[0], rng.dates[-1], rng.now)
+                            for _ in range(args.patients)])
+        # a day's keys and a little more, so the purge finds only the oldest few expired, as it does when it runs often
+        keys = args.reservations // 4
+        cursor.executemany("INSERT INTO IdempotencyKeys (Idempotency_Key, Username, Command, Outcome, Created_At) "
+                           "VALUES (%s, %s, %s, %s, %s)",
+                           [("k%d" % i, rng.choice(rng.patients), "reserve", "",
+                             rng.now - datetime.timedelta(days=1.05 * i / keys)) for i in range(keys)])
+        conn.commit()
+
+        # every index the migrations created, i.e. all but those SQLite makes for primary keys and UNIQUE
+        cursor.execute("SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL ORDER BY name")
+        indexes = cursor.fetchall()
+        for name, _ in indexes:
+            cursor.execute("DROP INDEX " + name)
+        conn.commit()
+
+        rng.seed(2)
+        before = time_queries(conn, rng, timed, args.repeats)
+        started = time.perf_counter()
+        for _, sql in indexes:
+            cursor.execute(sql)
+        conn.commit()
+        index_time = time.perf_counter() - started
+        rng.seed(2)
+        after = time_queries(conn, rng, timed, args.repeats)
+
+    print(f"{args.reservations} reservations, {args.caregivers} caregivers, {args.patients} patients; "
+          f"mean of {args.repeats} runs, building {len(indexes)} indexes ({', '.join(name for name, _ in indexes)}) "
+          f"took {index_time:.2f}s")
+    print(f"{'query':<40}{'without(ms)':>12}{'with(ms)':>12}{'speedup':>10}")
+    for label, _ in timed:
+        print(f"{label:<40}{before[label]:>12.3f}{after[label]:>12.3f}{before[label] / after[label]:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
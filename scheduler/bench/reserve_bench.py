@@ -0,0 +1,111 @@
+"""
+Measures reserve throughput under concurrent booking.
+
+    python bench/reserve_bench.py --threads 8 --caregivers 50 --dates 20
+
+Runs against a fresh SQLite database unless --use-env is given, in which case
+the DBBackend/DBPath (or Azure) settings from the environment are used and the
+bench data is added to that database. Prints bookings per second and checks
+that no caregiver slot or dose was handed out twice.
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--caregivers", type=int, default=50)
+    parser.add_argument("--dates", type=int, default=20)
+    parser.add_argument("--doses", type=int, default=None, help="default: one per caregiver slot")
+    parser.add_argument("--attempts", type=int, default=None, help="default: 1.2x the caregiver slots")
+    parser.add_argument("--use-env", action="store_true")
+    args = parser.parse_args()
+
+    if not args.use_env:
+        os.environ["DBBackend"] = "sqlite"
+        os.environ["DBPath"] = os.path.join(tempfile.mkdtemp(), "bench.db")
+    os.environ.setdefault("PoolSize", str(args.threads))
+
+    from db.ConnectionManager import ConnectionManager
+    from Session import Session
+    from model.Patient import Patient
+    import db.Repository as Repository
+    from util.Metrics import metrics
+    import Scheduler
+
+    slots = args.caregivers * args.dates
+    doses = args.doses if args.doses is not None else slots
+    attempts = args.attempts if args.attempts is not None else int(slots * 1.2)
+    prefix = "bench%d_" % os.getpid()
+    vaccine = prefix + "vaccine"
+    first_date = datetime.date(2030, 1, 1)
+    dates = [first_date + datetime.timedelta(days=i) for i in range(args.dates)]
+
+    with ConnectionManager() as conn:
+        cursor = conn.cursor()
+        cursor.executemany("INSERT INTO Caregivers VALUES (%s, %s, %s)",
+                           [(prefix + "cg%d" % i, b"\0" * 16, b"\0" * 16) for i in range(args.caregivers)])
+        cursor.executemany("INSERT INTO Patients VALUES (%s, %s, %s)",
+                           [(prefix + "p%d" % i, b"\0" * 16, b"\0" * 16) for i in range(args.threads)])
+        cursor.executemany("INSERT INTO Availabilities (Time, Username) VALUES (%s, %s)",
+                           [(d, prefix + "cg%d" % i) for d in dates for i in range(args.caregivers)])
+        cursor.execute("INSERT INTO Vaccines VALUES (%s, %d)", (vaccine, doses))
+        conn.commit()
+
+    remaining = [attempts]
+    lock = threading.Lock()
+
+    def worker(n):
+        session = Session()
+        session.current_patient = Patient(prefix + "p%d" % n)
+        rng = random.Random(n)
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            d = rng.choice(dates)
+            # through dispatch, so that a reserve a database error gave up on is counted as failed in util.Metrics
+            Scheduler.dispatch(["reserve", d.strftime("%m-%d-%Y"), vaccine], session)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(args.threads)]
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    elapsed = time.perf_counter() - started
+    with metrics.lock:
+        reserve_stats = metrics.commands.get("reserve")
+        errors = reserve_stats.failures if reserve_stats is not None else 0
+
+    with ConnectionManager() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM Reservations WHERE Vaccine_Name = %s", vaccine)
+        booked = cursor.fetchone()[0]
+        cursor.execute("SELECT COUNT(*) FROM Availabilities WHERE Username LIKE %s", prefix + "%")
+        left = cursor.fetchone()[0]
+        doses_left = Repository.vaccine_balance.one(conn, (vaccine,)).doses
+
+    print(f"{attempts} reserve attempts on {args.threads} threads in {elapsed:.3f}s "
+          f"({attempts / elapsed:.1f} attempts/s, {booked / elapsed:.1f} bookings/s)")
+    print(f"booked {booked}, aborted on database errors {errors}")
+    consistent = booked + left == slots and booked + doses_left == doses and doses_left >= 0
+    print("consistency: " + ("ok" if consistent else
+                             f"MISMATCH (slots {slots}, left {left}, doses {doses}, doses left {doses_left})"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,26 @@
+import os
+import sqlite3
+from db.MSSQLBackend import MSSQLBackend, pymssql
+from db.SQLiteBackend import SQLiteBackend
+
+
+class DatabaseUnavailable(Exception):
+    """Raised without trying the database while the circuit breaker is open, see db.Retry."""
+
+
+# catch this instead of a driver-specific error type: except DBError as e
+DBError = (sqlite3.Error, DatabaseUnavailable) if pymssql is None else (sqlite3.Error, pymssql.Error,
+                                                                        DatabaseUnavailable)
+
+BACKENDS = {
+    MSSQLBackend.name: MSSQLBackend,
+    SQLiteBackend.name: SQLiteBackend,
+}
+
+
+def get_backend():
+    """Builds the storage backend named by the DBBackend environment variable (default: mssql)."""
+    name = os.getenv("DBBackend", MSSQLBackend.name).lower()
+    if name not in BACKENDS:
+        raise ValueError("Unknown DBBackend " + name + ", expected one of: " + ", ".join(BACKENDS))
+    return BACKENDS[name]()
@@ -1,30 +1,463 @@
-import pymssql
+import functools
 import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from db.Backend import DBError, DatabaseUnavailable, get_backend
+from db.ConnectionPool import ConnectionPool
+from db.Replicas import BUMP_HEARTBEAT, GET_HEARTBEAT, Replica, ReplicaSet
+from db.Retry import CircuitBreaker, UNAVAILABLE, breaker, classify, retry_policy
+from db.SQLTrace import sql_trace
+from util.Metrics import metrics
 
 
 class ConnectionManager:
+    """
+    Borrows a connection from the process-wide pool.
 
-    def __init__(self):
-        self.server_name = os.getenv("Server") + ".database.windows.net"
-        self.db_name = os.getenv("DBName")
-        self.user = os.getenv("UserID")
-        self.password = os.getenv("Password")
+    Either call create_connection() / close_connection(), or use the manager as
+    a context manager:
+
+        with ConnectionManager() as conn:
+            ...
+
+    The storage backend behind the pool is chosen by the DBBackend environment
+    variable, see db.Backend. A connection that cannot be had is retried with
+    backoff, and refused outright while the circuit breaker is open; either way
+    the caller gets a DBError rather than the process exiting, see db.Retry.
+
+    A read_only manager reads from one of the replicas listed in DBReplicas
+    when one is current enough, see db.Replicas, and from the primary
+    otherwise: a replica must have caught up with the current session's last
+    commit, or with this process's last commit for a cached manager, whose
+    result is kept in a cache past the end of the command.
+    """
+
+    pool = None
+    backend = None
+    replica_set = None
+    # monotonic time of the last commit on the primary in this process, see committed()
+    last_commit = None
+    heartbeat_conn = None
+    pool_lock = threading.Lock()
+    # per-thread connection pinned by pinned(), handed out instead of pooled ones, and the session the
+    # thread is running a command for, see for_session()
+    local = threading.local()
+
+    def __init__(self, read_only=False, cached=False):
         self.conn = None
+        self.read_only = read_only
+        self.cached = cached
+        # the replica the last connection came from, None for the primary
+        self.replica = None
 
-    def create_connection(self):
+    @classmethod
+    def get_backend(cls):
+        with cls.pool_lock:
+            if cls.backend is None:
+                cls.backend = get_backend()
+            return cls.backend
+
+    @classmethod
+    def get_pool(cls):
+        backend = cls.get_backend()
+        with cls.pool_lock:
+            if cls.pool is None:
+                cls.pool = cls._new_pool(backend, breaker, cls.committed)
+                metrics.add_source("pool", cls.pool.stats)
+                sql_trace.set_backend(backend)
+            return cls.pool
+
+    @staticmethod
+    def _new_pool(backend, health, on_commit=None):
+        return ConnectionPool(
+            lambda: MeteredConnection(backend.connect(), per_row_executemany=backend.name == "mssql",
+                                      health=health, on_commit=on_commit),
+            max_size=int(os.getenv("PoolSize", "10")),
+            idle_timeout=float(os.getenv("PoolIdleTimeout", "300")),
+            health_check_interval=float(os.getenv("PoolHealthCheckInterval", "30")))
+
+    @classmethod
+    def get_replicas(cls):
+        """The replicas listed in the DBReplicas environment variable, comma separated, see db.Replicas."""
+        backend = cls.get_backend()
+        with cls.pool_lock:
+            if cls.replica_set is None:
+                replicas = []
+                for endpoint in os.getenv("DBReplicas", "").split(","):
+                    if endpoint.strip():
+                        replica = Replica(endpoint.strip(), backend.replica(endpoint.strip()))
+                        replica.pool = cls._new_pool(replica.backend, replica)
+                        replicas.append(replica)
+                cls.replica_set = ReplicaSet(replicas, max_lag=float(os.getenv("ReplicaMaxLag", "5")),
+                                             interval=float(os.getenv("ReplicaCheckInterval", "1")))
+                if replicas:
+                    metrics.add_source("replicas", cls.replica_set.stats)
+                    cls.replica_set.start(cls._beat)
+            return cls.replica_set
+
+    @classmethod
+    def _beat(cls):
+        # on a connection of its own: a heartbeat is not a commit readers need to see, see committed()
+        try:
+            if cls.heartbeat_conn is None:
+                cls.heartbeat_conn = cls.get_backend().connect()
+            cursor = cls.heartbeat_conn.cursor()
+            cursor.execute(BUMP_HEARTBEAT)
+            cursor.execute(GET_HEARTBEAT)
+            seq = cursor.fetchone()[0]
+            cls.heartbeat_conn.commit()
+            return seq
+        except DBError:
+            conn, cls.heartbeat_conn = cls.heartbeat_conn, None
+            if conn is not None:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+            raise
+
+    @classmethod
+    def committed(cls):
+        # a read that must see this commit waits for a replica current as of now, see _replica_connection()
+        now = time.monotonic()
+        cls.last_commit = now
+        session = getattr(cls.local, "session", None)
+        if session is not None:
+            session.wrote_at = now
+
+    @classmethod
+    @contextmanager
+    def for_session(cls, session):
+        """Attributes the commits made in the current thread to session until the block exits."""
+        outer = getattr(cls.local, "session", None)
+        cls.local.session = session
+        try:
+            yield session
+        finally:
+            cls.local.session = outer
+
+    @classmethod
+    @contextmanager
+    def pinned(cls, group_size=1):
+        """
+        Holds one pooled connection for the current thread until the block exits.
+
+        Every ConnectionManager created in this thread meanwhile shares it, and
+        their commits are grouped group_size at a time, see PinnedConnection.
+        """
+        pool = cls.get_pool()
+        conn = PinnedConnection(cls._acquire(pool), cls.get_backend(), group_size, pool)
+        cls.local.pinned = conn
         try:
-            self.conn = pymssql.connect(server=self.server_name, user=self.user, password=self.password, database=self.db_name)
-        except pymssql.Error as db_err:
-            print("Database Programming Error in SQL connection processing! ")
-            print(db_err)
-            quit()
+            yield conn
+            conn.flush()
+        finally:
+            cls.local.pinned = None
+            if conn.conn is not None:
+                pool.release(conn.conn, discard=conn.conn.broken)
+
+    @staticmethod
+    def _acquire(pool):
+        started = time.perf_counter()
+        attempt = 0
+        try:
+            while True:
+                try:
+                    breaker.check()
+                    # while the breaker is testing the database, a pooled connection must prove itself first;
+                    # an idle connection that fails its health check is simply replaced
+                    with metrics.handled_errors():
+                        return pool.acquire(validate=breaker.state != CircuitBreaker.CLOSED)
+                except DBError as e:
+                    # a refusal by the open breaker is not news to it, and a pool timeout says nothing of the server
+                    if classify(e) == UNAVAILABLE and not isinstance(e, DatabaseUnavailable):
+                        breaker.failure()
+                    if not retry_policy.retryable(e, attempt):
+                        metrics.observe_failure()
+                        raise
+                    time.sleep(retry_policy.delay(attempt))
+                    attempt += 1
+        finally:
+            metrics.observe_acquire(time.perf_counter() - started)
+
+    def create_connection(self):
+        self.replica = None
+        pinned = getattr(self.local, "pinned", None)
+        if pinned is not None:
+            self.conn = pinned
+            return self.conn
+        if self.read_only:
+            self.conn = self._replica_connection()
+            if self.conn is not None:
+                return self.conn
+        self.conn = self._acquire(self.get_pool())
         return self.conn
 
+    def _replica_connection(self):
+        # None if the read is to go to the primary
+        replica_set = self.get_replicas()
+        if not replica_set.replicas:
+            return None
+        if self.cached:
+            since = ConnectionManager.last_commit
+        else:
+            session = getattr(self.local, "session", None)
+            since = getattr(session, "wrote_at", None)
+        replica = replica_set.choose(since)
+        if replica is None:
+            return None
+        started = time.perf_counter()
+        try:
+            conn = replica.pool.acquire()
+        except DBError:
+            replica.failure()
+            return None
+        finally:
+            metrics.observe_acquire(time.perf_counter() - started)
+        self.replica = replica
+        return conn
+
     def close_connection(self):
+        # returns the connection to the pool; safe to call more than once
+        if self.conn is None:
+            return
+        conn = self.conn
+        self.conn = None
+        if conn is getattr(self.local, "pinned", None):
+            return
+        # a connection the server dropped is closed rather than handed to the next borrower
+        pool = self.replica.pool if self.replica is not None else self.get_pool()
+        pool.release(conn, discard=conn.broken)
+
+    def __enter__(self):
+        return self.create_connection()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close_connection()
+        return False
+
+
+class PinnedConnection:
+    """
+    A connection shared by a run of commands, e.g. a batch file.
+
+    Call begin_command() and end_command() around each command. A command that
+    commits is counted towards the current group, and the group is really
+    committed once group_size commands have; a command that returns without
+    committing is rolled back on its own, leaving the rest of the group intact.
+    If the server drops the connection, the next command starts over on a new
+    one and the uncommitted commands of the group are lost.
+    """
+
+    SAVEPOINT = "batch_command"
+
+    def __init__(self, conn, backend, group_size=1, pool=None):
+        self.conn = conn
+        self.backend = backend
+        self.group_size = max(1, group_size)
+        self.pool = pool
+        self.pending = 0
+        self.committed = False
+
+    def cursor(self, *args, **kwargs):
+        return self.conn.cursor(*args, **kwargs)
+
+    def commit(self):
+        self.committed = True
+        if self.group_size == 1:
+            self.conn.commit()
+
+    def rollback(self):
+        # only the current command's work when grouping
+        if self.group_size > 1:
+            self.conn.cursor().execute(self.backend.rollback_to_savepoint_sql % self.SAVEPOINT)
+        else:
+            self.conn.rollback()
+
+    def begin_command(self):
+        self.committed = False
+        # a connection that broke, or that could not be replaced last time
+        if (self.conn is None or self.conn.broken) and self.pool is not None:
+            if self.conn is not None:
+                self.pool.release(self.conn, discard=True)
+            self.conn = None
+            if self.pending:
+                print(f"Connection lost, {self.pending} uncommitted command(s) rolled back", file=sys.stderr)
+                self.pending = 0
+            self.conn = ConnectionManager._acquire(self.pool)
+        if self.group_size > 1:
+            self.conn.cursor().execute(self.backend.savepoint_sql % self.SAVEPOINT)
+
+    def end_command(self):
+        if not self.committed:
+            if self.group_size > 1:
+                self.conn.cursor().execute(self.backend.rollback_to_savepoint_sql % self.SAVEPOINT)
+            else:
+                self.conn.rollback()
+            return
+        self.pending += 1
+        if self.pending >= self.group_size:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.conn.commit()
+            self.pending = 0
+
+
+class MeteredConnection:
+    """
+    Wraps a driver connection so that every round trip to the database is counted in util.Metrics.
+
+    pymssql runs executemany() as one statement per parameter set, so on SQL Server
+    each set counts; SQLite runs it in-process as one call. Errors are classified
+    as they happen, see db.Retry: the connection is marked broken once the server
+    is unreachable, and an error from commit() is flagged as in_commit, as the
+    transaction may or may not have been committed. health hears of every
+    statement's outcome: the circuit breaker for the primary, or a replica.
+    """
+
+    def __init__(self, conn, per_row_executemany=False, health=breaker, on_commit=None):
+        self.conn = conn
+        self.per_row_executemany = per_row_executemany
+        self.health = health
+        self.on_commit = on_commit
+        self.broken = False
+
+    def cursor(self, *args, **kwargs):
+        return MeteredCursor(self.conn.cursor(*args, **kwargs), self)
+
+    def failed(self, error):
+        metrics.observe_failure()
+        if classify(error) == UNAVAILABLE:
+            self.broken = True
+            self.health.failure()
+
+    def commit(self):
+        started = time.perf_counter()
         try:
-            self.conn.close()
-        except pymssql.Error as db_err:
-            print("Database Programming Error in SQL connection processing! ")
-            print(db_err)
-            quit()
+            self.conn.commit()
+        except DBError as e:
+            e.in_commit = True
+            self.failed(e)
+            raise
+        finally:
+            metrics.observe_round_trip(time.perf_counter() - started)
+        if self.on_commit is not None:
+            self.on_commit()
+
+    def rollback(self):
+        started = time.perf_counter()
+        try:
+            self.conn.rollback()
+        except DBError as e:
+            self.failed(e)
+            raise
+        finally:
+            metrics.observe_round_trip(time.perf_counter() - started)
+
+    def close(self):
+        self.conn.close()
+
+
+class MeteredCursor:
+    """A driver cursor whose statements are timed into util.Metrics and, unless SQLTrace=0, db.SQLTrace."""
+
+    def __init__(self, cursor, conn):
+        self.cursor = cursor
+        self.conn = conn
+        # the traced statement whose rows are being fetched
+        self.statement = None
+
+    def execute(self, operation, params=None):
+        started = time.perf_counter()
+        rowcount = None
+        try:
+            if params is None:
+                self.cursor.execute(operation)
+            else:
+                self.cursor.execute(operation, params)
+            rowcount = self.cursor.rowcount
+        except DBError as e:
+            self.conn.failed(e)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.observe_round_trip(elapsed)
+            if sql_trace.enabled:
+                self.statement = sql_trace.record(operation, params, elapsed, rowcount)
+        self.conn.health.success()
+        return self
+
+    def executemany(self, operation, seq_of_params):
+        seq_of_params = list(seq_of_params)
+        started = time.perf_counter()
+        rowcount = None
+        try:
+            self.cursor.executemany(operation, seq_of_params)
+            rowcount = self.cursor.rowcount
+        except DBError as e:
+            self.conn.failed(e)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.observe_round_trip(elapsed, len(seq_of_params) if self.conn.per_row_executemany else 1)
+            if sql_trace.enabled:
+                self.statement = sql_trace.record(operation, seq_of_params[0] if seq_of_params else None,
+                                                  elapsed, rowcount)
+        self.conn.health.success()
+        return self
+
+    def fetchone(self):
+        row = self.cursor.fetchone()
+        if row is not None and self.statement is not None:
+            sql_trace.add_rows(self.statement, 1)
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self.cursor.fetchmany(size) if size is not None else self.cursor.fetchmany()
+        if self.statement is not None:
+            sql_trace.add_rows(self.statement, len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = self.cursor.fetchall()
+        if self.statement is not None:
+            sql_trace.add_rows(self.statement, len(rows))
+        return rows
+
+    def __iter__(self):
+        if self.statement is None:
+            return iter(self.cursor)
+        return self._counted()
+
+    def _counted(self):
+        statement = self.statement
+        rows = 0
+        try:
+            for row in self.cursor:
+                rows += 1
+                yield row
+        finally:
+            sql_trace.add_rows(statement, rows)
+
+    def __getattr__(self, name):
+        # description, rowcount, lastrowid, close, ...
+        return getattr(self.cursor, name)
+
+
+def retryable(func):
+    """
+    Runs func under the process-wide RetryPolicy, for reads and whole transactions, see db.Retry.
 
+    Inside a pinned connection nothing is retried, since a failure there may
+    have rolled back more than the current command.
+    """
+    @functools.wraps(func)
+    def call(*args, **kwargs):
+        if getattr(ConnectionManager.local, "pinned", None) is not None:
+            return func(*args, **kwargs)
+        return retry_policy.call(func, *args, **kwargs)
+    return call
@@ -0,0 +1,120 @@
+import threading
+import time
+from db.Backend import DatabaseUnavailable
+
+
+class PoolTimeout(DatabaseUnavailable):
+    """Raised when no connection could be had within the pool's acquire_timeout; a DBError like any other."""
+
+
+class ConnectionPool:
+    """
+    A bounded pool of reusable database connections.
+
+    Connections are opened lazily through the `connect` callable, up to `max_size`
+    at a time. Released connections are rolled back and kept idle for reuse;
+    idle connections older than `idle_timeout` seconds are closed, and a
+    connection that has been idle for longer than `health_check_interval`
+    seconds is pinged before it is handed out again.
+    """
+
+    def __init__(self, connect, max_size=10, idle_timeout=300, health_check_interval=30, acquire_timeout=30):
+        self.connect = connect
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.acquire_timeout = acquire_timeout
+        # idle connections as (conn, last_used) pairs, most recently used last
+        self.idle = []
+        self.size = 0
+        self.cond = threading.Condition()
+
+    def acquire(self, validate=False):
+        # validate=True pings an idle connection however recently it was used
+        deadline = time.monotonic() + self.acquire_timeout
+        with self.cond:
+            while True:
+                expired = self._evict_idle()
+                if self.idle:
+                    conn, last_used = self.idle.pop()
+                    break
+                if self.size < self.max_size:
+                    # reserve a slot, the connection itself is opened outside the lock
+                    self.size += 1
+                    conn, last_used = None, None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeout("Timed out waiting for a database connection")
+                self.cond.wait(remaining)
+        self._close_all(expired)
+
+        if conn is not None and (validate or time.monotonic() - last_used > self.health_check_interval):
+            if not self._is_healthy(conn):
+                self._close_all([conn])
+                conn = None
+        if conn is None:
+            try:
+                conn = self.connect()
+            except BaseException:
+                with self.cond:
+                    self.size -= 1
+                    self.cond.notify()
+                raise
+        return conn
+
+    def release(self, conn, discard=False):
+        if not discard:
+            try:
+                # never hand uncommitted work to the next borrower
+                conn.rollback()
+            except Exception:
+                discard = True
+        with self.cond:
+            if discard:
+                self.size -= 1
+            else:
+                self.idle.append((conn, time.monotonic()))
+            self.cond.notify()
+        if discard:
+            self._close_all([conn])
+
+    def close(self):
+        with self.cond:
+            idle = [conn for conn, _ in self.idle]
+            self.size -= len(idle)
+            self.idle = []
+            self.cond.notify_all()
+        self._close_all(idle)
+
+    def stats(self):
+        with self.cond:
+            return {"size": self.size, "idle": len(self.idle), "in_use": self.size - len(self.idle),
+                    "max_size": self.max_size}
+
+    def _evict_idle(self):
+        # called with the lock held; returns the evicted connections so they can be closed outside it
+        cutoff = time.monotonic() - self.idle_timeout
+        expired = [conn for conn, last_used in self.idle if last_used < cutoff]
+        if expired:
+            self.idle = [(conn, last_used) for conn, last_used in self.idle if last_used >= cutoff]
+            self.size -= len(expired)
+        return expired
+
+    @staticmethod
+    def _is_healthy(conn):
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close_all(conns):
+        for conn in conns:
+            try:
+                conn.close()
+            except Exception:
+                pass
@@ -0,0 +1,64 @@
+import datetime
+import os
+import threading
+import time
+from db.ConnectionManager import ConnectionManager
+
+# how long a key is remembered, in seconds
+TTL = float(os.getenv("IdempotencyTTL", "86400"))
+# expired keys are purged at most this often, in seconds, by whichever request comes along
+PURGE_INTERVAL = 300
+
+last_purge = [0.0]
+purge_lock = threading.Lock()
+
+purge_key = "DELETE FROM IdempotencyKeys WHERE Idempotency_Key = %s AND Username = %s AND Created_At < %s"
+purge_all = "DELETE FROM IdempotencyKeys WHERE Created_At < %s"
+# on SQL Server the range lock makes a concurrent claim of the same key wait for this one's transaction and then
+# find the key, instead of failing on the primary key
+insert_key = ("INSERT INTO IdempotencyKeys (Idempotency_Key, Username, Command, Created_At) "
+              "SELECT %s, %s, %s, %s "
+              "WHERE NOT EXISTS (SELECT 1 FROM IdempotencyKeys{hint} WHERE Idempotency_Key = %s AND Username = %s)")
+select_key = "SELECT Command, Outcome FROM IdempotencyKeys WHERE Idempotency_Key = %s AND Username = %s"
+update_outcome = "UPDATE IdempotencyKeys SET Outcome = %s WHERE Idempotency_Key = %s AND Username = %s"
+
+
+def claim(cursor, key, username, command):
+    """
+    Claims key for a request of username inside the caller's transaction; cursor must be as_dict.
+
+    Returns None when the request is new and should be carried out; call record()
+    with its outcome before committing. Returns the recorded outcome when the
+    same request was already carried out.
+    """
+    now = datetime.datetime.now()
+    expired_before = now - datetime.timedelta(seconds=TTL)
+    insert = insert_key.format(hint=" WITH (UPDLOCK, HOLDLOCK)" if ConnectionManager.get_backend().name == "mssql"
+                               else "")
+    purge_expired(cursor, expired_before)
+    cursor.execute(purge_key, (key, username, expired_before))
+    cursor.execute(insert, (key, username, command, now, key, username))
+    if cursor.rowcount == 1:
+        return None
+
+    cursor.execute(select_key, (key, username))
+    row = cursor.fetchone()
+    if row is None:
+        # the request holding the key rolled back meanwhile
+        cursor.execute(insert, (key, username, command, now, key, username))
+        return None
+    if row['Command'] != command:
+        raise ValueError("Idempotency key " + key + " was already used for " + row['Command'])
+    return row['Outcome']
+
+
+def record(cursor, key, username, outcome):
+    cursor.execute(update_outcome, (outcome, key, username))
+
+
+def purge_expired(cursor, expired_before):
+    with purge_lock:
+        if time.monotonic() - last_purge[0] < PURGE_INTERVAL:
+            return
+        last_purge[0] = time.monotonic()
+    cursor.execute(purge_all, expired_before)
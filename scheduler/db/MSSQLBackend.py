@@ -0,0 +1,82 @@
+import itertools
+import os
+import re
+
+try:
+    import pymssql
+except ImportError:
+    pymssql = None
+
+PLACEHOLDER = re.compile(r"%[sd]")
+
+
+class MSSQLBackend:
+    """
+    Azure SQL Server through pymssql, configured by the Server/DBName/UserID/Password environment variables.
+
+    server overrides Server, e.g. for a geo-replica, which shares the database name and login.
+    """
+
+    name = "mssql"
+    savepoint_sql = "SAVE TRANSACTION %s"
+    rollback_to_savepoint_sql = "ROLLBACK TRANSACTION %s"
+    # a random order of the values of column that keeps equal values together, for a random seed passed as %s
+    shuffle_sql = "HASHBYTES('SHA2_256', CONCAT(%s, {column}))"
+    # pymssql keeps a transaction open whenever autocommit is off
+    begin_transaction_sql = None
+
+    def __init__(self, server=None):
+        if pymssql is None:
+            raise RuntimeError("pymssql is not installed; install it or set DBBackend=sqlite")
+        self.server_name = (server or os.getenv("Server")) + ".database.windows.net"
+        self.db_name = os.getenv("DBName")
+        self.user = os.getenv("UserID")
+        self.password = os.getenv("Password")
+
+    def replica(self, endpoint):
+        """A backend for the read replica at endpoint, a server name like Server"""
+        return MSSQLBackend(endpoint)
+
+    @staticmethod
+    def explain(conn, sql, params):
+        """The estimated plan of sql as lines, read on conn without running the statement"""
+        cursor = conn.cursor()
+        # with SHOWPLAN_TEXT on, SQL Server returns the plan of each statement of the batch instead of running it
+        cursor.execute("SET SHOWPLAN_TEXT ON")
+        try:
+            cursor.execute(sql, params)
+            lines = []
+            while True:
+                lines += [row[0].rstrip() for row in cursor.fetchall()]
+                if not cursor.nextset():
+                    return lines
+        finally:
+            cursor.execute("SET SHOWPLAN_TEXT OFF")
+
+    @staticmethod
+    def prepare(sql, types):
+        """
+        sql as a call to sp_executesql with a parameter of each of types in place of its placeholders.
+
+        pymssql writes the values into the SQL text, so every distinct value would be
+        compiled and cached as a statement of its own; SQL Server compiles the
+        parameterized statement once and reuses its plan for any values.
+        """
+        placeholders = PLACEHOLDER.findall(sql)
+        if len(placeholders) != len(types):
+            raise ValueError("%d placeholders, %d parameter types: %s" % (len(placeholders), len(types), sql))
+        if not types:
+            return sql
+        number = itertools.count(1)
+        statement = PLACEHOLDER.sub(lambda match: "@P%d" % next(number), sql)
+        declarations = ", ".join("@P%d %s" % (i, type) for i, type in enumerate(types, 1))
+        return "EXEC sp_executesql N'%s', N'%s', %s" % (statement.replace("'", "''"), declarations,
+                                                         ", ".join(placeholders))
+
+    @staticmethod
+    def limit(select, params, count):
+        """select, limited to its first count rows"""
+        return "SELECT TOP (%d) " + select[len("SELECT "):], (count,) + tuple(params)
+
+    def connect(self):
+        return pymssql.connect(server=self.server_name, user=self.user, password=self.password, database=self.db_name)
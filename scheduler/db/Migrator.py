@@ -0,0 +1,120 @@
+import datetime
+import os
+import re
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "resources", "migrations")
+
+# NNNN_name.up.sql / NNNN_name.down.sql
+MIGRATION_FILE = re.compile(r"^(\d+)_(\w+)\.(up|down)\.sql$")
+# statements in a migration file end with a semicolon at the end of a line
+STATEMENT_END = re.compile(r";[ \t]*$", re.MULTILINE)
+
+
+class Migration:
+    def __init__(self, version, name, up_path, down_path):
+        self.version = version
+        self.name = name
+        self.up_path = up_path
+        self.down_path = down_path
+
+
+class Migrator:
+    """
+    Applies the versioned schema migrations in resources/migrations/<backend>.
+
+    Applied versions are recorded in the SchemaVersions table. Each step runs in
+    its own transaction together with its SchemaVersions row, so a failed step
+    leaves the schema at the previous version.
+    """
+
+    create_versions = ("CREATE TABLE SchemaVersions (Version int PRIMARY KEY, Name varchar(255), "
+                       "Applied_At datetime)")
+
+    def __init__(self, backend, conn):
+        self.backend = backend
+        self.conn = conn
+        self.migrations = self.load(backend.name)
+
+    @staticmethod
+    def load(backend_name):
+        directory = os.path.join(MIGRATIONS_DIR, backend_name)
+        found = {}
+        for file_name in sorted(os.listdir(directory)):
+            match = MIGRATION_FILE.match(file_name)
+            if match is None:
+                continue
+            version, name, direction = int(match.group(1)), match.group(2), match.group(3)
+            migration = found.setdefault(version, Migration(version, name, None, None))
+            setattr(migration, direction + "_path", os.path.join(directory, file_name))
+        return [found[version] for version in sorted(found)]
+
+    def applied(self):
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute("SELECT Version FROM SchemaVersions")
+        except Exception:
+            # no SchemaVersions table yet
+            self.conn.rollback()
+            self.begin()
+            cursor = self.conn.cursor()
+            cursor.execute(self.create_versions)
+            self.conn.commit()
+            return set()
+        versions = {row[0] for row in cursor}
+        self.conn.commit()
+        return versions
+
+    def status(self):
+        """(version, name, applied) for every known migration."""
+        applied = self.applied()
+        return [(m.version, m.name, m.version in applied) for m in self.migrations]
+
+    def current_version(self):
+        applied = self.applied()
+        return max(applied) if applied else 0
+
+    def upgrade(self, target=None):
+        """Applies pending migrations up to and including target (default: all); returns the versions applied."""
+        applied = self.applied()
+        done = []
+        for migration in self.migrations:
+            if migration.version in applied or (target is not None and migration.version > target):
+                continue
+            self.run(migration.up_path, "INSERT INTO SchemaVersions VALUES (%d, %s, %s)",
+                     (migration.version, migration.name, datetime.datetime.now()))
+            done.append(migration.version)
+        return done
+
+    def downgrade(self, target):
+        """Rolls back applied migrations newer than target, newest first; returns the versions rolled back."""
+        applied = self.applied()
+        done = []
+        for migration in reversed(self.migrations):
+            if migration.version not in applied or migration.version <= target:
+                continue
+            if migration.down_path is None:
+                raise ValueError("Migration %d has no down step" % migration.version)
+            self.run(migration.down_path, "DELETE FROM SchemaVersions WHERE Version = %d", (migration.version,))
+            done.append(migration.version)
+        return done
+
+    def begin(self):
+        # SQLite runs DDL outside a transaction unless one is opened explicitly
+        if self.backend.begin_transaction_sql is not None:
+            self.conn.cursor().execute(self.backend.begin_transaction_sql)
+
+    def run(self, path, record_sql, record_params):
+        with open(path) as f:
+            script = f.read()
+        self.begin()
+        cursor = self.conn.cursor()
+        try:
+            for statement in STATEMENT_END.split(script):
+                code = "\n".join(line for line in statement.splitlines() if not line.strip().startswith("--"))
+                if code.strip():
+                    cursor.execute(statement)
+            cursor.execute(record_sql, record_params)
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
@@ -0,0 +1,80 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from util.Metrics import metrics
+
+
+class ReadCache:
+    """
+    An in-process read-through cache with a TTL and LRU eviction.
+
+    Writers call the invalidate_* functions after committing, so within one
+    process reads are only stale while a write is uncommitted; changes made by
+    other processes show up once the entry's TTL runs out. Every invalidation
+    bumps `generation`, and a value loaded while it changed is returned but not
+    kept, since the load may have read the database before that write.
+    """
+
+    def __init__(self, max_entries=1024, ttl=30.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.generation = 0
+        self.discarded = 0
+
+    def get(self, key, load):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] > now:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            generation = self.generation
+        # load outside the lock so a slow query does not block hits on other keys
+        value = load()
+        with self.lock:
+            if self.generation != generation:
+                self.discarded += 1
+                return value
+            self.entries[key] = (value, now + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def invalidate(self, *keys):
+        with self.lock:
+            self.generation += 1
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses,
+                    "evictions": self.evictions, "discarded": self.discarded, "hit_ratio": self.hits / lookups if lookups else 0.0}
+
+
+read_cache = ReadCache(max_entries=int(os.getenv("CacheSize", "1024")), ttl=float(os.getenv("CacheTTL", "30")))
+metrics.add_source("read_cache", read_cache.stats)
+
+# keys: ("vaccines",) -> every (name, doses), which single-vaccine reads look up too; free slots per date are
+# kept by db.SlotIndex
+ALL_VACCINES = ("vaccines",)
+
+
+def invalidate_vaccines():
+    read_cache.invalidate(ALL_VACCINES)
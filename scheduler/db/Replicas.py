@@ -0,0 +1,142 @@
+import collections
+import itertools
+import sys
+import threading
+import time
+from db.Backend import DBError
+
+# the primary's heartbeat: bumped by beat(), read back from each replica by check()
+BUMP_HEARTBEAT = "UPDATE ReplicaHeartbeat SET Seq = Seq + 1 WHERE ID = 1"
+GET_HEARTBEAT = "SELECT Seq FROM ReplicaHeartbeat WHERE ID = 1"
+
+
+class Replica:
+    """One read replica: its own pool of connections, and how current its copy was when last checked."""
+
+    def __init__(self, endpoint, backend):
+        self.endpoint = endpoint
+        self.backend = backend
+        self.pool = None
+        # monotonic time before which everything committed on the primary is on the replica, None if unknown
+        self.current_as_of = None
+        self.healthy = True
+        self.reads = 0
+        self.errors = 0
+
+    # MeteredConnection reports the outcome of statements here, as it does to the primary's circuit breaker
+
+    def success(self):
+        pass
+
+    def failure(self):
+        # unused until the next check() gets through to it
+        self.healthy = False
+        self.errors += 1
+
+
+class ReplicaSet:
+    """
+    Routes reads to replicas whose copy of the primary is at most max_lag seconds old.
+
+    A background thread commits a heartbeat on the primary every interval
+    seconds, bumping the counter in ReplicaHeartbeat, and remembers when each
+    bump started. It then reads the counter back from every replica: a replica
+    showing one of this process's bumps has applied everything committed on
+    the primary before that bump started. Replicated commits are applied in
+    order, so this bounds staleness with the process's own clock alone, and
+    read-your-own-writes is a matter of asking for a replica current as of the
+    commit in question, see choose().
+
+    A replica that is behind, unreachable or not yet checked is skipped, and
+    the read goes to the primary.
+    """
+
+    def __init__(self, replicas, max_lag=5.0, interval=1.0):
+        self.replicas = replicas
+        self.max_lag = max_lag
+        self.interval = interval
+        # (heartbeat value, monotonic time the bump started), oldest first
+        self.beats = collections.deque(maxlen=int(max_lag / interval) + 2)
+        self.rotation = itertools.count()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.primary_reads = 0
+
+    def start(self, beat):
+        """Starts the heartbeat thread; beat() bumps the primary's heartbeat and returns its new value."""
+        if self.thread is not None:
+            return
+
+        def run():
+            while True:
+                started = time.monotonic()
+                try:
+                    seq = beat()
+                except DBError as e:
+                    # no new bump to match, so once max_lag has passed the reads go to the primary too
+                    print("Replica heartbeat failed:", e, file=sys.stderr)
+                else:
+                    with self.lock:
+                        self.beats.append((seq, started))
+                for replica in self.replicas:
+                    self.check(replica)
+                time.sleep(max(self.interval - (time.monotonic() - started), 0.0))
+
+        self.thread = threading.Thread(target=run, name="replica-heartbeat", daemon=True)
+        self.thread.start()
+
+    def check(self, replica):
+        try:
+            conn = replica.pool.acquire()
+        except DBError:
+            replica.failure()
+            return
+        broken = True
+        try:
+            cursor = conn.cursor()
+            cursor.execute(GET_HEARTBEAT)
+            row = cursor.fetchone()
+            broken = conn.broken
+        except DBError:
+            replica.failure()
+            return
+        finally:
+            replica.pool.release(conn, discard=broken)
+        seq = row[0] if row is not None else -1
+        with self.lock:
+            # the newest of this process's bumps the replica has applied
+            current_as_of = None
+            for beat_seq, started in self.beats:
+                if beat_seq <= seq:
+                    current_as_of = started
+            replica.current_as_of = current_as_of
+            replica.healthy = True
+
+    def choose(self, since=None):
+        """
+        A replica current as of max_lag seconds ago, and as of the monotonic time since if given,
+        round robin; None when only the primary will do.
+        """
+        oldest = time.monotonic() - self.max_lag
+        if since is not None:
+            oldest = max(oldest, since)
+        candidates = [replica for replica in self.replicas
+                      if replica.healthy and replica.current_as_of is not None and replica.current_as_of >= oldest]
+        with self.lock:
+            if not candidates:
+                self.primary_reads += 1
+                return None
+            replica = candidates[next(self.rotation) % len(candidates)]
+            replica.reads += 1
+        return replica
+
+    def stats(self):
+        now = time.monotonic()
+        with self.lock:
+            stats = {"primary_reads": self.primary_reads}
+            for i, replica in enumerate(self.replicas):
+                lag = now - replica.current_as_of if replica.current_as_of is not None else None
+                stats["replica%d_reads" % i] = replica.reads
+                stats["replica%d_errors" % i] = replica.errors
+                stats["replica%d_lag" % i] = lag if lag is not None and replica.healthy else "unknown"
+            return stats
@@ -0,0 +1,189 @@
+from collections import namedtuple
+from db.ConnectionManager import ConnectionManager
+
+'''
+The application's queries, one place per query, each with the record type its rows are read into.
+
+Rows are read from plain cursors into namedtuples, by position, rather than into a dict per row.
+Each Query is prepared for the backend once per process, see the backends' prepare(): SQL Server gets
+a parameterized batch whose plan it compiles once for any values, and SQLite reuses the compiled
+statement of each pooled connection from the connection's statement cache.
+'''
+
+# SQL Server types of the parameters, for prepare()
+NAME = "varchar(255)"
+DATE = "date"
+INT = "int"
+BYTES = "binary(16)"
+DATETIME = "datetime"
+TOKEN = "varchar(32)"
+
+# the current balance of the vaccine row aliased v, see model.Vaccine
+BALANCE = "v.Doses + COALESCE((SELECT SUM(l.Delta) FROM VaccineLedger l{hint} WHERE l.Name = v.Name), 0)"
+
+Credentials = namedtuple("Credentials", "salt hash")
+DayAvailability = namedtuple("DayAvailability", "time caregivers slots")
+OpenSlot = namedtuple("OpenSlot", "time slot")
+FreeSlot = namedtuple("FreeSlot", "slot username")
+DatedSlot = namedtuple("DatedSlot", "time slot username")
+VaccineBalance = namedtuple("VaccineBalance", "name doses")
+Appointment = namedtuple("Appointment", "id patient_name caregiver_name vaccine_name reservation_time slot")
+AppointmentLine = namedtuple("AppointmentLine", "id vaccine_name reservation_time slot other_name")
+WaitingEntry = namedtuple("WaitingEntry", "id vaccine_name from_date to_date")
+
+
+class Query:
+    """
+    One statement: its SQL with pymssql placeholders, the SQL Server type of each parameter and its record type.
+
+    mssql is the statement's SQL on SQL Server, where it differs, e.g. by table hints.
+    """
+
+    __slots__ = ("sql", "types", "record", "mssql", "prepared", "limited")
+
+    def __init__(self, sql, types=(), record=None, mssql=None):
+        self.sql = sql
+        self.types = tuple(types)
+        self.record = record
+        self.mssql = mssql
+        self.prepared = None
+        self.limited = None
+
+    def text(self):
+        """The SQL as prepared for the backend"""
+        if self.prepared is None:
+            backend = ConnectionManager.get_backend()
+            sql = self.mssql if self.mssql is not None and backend.name == "mssql" else self.sql
+            self.prepared = backend.prepare(sql, self.types)
+        return self.prepared
+
+    def execute(self, cursor, params=(), count=None):
+        """Runs the statement on cursor; with count, a SELECT returns its first count rows only."""
+        if count is None:
+            cursor.execute(self.text(), params if self.types else None)
+            return cursor
+        backend = ConnectionManager.get_backend()
+        if self.limited is None:
+            # limit() only rearranges, so it puts the count's type among the parameter types too
+            self.limited = Query(*backend.limit(self.sql, self.types, INT), record=self.record)
+        cursor.execute(self.limited.text(), backend.limit(self.sql, params, count)[1])
+        return cursor
+
+    def executemany(self, cursor, seq_of_params):
+        cursor.executemany(self.text(), seq_of_params)
+        return cursor
+
+    def all(self, conn, params=(), count=None):
+        """Every row, as records"""
+        rows = self.execute(conn.cursor(), params, count).fetchall()
+        return [self.record._make(row) for row in rows] if self.record is not None else rows
+
+    def one(self, conn, params=()):
+        """The first row as a record, or None"""
+        row = self.execute(conn.cursor(), params).fetchone()
+        return self.record._make(row) if row is not None and self.record is not None else row
+
+    def each(self, conn, params=(), count=None, size=100):
+        """The rows as records, fetched size at a time"""
+        cursor = self.execute(conn.cursor(), params, count)
+        rows = cursor.fetchmany(size)
+        while rows:
+            for row in rows:
+                yield self.record._make(row) if self.record is not None else row
+            rows = cursor.fetchmany(size)
+
+
+# users
+patient_credentials = Query("SELECT Salt, Hash FROM Patients WHERE Username = %s", (NAME,), Credentials)
+caregiver_credentials = Query("SELECT Salt, Hash FROM Caregivers WHERE Username = %s", (NAME,), Credentials)
+patient_exists = Query("SELECT 1 FROM Patients WHERE Username = %s", (NAME,))
+caregiver_exists = Query("SELECT 1 FROM Caregivers WHERE Username = %s", (NAME,))
+patient_names = Query("SELECT Username FROM Patients")
+caregiver_names = Query("SELECT Username FROM Caregivers")
+patients_among_queries = {}
+
+
+def patients_among(count):
+    """The usernames among count given ones that are patients"""
+    query = patients_among_queries.get(count)
+    if query is None:
+        query = patients_among_queries[count] = Query(
+            "SELECT Username FROM Patients WHERE Username IN (" + ", ".join(["%s"] * count) + ")", (NAME,) * count)
+    return query
+
+
+def add_user(table):
+    # inserts the user unless the name is taken, which is then reported as a rowcount of 0; on SQL Server the
+    # range lock makes a concurrent insert of the same name wait and see it, instead of failing on the key
+    sql = ("INSERT INTO " + table + " (Username, Salt, Hash) SELECT %s, %s, %s "
+           "WHERE NOT EXISTS (SELECT 1 FROM " + table + "{hint} WHERE Username = %s)")
+    return Query(sql.format(hint=""), (NAME, BYTES, BYTES, NAME),
+                 mssql=sql.format(hint=" WITH (UPDLOCK, HOLDLOCK)"))
+
+
+add_patient = add_user("Patients")
+add_caregiver = add_user("Caregivers")
+
+# availability, on the Availabilities primary key (Time, Username, Slot)
+availability_counts = Query("SELECT Time, COUNT(DISTINCT Username), COUNT(*) FROM Availabilities "
+                            "WHERE Time >= %s AND Time <= %s GROUP BY Time ORDER BY Time", (DATE, DATE), DayAvailability)
+next_slot_from = Query("SELECT Time, Slot FROM Availabilities WHERE Time >= %s ORDER BY Time, Slot", (DATE,), OpenSlot)
+next_slot_after = Query("SELECT Time, Slot FROM Availabilities WHERE Time > %s ORDER BY Time, Slot", (DATE,), OpenSlot)
+free_slots = Query("SELECT Slot, Username FROM Availabilities WHERE Time = %s", (DATE,), FreeSlot)
+free_slots_between = Query("SELECT Time, Slot, Username FROM Availabilities WHERE Time >= %s AND Time <= %s "
+                           "ORDER BY Time, Slot, Username", (DATE, DATE), DatedSlot)
+add_slot = Query("INSERT INTO Availabilities (Time, Username, Slot) VALUES (%s, %s, %d)", (DATE, NAME, INT))
+# a slot given back by a cancel, which the caregiver may have uploaded again meanwhile
+restore_slot = Query("INSERT INTO Availabilities (Time, Username, Slot) SELECT %s, %s, %d WHERE NOT EXISTS "
+                     "(SELECT 1 FROM Availabilities WHERE Time = %s AND Username = %s AND Slot = %d)",
+                     (DATE, NAME, INT, DATE, NAME, INT))
+# a caregiver's slots in a date range, free or booked
+caregiver_slots = Query("SELECT Time, Slot FROM Availabilities WHERE Username = %s AND Time BETWEEN %s AND %s "
+                        "UNION ALL SELECT Reservation_Time, Slot FROM Reservations "
+                        "WHERE Caregiver_Name = %s AND Reservation_Time BETWEEN %s AND %s",
+                        (NAME, DATE, DATE, NAME, DATE, DATE), OpenSlot)
+
+# vaccines
+vaccine_balances = Query("SELECT v.Name, " + BALANCE.format(hint="") + " AS Doses FROM Vaccines v", (),
+                         VaccineBalance)
+vaccine_exists = Query("SELECT 1 FROM Vaccines WHERE Name = %s", (NAME,))
+vaccine_balance = Query(vaccine_balances.sql + " WHERE v.Name = %s", (NAME,), VaccineBalance)
+
+# appointments
+appointment = Query("SELECT ID, Patient_Name, Caregiver_Name, Vaccine_Name, Reservation_Time, Slot FROM Reservations "
+                    "WHERE ID = %d", (INT,), Appointment)
+delete_appointment = Query("DELETE FROM Reservations WHERE ID = %d", (INT,))
+appointment_pages = {}
+
+
+def appointments_page(user_column, other_column, from_date=False, to_date=False):
+    """
+    A page of the appointments of the user in user_column after an ID, with the other party from other_column,
+    on or after a date with from_date and on or before one with to_date
+    """
+    key = (user_column, other_column, from_date, to_date)
+    query = appointment_pages.get(key)
+    if query is None:
+        sql = ("SELECT ID, Vaccine_Name, Reservation_Time, Slot, " + other_column +
+               " FROM Reservations WHERE " + user_column + " = %s AND ID > %d")
+        types = (NAME, INT)
+        if from_date:
+            sql += " AND Reservation_Time >= %s"
+            types += (DATE,)
+        if to_date:
+            sql += " AND Reservation_Time <= %s"
+            types += (DATE,)
+        query = appointment_pages[key] = Query(sql + " ORDER BY ID", types, AppointmentLine)
+    return query
+
+
+# waitlist
+waitlist_entries = Query("SELECT ID, Vaccine_Name, From_Date, To_Date FROM Waitlist WHERE Patient_Name = %s "
+                         "ORDER BY ID", (NAME,), WaitingEntry)
+
+
+# revoked session tokens, see db.SessionTokens
+revoked_token = Query("SELECT 1 FROM RevokedTokens WHERE Token_ID = %s", (TOKEN,))
+revoke_token = Query("INSERT INTO RevokedTokens (Token_ID, Expires_At) SELECT %s, %s "
+                     "WHERE NOT EXISTS (SELECT 1 FROM RevokedTokens WHERE Token_ID = %s)", (TOKEN, DATETIME, TOKEN))
+purge_revoked_tokens = Query("DELETE FROM RevokedTokens WHERE Expires_At < %s", (DATETIME,))
@@ -0,0 +1,186 @@
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+from db.Backend import DatabaseUnavailable
+from db.ConnectionPool import PoolTimeout
+from db.MSSQLBackend import pymssql
+from util.Metrics import metrics
+
+# how a database error is handled: a permanent error is reported straight away, a transient one (lock
+# timeout, deadlock, throttling) is worth retrying, and an unavailable one means the server or the
+# connection is gone, which also counts towards opening the circuit breaker
+PERMANENT = "permanent"
+TRANSIENT = "transient"
+UNAVAILABLE = "unavailable"
+
+# SQL Server errors worth retrying: deadlock victim, lock timeout and Azure SQL throttling / resource limits
+TRANSIENT_ERRORS = {1205, 1222, 40501, 49918, 49919, 49920, 10928, 10929}
+# Azure SQL failover and reconfiguration, and the database being unreachable
+UNAVAILABLE_ERRORS = {233, 4060, 4221, 10053, 10054, 10060, 40143, 40197, 40613, 40540, 42108, 42109}
+# FreeTDS (DB-Lib) errors for a connection that could not be made or has been lost
+DBLIB_UNAVAILABLE = re.compile(r"DB-Lib error message 20(003|004|006|009|017|047)")
+
+
+def classify(error):
+    """PERMANENT, TRANSIENT or UNAVAILABLE, see above."""
+    if isinstance(error, DatabaseUnavailable):
+        return UNAVAILABLE
+    if isinstance(error, sqlite3.OperationalError):
+        # an embedded database is never unreachable, but a writer may hold the lock past the busy timeout
+        message = str(error)
+        return TRANSIENT if "locked" in message or "busy" in message else PERMANENT
+    if pymssql is not None and isinstance(error, pymssql.Error):
+        code = error.args[0] if error.args and isinstance(error.args[0], int) else None
+        if code in UNAVAILABLE_ERRORS or DBLIB_UNAVAILABLE.search(str(error)):
+            return UNAVAILABLE
+        if code in TRANSIENT_ERRORS:
+            return TRANSIENT
+        if isinstance(error, pymssql.InterfaceError):
+            return UNAVAILABLE
+    return PERMANENT
+
+
+class CircuitBreaker:
+    """
+    Fails fast while the database is down instead of letting every command wait out its own timeouts.
+
+    After `threshold` UNAVAILABLE errors in a row the breaker opens, and
+    ConnectionManager refuses connections with DatabaseUnavailable for
+    `reset_timeout` seconds. Then one caller at a time is let through as a
+    trial: its first successful statement closes the breaker again, another
+    failure reopens it.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, threshold=5, reset_timeout=10.0):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_at = 0.0
+        self.lock = threading.Lock()
+        self.opened = 0
+        self.recovered = 0
+        self.rejected = 0
+
+    def check(self):
+        """Raises DatabaseUnavailable unless a connection may be attempted now."""
+        if self.state == self.CLOSED:
+            return
+        now = time.monotonic()
+        with self.lock:
+            if self.state == self.OPEN and now - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self.trial_at = 0.0
+            if self.state == self.HALF_OPEN and now - self.trial_at >= self.reset_timeout:
+                # no trial running, or the last one never reported back
+                self.trial_at = now
+                return
+            if self.state == self.CLOSED:
+                return
+            self.rejected += 1
+            retry_in = max(self.opened_at + self.reset_timeout - now, 0.0)
+        raise DatabaseUnavailable("The database is unavailable, try again in %.0f s" % max(retry_in, 1))
+
+    def success(self):
+        # called for every successful statement, so the common case takes no lock
+        if self.state == self.CLOSED and self.failures == 0:
+            return
+        with self.lock:
+            if self.state != self.CLOSED:
+                self.recovered += 1
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.threshold):
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self.opened += 1
+
+    def stats(self):
+        with self.lock:
+            return {"state": self.state, "consecutive_failures": self.failures, "opened": self.opened,
+                    "recovered": self.recovered, "rejected": self.rejected}
+
+
+class RetryPolicy:
+    """
+    Re-runs an operation that failed with a TRANSIENT or UNAVAILABLE error.
+
+    The operation must be safe to run again from the start: a read, or a
+    whole transaction, which the failure rolled back. An error raised by
+    commit() itself leaves the outcome unknown and is never retried. Attempt n
+    waits a random time up to base_delay * 2^n seconds (capped at max_delay), so
+    clients that failed together do not all come back at once.
+    """
+
+    def __init__(self, retries=3, base_delay=0.1, max_delay=2.0, breaker=None):
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = breaker
+        self.lock = threading.Lock()
+        self.retried = 0
+        self.recovered = 0
+        self.gave_up = 0
+
+    def delay(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def retryable(self, error, attempt):
+        if attempt >= self.retries or getattr(error, "in_commit", False):
+            return False
+        # the pool already waited its acquire_timeout for a connection to come free
+        if isinstance(error, PoolTimeout):
+            return False
+        if classify(error) == PERMANENT:
+            return False
+        # while the breaker is open, retrying would only be refused
+        return self.breaker is None or self.breaker.state != CircuitBreaker.OPEN
+
+    def call(self, operation, *args, **kwargs):
+        attempt = 0
+        # once an attempt succeeds, the errors of the failed ones are resolved
+        with metrics.handled_errors():
+            while True:
+                try:
+                    result = operation(*args, **kwargs)
+                except Exception as e:
+                    if not self.retryable(e, attempt):
+                        if attempt:
+                            with self.lock:
+                                self.gave_up += 1
+                        raise
+                    time.sleep(self.delay(attempt))
+                    attempt += 1
+                    with self.lock:
+                        self.retried += 1
+                    continue
+                if attempt:
+                    with self.lock:
+                        self.recovered += 1
+                return result
+
+    def stats(self):
+        with self.lock:
+            return {"retries": self.retried, "recovered": self.recovered, "gave_up": self.gave_up}
+
+
+breaker = CircuitBreaker(threshold=int(os.getenv("BreakerThreshold", "5")),
+                         reset_timeout=float(os.getenv("BreakerResetTimeout", "10")))
+retry_policy = RetryPolicy(retries=int(os.getenv("RetryAttempts", "3")),
+                           base_delay=float(os.getenv("RetryBaseDelay", "0.1")),
+                           max_delay=float(os.getenv("RetryMaxDelay", "2")),
+                           breaker=breaker)
+metrics.add_source("breaker", breaker.stats)
+metrics.add_source("retry", retry_policy.stats)
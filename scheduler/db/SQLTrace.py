@@ -0,0 +1,193 @@
+import datetime
+import os
+import re
+import sys
+import threading
+from util.Metrics import metrics
+
+# literals and placeholders in SQL text, replaced by ? so that calls differing only in values share a statement
+STRING_LITERAL = re.compile(r"N?'(?:[^']|'')*'")
+NUMBER_LITERAL = re.compile(r"(?<![\w.@])\d+(?:\.\d+)?\b")
+PLACEHOLDER = re.compile(r"%[sd]")
+# IN lists built with one placeholder per value, collapsed so every length is the same statement
+IN_LIST = re.compile(r"\bIN \(\?(?:, \?)*\)", re.IGNORECASE)
+WHITESPACE = re.compile(r"\s+")
+# a statement prepared for SQL Server, see MSSQLBackend.prepare(), is traced as the statement it runs
+PREPARED = re.compile(r"EXEC sp_executesql N'((?:[^']|'')*)'")
+PREPARED_PARAMETER = re.compile(r"@P\d+\b")
+
+
+def normalize(sql):
+    prepared = PREPARED.match(sql)
+    if prepared:
+        sql = PREPARED_PARAMETER.sub("?", prepared.group(1).replace("''", "'"))
+    sql = STRING_LITERAL.sub("?", sql)
+    sql = PLACEHOLDER.sub("?", sql)
+    sql = NUMBER_LITERAL.sub("?", sql)
+    sql = WHITESPACE.sub(" ", sql).strip()
+    return IN_LIST.sub("IN (?, ...)", sql)
+
+
+def redact(params):
+    """The parameters with every string and byte string replaced by its type and length, for logging."""
+    if params is None:
+        return "()"
+    if not isinstance(params, (tuple, list)):
+        params = (params,)
+    shown = []
+    for value in params:
+        if isinstance(value, str):
+            shown.append("<str:%d>" % len(value))
+        elif isinstance(value, (bytes, bytearray)):
+            shown.append("<bytes:%d>" % len(value))
+        elif value is None or isinstance(value, (int, float, datetime.date)):
+            shown.append(str(value))
+        else:
+            shown.append("<" + type(value).__name__ + ">")
+    return "(" + ", ".join(shown) + ")"
+
+
+class StatementStats:
+    def __init__(self):
+        self.calls = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.rows = 0
+        self.slow = 0
+        self.plan_captured = False
+
+
+class SQLTrace:
+    """
+    Per-statement timings of every SQL statement the pooled connections run.
+
+    The cursors of ConnectionManager's connections report each statement here
+    with its duration and row count (affected rows, or rows fetched for a
+    SELECT). Statements are grouped by their normalized text, with literals,
+    placeholders and IN lists reduced to ?. A statement slower than slow_ms is
+    written to the slow-query log with its redacted parameters and, with
+    capture_plans, the estimated plan the first time that statement is slow;
+    plans are read over a separate connection, so results pending on the
+    traced cursor are left alone.
+    """
+
+    def __init__(self, enabled=True, slow_ms=100.0, log_path=None, capture_plans=False):
+        self.enabled = enabled
+        self.slow_time = slow_ms / 1000
+        self.log_path = log_path
+        self.capture_plans = capture_plans
+        self.statements = {}
+        # raw SQL text -> normalized text; the application's SQL is a fixed set of strings
+        self.normalized = {}
+        self.lock = threading.Lock()
+        self.log_lock = threading.Lock()
+        self.slow_queries = 0
+        self.backend = None
+        self.plan_conn = None
+
+    def set_backend(self, backend):
+        # where estimated plans are read from, see capture_plan()
+        self.backend = backend
+
+    def statement(self, sql):
+        """The normalized text sql is recorded under."""
+        normalized = self.normalized.get(sql)
+        if normalized is None:
+            normalized = normalize(sql)
+            with self.lock:
+                if len(self.normalized) >= 4096:
+                    self.normalized.clear()
+                self.normalized[sql] = normalized
+        return normalized
+
+    def record(self, sql, params, elapsed, rowcount):
+        """Records one execution; returns the statement it was recorded under, for add_rows()."""
+        statement = self.statement(sql)
+        slow = elapsed >= self.slow_time
+        with self.lock:
+            stats = self.statements.get(statement)
+            if stats is None:
+                stats = self.statements[statement] = StatementStats()
+            stats.calls += 1
+            stats.total_time += elapsed
+            stats.max_time = max(stats.max_time, elapsed)
+            if rowcount is not None and rowcount > 0:
+                stats.rows += rowcount
+            capture = False
+            if slow:
+                stats.slow += 1
+                self.slow_queries += 1
+                capture = self.capture_plans and not stats.plan_captured
+                stats.plan_captured = stats.plan_captured or capture
+        if slow:
+            self.log_slow(statement, sql, params, elapsed, rowcount, capture)
+        return statement
+
+    def add_rows(self, statement, rows):
+        if statement is None or not rows:
+            return
+        with self.lock:
+            stats = self.statements.get(statement)
+            if stats is not None:
+                stats.rows += rows
+
+    def log_slow(self, statement, sql, params, elapsed, rowcount, capture):
+        lines = ["%s slow query %.1f ms, rows %s: %s %s" % (
+            datetime.datetime.now().isoformat(" ", "milliseconds"), elapsed * 1000,
+            rowcount if rowcount is not None and rowcount >= 0 else "-", statement, redact(params))]
+        if capture:
+            lines += ["    " + line for line in self.capture_plan(sql, params)]
+        text = "\n".join(lines) + "\n"
+        with self.log_lock:
+            if self.log_path:
+                with open(self.log_path, "a") as log:
+                    log.write(text)
+            else:
+                sys.stderr.write(text)
+
+    def capture_plan(self, sql, params):
+        # called at most once per statement, so one lazily opened connection serves every plan
+        if self.backend is None:
+            return ["plan unavailable: no backend"]
+        with self.log_lock:
+            try:
+                if self.plan_conn is None:
+                    self.plan_conn = self.backend.connect()
+                return self.backend.explain(self.plan_conn, sql, params) or ["plan unavailable: empty plan"]
+            except Exception as e:
+                try:
+                    self.plan_conn.rollback()
+                except Exception:
+                    pass
+                return ["plan unavailable: " + str(e)]
+
+    def report(self, top=20):
+        """The top statements by total time, as printable lines."""
+        with self.lock:
+            statements = sorted(self.statements.items(), key=lambda item: item[1].total_time, reverse=True)
+            total = sum(stats.total_time for _, stats in statements)
+        lines = [f"{'calls':>8}{'total(ms)':>11}{'share':>7}{'mean(ms)':>10}{'max(ms)':>10}{'rows':>9}{'slow':>6}"
+                 f"  statement"]
+        for statement, stats in statements[:top]:
+            share = stats.total_time / total * 100 if total else 0.0
+            lines.append(f"{stats.calls:>8}{stats.total_time * 1000:>11.1f}{share:>6.1f}%"
+                         f"{stats.total_time / stats.calls * 1000:>10.2f}{stats.max_time * 1000:>10.2f}"
+                         f"{stats.rows:>9}{stats.slow:>6}  {shorten(statement)}")
+        lines.append(f"{len(statements)} statements, {total * 1000:.1f} ms in total, "
+                     f"{self.slow_queries} slower than {self.slow_time * 1000:g} ms")
+        return lines
+
+    def stats(self):
+        with self.lock:
+            return {"statements": len(self.statements), "slow_queries": self.slow_queries}
+
+
+def shorten(statement, width=100):
+    return statement if len(statement) <= width else statement[:width - 3] + "..."
+
+
+sql_trace = SQLTrace(enabled=os.getenv("SQLTrace", "1") != "0",
+                     slow_ms=float(os.getenv("SlowQueryMs", "100")),
+                     log_path=os.getenv("SlowQueryLog"),
+                     capture_plans=os.getenv("SlowQueryPlans", "0") != "0")
+metrics.add_source("sql_trace", sql_trace.stats)
@@ -0,0 +1,185 @@
+import datetime
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+from db.Migrator import Migrator
+
+# the application SQL is written with pymssql's %s / %d placeholders
+PLACEHOLDER = re.compile(r"%[sd]")
+
+sqlite3.register_adapter(datetime.date, lambda d: d.isoformat())
+sqlite3.register_adapter(datetime.datetime, lambda d: d.isoformat(" "))
+sqlite3.register_converter("date", lambda b: datetime.date.fromisoformat(b.decode()))
+sqlite3.register_converter("datetime", lambda b: datetime.datetime.fromisoformat(b.decode()))
+
+
+def shuffle_key(seed, value):
+    # SHUFFLE_KEY(seed, value): the same key for equal values, in an order that changes with the seed
+    return hashlib.blake2b((seed + value).encode("utf-8"), digest_size=8).digest()
+
+
+class SQLiteCursor:
+    """Presents a sqlite3 cursor with the parts of the pymssql cursor interface the application uses."""
+
+    translated = {}
+
+    def __init__(self, cursor, as_dict=False):
+        self.cursor = cursor
+        self.as_dict = as_dict
+
+    @classmethod
+    def translate(cls, operation):
+        sql = cls.translated.get(operation)
+        if sql is None:
+            sql = cls.translated[operation] = PLACEHOLDER.sub("?", operation)
+        return sql
+
+    @staticmethod
+    def params(params):
+        # pymssql accepts a bare scalar for a single placeholder
+        if params is None:
+            return ()
+        if isinstance(params, (tuple, list, dict)):
+            return params
+        return (params,)
+
+    def execute(self, operation, params=None):
+        self.cursor.execute(self.translate(operation), self.params(params))
+        return self
+
+    def executemany(self, operation, seq_of_params):
+        self.cursor.executemany(self.translate(operation), [self.params(p) for p in seq_of_params])
+        return self
+
+    def _row(self, row):
+        if row is None or not self.as_dict:
+            return row
+        return {column[0]: value for column, value in zip(self.cursor.description, row)}
+
+    def fetchone(self):
+        return self._row(self.cursor.fetchone())
+
+    def fetchmany(self, size=None):
+        rows = self.cursor.fetchmany(size) if size is not None else self.cursor.fetchmany()
+        return [self._row(row) for row in rows]
+
+    def fetchall(self):
+        return [self._row(row) for row in self.cursor.fetchall()]
+
+    def __iter__(self):
+        for row in self.cursor:
+            yield self._row(row)
+
+    @property
+    def description(self):
+        return self.cursor.description
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        return self.cursor.lastrowid
+
+    def close(self):
+        self.cursor.close()
+
+
+class SQLiteConnection:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def cursor(self, as_dict=False):
+        return SQLiteCursor(self.conn.cursor(), as_dict)
+
+    def commit(self):
+        self.conn.commit()
+
+    def rollback(self):
+        self.conn.rollback()
+
+    def close(self):
+        self.conn.close()
+
+
+class SQLiteBackend:
+    """
+    Embedded SQLite storage, configured by the DBPath environment variable.
+
+    DBPath defaults to scheduler.db in the working directory; ":memory:" gives a
+    private in-process database shared by all pooled connections. Pending schema
+    migrations from resources/migrations/sqlite are applied on first use unless
+    DBAutoMigrate=0, which is also what keeps a database at a version that
+    --migrate down rolled back to. A read_only backend opens an existing file, e.g. a read
+    replica, without writing to it.
+    """
+
+    name = "sqlite"
+    savepoint_sql = "SAVEPOINT %s"
+    rollback_to_savepoint_sql = "ROLLBACK TO SAVEPOINT %s"
+    # a random order of the values of column that keeps equal values together, for a random seed passed as %s
+    shuffle_sql = "SHUFFLE_KEY(%s, {column})"
+    begin_transaction_sql = "BEGIN"
+
+    def __init__(self, path=None, read_only=False):
+        self.path = path or os.getenv("DBPath", "scheduler.db")
+        self.read_only = read_only
+        # --migrate turns this off, so that it works from the schema version the database is at
+        self.auto_migrate = os.getenv("DBAutoMigrate", "1") != "0"
+        self.keeper = None
+        self.lock = threading.Lock()
+        self.initialized = False
+        if self.path == ":memory:":
+            # a named shared-cache database lives as long as one connection to it is open
+            self.path = "file:scheduler-%d?mode=memory&cache=shared" % id(self)
+            self.keeper = self._open()
+        elif read_only:
+            self.path = "file:%s?mode=ro" % self.path
+
+    def replica(self, endpoint):
+        """A backend for the read replica at endpoint, a database file"""
+        return SQLiteBackend(endpoint, read_only=True)
+
+    @staticmethod
+    def explain(conn, sql, params):
+        """The estimated plan of sql as lines, read on conn without running the statement"""
+        cursor = conn.cursor()
+        cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+        depth = {0: -1}
+        lines = []
+        for id, parent, _, detail in cursor.fetchall():
+            depth[id] = depth.get(parent, -1) + 1
+            lines.append("  " * depth[id] + detail)
+        return lines
+
+    @staticmethod
+    def prepare(sql, types):
+        """sql as it is run: each pooled connection compiles it once and keeps it in its statement cache"""
+        return sql
+
+    @staticmethod
+    def limit(select, params, count):
+        """select, limited to its first count rows"""
+        return select + " LIMIT %d", tuple(params) + (count,)
+
+    def _open(self):
+        # the statement cache holds every statement of the application, see db.Repository
+        conn = sqlite3.connect(self.path, detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False,
+                               timeout=30, uri=self.path.startswith("file:"), cached_statements=256)
+        conn.execute("PRAGMA foreign_keys = ON")
+        conn.create_function("SHUFFLE_KEY", 2, shuffle_key, deterministic=True)
+        return conn
+
+    def connect(self):
+        conn = self._open()
+        with self.lock:
+            if not self.initialized and not self.read_only:
+                if self.keeper is None:
+                    conn.execute("PRAGMA journal_mode = WAL")
+                if self.auto_migrate:
+                    Migrator(self, SQLiteConnection(conn)).upgrade()
+                self.initialized = True
+        return SQLiteConnection(conn)
@@ -0,0 +1,161 @@
+import base64
+import datetime
+import hashlib
+import hmac
+import os
+import secrets
+import sys
+import threading
+import time
+from collections import namedtuple
+from db.ConnectionManager import ConnectionManager, retryable
+import db.Repository as Repository
+from util.Metrics import metrics
+
+'''
+Session tokens let a terminal that reconnects or restarts resume its login with `resume <token>`
+instead of logging in again, which costs a PBKDF2 hash.
+
+A token is "<payload>.<signature>", both base64url: the payload names the user kind, expiry, token ID
+and username, and the signature is its HMAC-SHA256 under the key from signing_key(). Checking a token
+needs no hash and no secret per user, only the signature, compared in constant time, the expiry, and a
+lookup in RevokedTokens, where logout records the token's ID until it expires.
+'''
+
+# how long a token is valid, in seconds
+TTL = int(os.getenv("SessionTokenTTL", "86400"))
+# the signing key, see signing_key()
+SECRET = os.getenv("SessionSecret", "").encode("utf-8")
+KINDS = ("patient", "caregiver")
+# expired revocations are purged at most this often, in seconds, by whichever logout comes along
+PURGE_INTERVAL = 300
+
+SessionToken = namedtuple("SessionToken", "kind username id expires")
+
+last_purge = [0.0]
+purge_lock = threading.Lock()
+key = [SECRET or None]
+key_lock = threading.Lock()
+lock = threading.Lock()
+counts = {"issued": 0, "resumed": 0, "refused": 0, "revoked": 0}
+
+
+def encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def signing_key():
+    """
+    SessionSecret, which every process that should accept the same tokens must share.
+
+    Without it, a SQLite database file gets a random key of its own, kept next to it in "<DBPath>.secret", so
+    that tokens survive restarts of the processes using that file. Anything else, e.g. SQL Server, gets a random
+    key for this process only, with a warning: its tokens stop working when it exits and on every other process.
+    """
+    with key_lock:
+        if key[0] is None:
+            backend = ConnectionManager.get_backend()
+            if backend.name == "sqlite" and not backend.path.startswith("file:"):
+                key[0] = load_key_file(backend.path + ".secret")
+            else:
+                print("SessionSecret is not set: session tokens only work until this process exits",
+                      file=sys.stderr)
+                key[0] = secrets.token_bytes(32)
+        return key[0]
+
+
+def load_key_file(path):
+    if not os.path.exists(path):
+        # written in full under a name of its own, then linked into place unless another process got there first
+        new_path = "%s.%d" % (path, os.getpid())
+        with open(os.open(new_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as f:
+            f.write(secrets.token_hex(32))
+        try:
+            os.link(new_path, path)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(new_path)
+    with open(path) as f:
+        return bytes.fromhex(f.read().strip())
+
+
+def sign(payload):
+    return hmac.new(signing_key(), payload, hashlib.sha256).digest()
+
+
+def count(event):
+    with lock:
+        counts[event] += 1
+
+
+def issue(kind, username):
+    """A new token for the user; returns its text and the SessionToken it stands for."""
+    token = SessionToken(kind, username, secrets.token_hex(12), int(time.time()) + TTL)
+    payload = "|".join((token.kind, str(token.expires), token.id, token.username)).encode("utf-8")
+    count("issued")
+    return encode(payload) + "." + encode(sign(payload)), token
+
+
+def parse(text):
+    """The SessionToken text stands for, or None unless it is well-formed, correctly signed and unexpired."""
+    try:
+        payload_text, signature_text = text.split(".")
+        payload, signature = decode(payload_text), decode(signature_text)
+    except ValueError:
+        return None
+    if not hmac.compare_digest(sign(payload), signature):
+        return None
+    kind, expires, id, username = payload.decode("utf-8").split("|", 3)
+    if kind not in KINDS or int(expires) <= time.time():
+        return None
+    return SessionToken(kind, username, id, int(expires))
+
+
+@retryable
+def is_revoked(token):
+    # read on the primary: a logout has to take effect everywhere at once
+    with ConnectionManager() as conn:
+        return Repository.revoked_token.one(conn, (token.id,)) is not None
+
+
+def resume(text):
+    """The SessionToken text stands for if it may resume a session, otherwise None."""
+    token = parse(text)
+    if token is None or is_revoked(token):
+        count("refused")
+        return None
+    count("resumed")
+    return token
+
+
+@retryable
+def revoke(token):
+    expires = datetime.datetime.fromtimestamp(token.expires)
+    with ConnectionManager() as conn:
+        cursor = conn.cursor()
+        purge_expired(cursor)
+        Repository.revoke_token.execute(cursor, (token.id, expires, token.id))
+        conn.commit()
+    count("revoked")
+
+
+def purge_expired(cursor):
+    # a revoked token that has expired is refused by parse() anyway
+    with purge_lock:
+        if time.monotonic() - last_purge[0] < PURGE_INTERVAL:
+            return
+        last_purge[0] = time.monotonic()
+    Repository.purge_revoked_tokens.execute(cursor, (datetime.datetime.now(),))
+
+
+def stats():
+    with lock:
+        return dict(counts)
+
+
+metrics.add_source("session_tokens", stats)
@@ -0,0 +1,110 @@
+import bisect
+import os
+import threading
+import time
+from collections import OrderedDict
+from util.Metrics import metrics
+
+MINUTES_PER_DAY = 24 * 60
+
+
+def format_slot(slot):
+    """A slot, stored as minutes after midnight, as HH:MM."""
+    return "%02d:%02d" % divmod(slot, 60)
+
+
+class SlotIndex:
+    """
+    The free caregiver slots of each date, kept in memory for slot search.
+
+    A date is loaded from Availabilities the first time it is asked for, as a
+    list of (slot, username) pairs sorted by slot, so the free slots within a
+    time window are found by bisection. Writers in this process apply their
+    changes with add() and remove() after committing instead of reloading the
+    date; a date is reloaded once it is older than `ttl` seconds, which picks up
+    changes made by other processes. At most `max_dates` dates are kept.
+
+    Every change bumps `generation`, whether or not its date is loaded, and a
+    date loaded while it changed is answered from but not kept: the load may
+    have read the database before that change was committed.
+    """
+
+    def __init__(self, max_dates=366, ttl=30.0):
+        self.max_dates = max_dates
+        self.ttl = ttl
+        # date -> (loaded at, sorted [(slot, username)])
+        self.dates = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.loads = 0
+        self.generation = 0
+        self.discarded = 0
+
+    def free_slots(self, d, load, start=0, end=MINUTES_PER_DAY):
+        """The (slot, username) pairs free on d with start <= slot < end; load() reads them from the database."""
+        now = time.monotonic()
+        with self.lock:
+            entry = self.dates.get(d)
+            if entry is not None and entry[0] + self.ttl > now:
+                self.dates.move_to_end(d)
+                self.hits += 1
+                return self._between(entry[1], start, end)
+            self.loads += 1
+            generation = self.generation
+        # load outside the lock so a slow query does not block lookups of other dates
+        slots = sorted(load())
+        with self.lock:
+            if self.generation != generation:
+                self.discarded += 1
+                return self._between(slots, start, end)
+            self.dates[d] = (now, slots)
+            self.dates.move_to_end(d)
+            while len(self.dates) > self.max_dates:
+                self.dates.popitem(last=False)
+            return self._between(slots, start, end)
+
+    @staticmethod
+    def _between(slots, start, end):
+        return slots[bisect.bisect_left(slots, (start,)):bisect.bisect_left(slots, (end,))]
+
+    def add(self, d, slots):
+        # dates that are not loaded yet will be read in full when they are first asked for
+        with self.lock:
+            self.generation += 1
+            entry = self.dates.get(d)
+            if entry is None:
+                return
+            for slot in slots:
+                i = bisect.bisect_left(entry[1], slot)
+                if i == len(entry[1]) or entry[1][i] != slot:
+                    entry[1].insert(i, slot)
+
+    def remove(self, d, slot, username):
+        with self.lock:
+            self.generation += 1
+            entry = self.dates.get(d)
+            if entry is None:
+                return
+            i = bisect.bisect_left(entry[1], (slot, username))
+            if i < len(entry[1]) and entry[1][i] == (slot, username):
+                del entry[1][i]
+
+    def invalidate(self, *dates):
+        with self.lock:
+            self.generation += 1
+            for d in dates:
+                self.dates.pop(d, None)
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.dates.clear()
+
+    def stats(self):
+        with self.lock:
+            return {"dates": len(self.dates), "slots": sum(len(slots) for _, slots in self.dates.values()),
+                    "hits": self.hits, "loads": self.loads, "discarded": self.discarded}
+
+
+slot_index = SlotIndex(max_dates=int(os.getenv("SlotIndexDates", "366")), ttl=float(os.getenv("CacheTTL", "30")))
+metrics.add_source("slot_index", slot_index.stats)
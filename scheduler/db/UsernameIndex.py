@@ -0,0 +1,81 @@
+import threading
+from db.ConnectionManager import ConnectionManager
+import db.Repository as Repository
+from util.BloomFilter import BloomFilter
+from util.Metrics import metrics
+
+# false "maybe taken" answers, each of which costs a lookup
+ERROR_RATE = 0.01
+
+
+class UsernameIndex:
+    """
+    The usernames a user table may already have, so that sign-ups for a free name skip the lookup.
+
+    A Bloom filter over the table's usernames, read in full on first use and
+    kept current by add() as this process creates users; it is rebuilt from
+    the table once it holds twice as many names as it was read with. A name
+    the filter has never seen is free as far as this process knows and goes
+    straight to the conditional insert, which still has the last word, e.g.
+    for a name another process took meanwhile. A name the filter may have
+    seen is looked up, since one in 100 such answers is wrong. Names are
+    compared case-insensitively, as SQL Server's default collation does.
+    """
+
+    def __init__(self, names):
+        self.names = names
+        self.filter = None
+        self.lock = threading.Lock()
+        self.load_lock = threading.Lock()
+        self.loads = 0
+        self.skipped_lookups = 0
+        self.lookups = 0
+
+    def load(self):
+        # one loader at a time; the others wait for its filter rather than read the table again
+        with self.load_lock:
+            current = self.filter
+            if current is not None and current.count < current.capacity:
+                return current
+            cm = ConnectionManager(read_only=True, cached=True)
+            conn = cm.create_connection()
+            try:
+                names = [row[0].casefold() for row in self.names.each(conn, size=1000)]
+            finally:
+                cm.close_connection()
+            bloom = BloomFilter(max(2 * len(names), 1024), ERROR_RATE)
+            for name in names:
+                bloom.add(name)
+            with self.lock:
+                self.filter = bloom
+                self.loads += 1
+            return bloom
+
+    def might_exist(self, username):
+        """False if username is not taken as far as this process knows, True if it has to be looked up"""
+        bloom = self.filter
+        if bloom is None or bloom.count >= bloom.capacity:
+            bloom = self.load()
+        found = username.casefold() in bloom
+        with self.lock:
+            if found:
+                self.lookups += 1
+            else:
+                self.skipped_lookups += 1
+        return found
+
+    def add(self, username):
+        with self.lock:
+            if self.filter is not None:
+                self.filter.add(username.casefold())
+
+    def stats(self):
+        with self.lock:
+            return {"names": self.filter.count if self.filter is not None else 0, "loads": self.loads,
+                    "lookups": self.lookups, "skipped_lookups": self.skipped_lookups}
+
+
+patient_names = UsernameIndex(Repository.patient_names)
+caregiver_names = UsernameIndex(Repository.caregiver_names)
+metrics.add_source("patient_names", patient_names.stats)
+metrics.add_source("caregiver_names", caregiver_names.stats)
@@ -0,0 +1,127 @@
+import datetime
+import os
+import secrets
+import threading
+
+
+def week_of(d):
+    """The Monday starting d's week, the key of the CaregiverLoad counters."""
+    return d - datetime.timedelta(days=d.weekday())
+
+
+class CaregiverLoad:
+    """
+    Bookings per caregiver per week, kept in step with Reservations by reserve and cancel.
+
+    The counters are updated in the same transaction as the reservation they count. They are weekly so
+    that least_loaded sums a handful of rows per caregiver over its window, where daily counters would take
+    seven times as many; a caregiver can be booked for any number of slots a day, so a day is no natural unit.
+    """
+
+    add_booking_sqlite = ("INSERT INTO CaregiverLoad (Username, Week_Start, Bookings) VALUES (%s, %s, 1) "
+                          "ON CONFLICT (Username, Week_Start) DO UPDATE SET Bookings = Bookings + 1")
+    # T-SQL fragment for the reserve batch, counting the caregiver and date held in @claimed; the range lock
+    # keeps two first bookings of the same caregiver and week from both inserting. Shifting the date back a day
+    # makes DATEDIFF(week), which counts Sundays, count Monday-based weeks from 1900-01-01, a Monday.
+    add_booking_mssql = """
+        DECLARE @week date = (SELECT DATEADD(week, DATEDIFF(week, '19000101', DATEADD(day, -1, Time)), '19000101')
+                              FROM @claimed);
+        UPDATE CaregiverLoad WITH (UPDLOCK, SERIALIZABLE) SET Bookings = Bookings + 1
+        WHERE Username = (SELECT Username FROM @claimed) AND Week_Start = @week;
+        IF @@ROWCOUNT = 0
+            INSERT INTO CaregiverLoad (Username, Week_Start, Bookings) SELECT Username, @week, 1 FROM @claimed"""
+    remove_booking = "UPDATE CaregiverLoad SET Bookings = Bookings - 1 WHERE Username = %s AND Week_Start = %s"
+    # bulk bookings: add to the existing counters, then insert the ones that are missing
+    add_bookings = "UPDATE CaregiverLoad SET Bookings = Bookings + %d WHERE Username = %s AND Week_Start = %s"
+    insert_bookings = ("INSERT INTO CaregiverLoad (Username, Week_Start, Bookings) SELECT %s, %s, %d "
+                       "WHERE NOT EXISTS (SELECT 1 FROM CaregiverLoad WHERE Username = %s AND Week_Start = %s)")
+
+
+# Each strategy orders the candidate caregivers of a date, as an ORDER BY over Availabilities aliased `a`,
+# and reserve claims the first one. The ordering runs inside the claiming statement, so concurrent bookings
+# still each take a different caregiver.
+
+class AlphabeticalAssignment:
+    """The first free caregiver by username."""
+
+    name = "alphabetical"
+
+    def order_by(self, d, backend):
+        return "ORDER BY a.Username", ()
+
+    def assigned(self, d, username):
+        pass
+
+
+class LeastLoadedAssignment:
+    """The free caregiver with the fewest bookings within `window_weeks` weeks either side of the date."""
+
+    name = "least_loaded"
+
+    def __init__(self, window_weeks=None):
+        self.window_weeks = window_weeks if window_weeks is not None else int(os.getenv("LoadWindowWeeks", "2"))
+
+    def order_by(self, d, backend):
+        week = week_of(d)
+        window = datetime.timedelta(weeks=self.window_weeks)
+        return ("ORDER BY (SELECT COALESCE(SUM(l.Bookings), 0) FROM CaregiverLoad l "
+                "WHERE l.Username = a.Username AND l.Week_Start >= %s AND l.Week_Start <= %s), a.Username",
+                (week - window, week + window))
+
+    def assigned(self, d, username):
+        pass
+
+
+class RoundRobinAssignment:
+    """The first free caregiver after the one this process assigned last, wrapping around by username."""
+
+    name = "round_robin"
+
+    def __init__(self):
+        self.last = ""
+        self.lock = threading.Lock()
+
+    def order_by(self, d, backend):
+        with self.lock:
+            last = self.last
+        return "ORDER BY CASE WHEN a.Username > %s THEN 0 ELSE 1 END, a.Username", (last,)
+
+    def assigned(self, d, username):
+        with self.lock:
+            self.last = username
+
+
+class RandomAssignment:
+    """Any free caregiver, picked uniformly, and then that caregiver's earliest free slot."""
+
+    name = "random"
+
+    def order_by(self, d, backend):
+        # a key per caregiver rather than per row, so that the slots of the chosen caregiver stay in order
+        return "ORDER BY " + backend.shuffle_sql.format(column="a.Username"), (secrets.token_hex(8),)
+
+    def assigned(self, d, username):
+        pass
+
+
+STRATEGIES = {
+    AlphabeticalAssignment.name: AlphabeticalAssignment,
+    LeastLoadedAssignment.name: LeastLoadedAssignment,
+    RoundRobinAssignment.name: RoundRobinAssignment,
+    RandomAssignment.name: RandomAssignment,
+}
+
+strategy = None
+strategy_lock = threading.Lock()
+
+
+def get_assignment_strategy():
+    """The process-wide strategy named by the CaregiverAssignment environment variable (default: alphabetical)."""
+    global strategy
+    with strategy_lock:
+        if strategy is None:
+            name = os.getenv("CaregiverAssignment", AlphabeticalAssignment.name).lower()
+            if name not in STRATEGIES:
+                raise ValueError("Unknown CaregiverAssignment " + name + ", expected one of: " + ", ".join(STRATEGIES))
+            strategy = STRATEGIES[name]()
+        return strategy
@@ -1,12 +1,17 @@
 import sys
 sys.path.append("../util/*")
 sys.path.append("../db/*")
-from util.Util import Util
-from db.ConnectionManager import ConnectionManager
-import pymssql
+from util.HashExecutor import get_hash_executor
+from db.ConnectionManager import ConnectionManager, retryable
+from db.Backend import DBError
+import db.Repository as Repository
+from db.UsernameIndex import caregiver_names
+from db.SlotIndex import slot_index
 
 
 class Caregiver:
+    __slots__ = ("username", "password", "salt", "hash")
+
     def __init__(self, username, password=None, salt=None, hash=None):
         self.username = username
         self.password = password
@@ -14,32 +19,34 @@ class Caregiver:
         self.hash = hash
 
     # getters
+    @retryable
     def get(self):
-        cm = ConnectionManager()
-        conn = cm.create_connection()
-        cursor = conn.cursor(as_dict=True)
+        cm = ConnectionManager(read_only=True)
+        while True:
+            conn = cm.create_connection()
+            try:
+                row = Repository.caregiver_credentials.one(conn, (self.username,))
+            except DBError as e:
+                raise e
+            finally:
+                cm.close_connection()
+            if row is not None or cm.replica is None:
+                break
+            # a caregiver registered moments ago may not have reached the replica yet
+            cm = ConnectionManager()
+        if row is None:
+            return None
 
-        get_caregiver_details = "SELECT Salt, Hash FROM Caregivers WHERE Username = %s"
-        try:
-            cursor.execute(get_caregiver_details, self.username)
-            for row in cursor:
-                curr_salt = row['Salt']
-                curr_hash = row['Hash']
-                calculated_hash = Util.generate_hash(self.password, curr_salt)
-                if not curr_hash == calculated_hash:
-                    # print("Incorrect password")
-                    cm.close_connection()
-                    return None
-                else:
-                    self.salt = curr_salt
-                    self.hash = calculated_hash
-                    cm.close_connection()
-                    return self
-        except pymssql.Error as e:
-            raise e
-        finally:
-            cm.close_connection()
-        return None
+        # verify the password on the hash executor, with the connection already back in the pool
+        curr_salt = row.salt
+        curr_hash = row.hash
+        calculated_hash = get_hash_executor().generate_hash(self.password, curr_salt)
+        if not curr_hash == calculated_hash:
+            # print("Incorrect password")
+            return None
+        self.salt = curr_salt
+        self.hash = calculated_hash
+        return self
 
     def get_username(self):
         return self.username
@@ -50,34 +57,69 @@ class Caregiver:
     def get_hash(self):
         return self.hash
 
+    # Inserts the caregiver unless the username is taken meanwhile; returns whether it was inserted.
+    @retryable
     def save_to_db(self):
         cm = ConnectionManager()
         conn = cm.create_connection()
         cursor = conn.cursor()
 
-        add_caregivers = "INSERT INTO Caregivers VALUES (%s, %s, %s)"
         try:
-            cursor.execute(add_caregivers, (self.username, self.salt, self.hash))
+            added = Repository.add_caregiver.execute(cursor, (self.username, self.salt, self.hash,
+                                                      self.username)).rowcount == 1
             # you must call commit() to persist your data if you don't set autocommit to True
             conn.commit()
-        except pymssql.Error:
+        except DBError:
             raise
         finally:
             cm.close_connection()
+        # taken either way
+        caregiver_names.add(self.username)
+        return added
 
-    # Insert availability with parameter date d
-    def upload_availability(self, d):
+    # Insert availability with parameter date d, for the slot starting `slot` minutes after midnight
+    @retryable
+    def upload_availability(self, d, slot=0):
         cm = ConnectionManager()
         conn = cm.create_connection()
         cursor = conn.cursor()
 
-        add_availability = "INSERT INTO Availabilities VALUES (%s , %s)"
         try:
-            cursor.execute(add_availability, (d, self.username))
+            Repository.add_slot.execute(cursor, (d, self.username, slot))
             # you must call commit() to persist your data if you don't set autocommit to True
             conn.commit()
-        except pymssql.Error:
+            slot_index.add(d, [(slot, self.username)])
+        except DBError:
             # print("Error occurred when updating caregiver availability")
             raise
         finally:
             cm.close_connection()
+
+    # Insert availability for every slot (minutes after midnight) on every date in dates in one transaction,
+    # skipping slots already uploaded or booked. Returns the number of slots added and the number already present.
+    @retryable
+    def upload_availabilities(self, dates, slots=(0,)):
+        dates = sorted(set(dates))
+        slots = sorted(set(slots))
+        if not dates or not slots:
+            return 0, 0
+
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+
+        try:
+            existing = set(Repository.caregiver_slots.all(conn, (self.username, dates[0], dates[-1], self.username,
+                                                                  dates[0], dates[-1])))
+            new_slots = [(d, slot) for d in dates for slot in slots if (d, slot) not in existing]
+            if new_slots:
+                Repository.add_slot.executemany(cursor, [(d, self.username, slot) for d, slot in new_slots])
+            conn.commit()
+            added = {}
+            for d, slot in new_slots:
+                added.setdefault(d, []).append((slot, self.username))
+            for d, free in added.items():
+                slot_index.add(d, free)
+        finally:
+            cm.close_connection()
+        return len(new_slots), len(dates) * len(slots) - len(new_slots)
@@ -1,12 +1,16 @@
 import sys
 sys.path.append("../util/*")
 sys.path.append("../db/*")
-from util.Util import Util
-from db.ConnectionManager import ConnectionManager
-import pymssql
+from util.HashExecutor import get_hash_executor
+from db.ConnectionManager import ConnectionManager, retryable
+from db.Backend import DBError
+import db.Repository as Repository
+from db.UsernameIndex import patient_names
 
 
 class Patient:
+    __slots__ = ("username", "password", "salt", "hash")
+
     def __init__(self, username, password=None, salt=None, hash=None):
         self.username = username
         self.password = password
@@ -14,32 +18,34 @@ class Patient:
         self.hash = hash
 
     # getters
+    @retryable
     def get(self):
-        cm = ConnectionManager()
-        conn = cm.create_connection()
-        cursor = conn.cursor(as_dict=True)
+        cm = ConnectionManager(read_only=True)
+        while True:
+            conn = cm.create_connection()
+            try:
+                row = Repository.patient_credentials.one(conn, (self.username,))
+            except DBError as e:
+                raise e
+            finally:
+                cm.close_connection()
+            if row is not None or cm.replica is None:
+                break
+            # a patient registered moments ago may not have reached the replica yet
+            cm = ConnectionManager()
+        if row is None:
+            return None
 
-        get_patient_details = "SELECT Salt, Hash FROM Patients WHERE Username = %s"
-        try:
-            cursor.execute(get_patient_details, self.username)
-            for row in cursor:
-                curr_salt = row['Salt']
-                curr_hash = row['Hash']
-                calculated_hash = Util.generate_hash(self.password, curr_salt)
-                if not curr_hash == calculated_hash:
-                    # print("Incorrect password")
-                    cm.close_connection()
-                    return None
-                else:
-                    self.salt = curr_salt
-                    self.hash = calculated_hash
-                    cm.close_connection()
-                    return self
-        except pymssql.Error as e:
-            raise e
-        finally:
-            cm.close_connection()
-        return None
+        # verify the password on the hash executor, with the connection already back in the pool
+        curr_salt = row.salt
+        curr_hash = row.hash
+        calculated_hash = get_hash_executor().generate_hash(self.password, curr_salt)
+        if not curr_hash == calculated_hash:
+            # print("Incorrect password")
+            return None
+        self.salt = curr_salt
+        self.hash = calculated_hash
+        return self
 
     def get_username(self):
         return self.username
@@ -50,17 +56,22 @@ class Patient:
     def get_hash(self):
         return self.hash
 
+    # Inserts the patient unless the username is taken meanwhile; returns whether it was inserted.
+    @retryable
     def save_to_db(self):
         cm = ConnectionManager()
         conn = cm.create_connection()
         cursor = conn.cursor()
 
-        add_patients = "INSERT INTO Patients VALUES (%s, %s, %s)"
         try:
-            cursor.execute(add_patients, (self.username, self.salt, self.hash))
+            added = Repository.add_patient.execute(cursor, (self.username, self.salt, self.hash,
+                                                      self.username)).rowcount == 1
             # you must call commit() to persist your data if you don't set autocommit to True
             conn.commit()
-        except pymssql.Error:
+        except DBError:
             raise
         finally:
             cm.close_connection()
+        # taken either way
+        patient_names.add(self.username)
+        return added
@@ -0,0 +1,239 @@
+import datetime
+import sys
+sys.path.append("../db/*")
+from db.ConnectionManager import ConnectionManager, retryable
+from db.Backend import DBError
+import db.ReadCache as ReadCache
+import db.Repository as Repository
+from db.SlotIndex import slot_index, format_slot
+from model.Vaccine import Vaccine
+from model.Assignment import CaregiverLoad, get_assignment_strategy, week_of
+import db.IdempotencyKeys as IdempotencyKeys
+
+
+class ReservationError(Exception):
+    # capacity is set when the request may succeed once there are free slots or doses, e.g. from the waitlist
+    def __init__(self, message, capacity=False):
+        super().__init__(message)
+        self.capacity = capacity
+
+
+class Reservation:
+    def __init__(self, patient_name, vaccine_name, reservation_time, caregiver_name=None, id=None, slot=None,
+                 latest_time=None):
+        self.patient_name = patient_name
+        self.vaccine_name = vaccine_name
+        self.reservation_time = reservation_time
+        self.caregiver_name = caregiver_name
+        self.id = id
+        # start of the slot in minutes after midnight; None books the chosen caregiver's earliest free slot
+        self.slot = slot
+        # when set, the earliest free date from reservation_time to latest_time is booked
+        self.latest_time = latest_time
+        # the outcome recorded for an idempotency key that was already used
+        self.replayed_outcome = None
+
+    # Claim a free caregiver slot for the date (at self.slot, if set), take one dose and insert the reservation,
+    # all in one transaction. Raises ReservationError when the vaccine does not exist, no caregiver is free or the
+    # vaccine is out of doses.
+    # With an idempotency_key, a repeated call only sets replayed_outcome to the first call's outcome.
+    @retryable
+    def save_to_db(self, idempotency_key=None):
+        # what was asked for, which a booking that is rolled back must not leave narrowed for a retry
+        requested = (self.reservation_time, self.slot, self.caregiver_name, self.id)
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor(as_dict=True)
+        try:
+            if idempotency_key is not None:
+                self.replayed_outcome = IdempotencyKeys.claim(cursor, idempotency_key, self.patient_name,
+                                                              self.command())
+                if self.replayed_outcome is not None:
+                    return self
+            status = self.book(cursor)
+            if status != "ok":
+                conn.rollback()
+                if Repository.vaccine_exists.one(conn, (self.vaccine_name,)) is None:
+                    raise ReservationError("Vaccine not found")
+            if status == "no_caregiver":
+                raise ReservationError("No caregiver is available", capacity=True)
+            if status == "no_doses":
+                raise ReservationError("Not enough available doses", capacity=True)
+            if idempotency_key is not None:
+                IdempotencyKeys.record(cursor, idempotency_key, self.patient_name, self.get_outcome())
+            conn.commit()
+            self.booked()
+            Vaccine.count_ledger_writes(1)
+        except DBError:
+            self.reservation_time, self.slot, self.caregiver_name, self.id = requested
+            raise
+        finally:
+            cm.close_connection()
+        return self
+
+    # The request as recorded with its idempotency key, so that reusing the key for another date, slot or vaccine
+    # is rejected rather than answered with the other booking's outcome.
+    def command(self):
+        slot = format_slot(self.slot) if self.slot is not None else "any"
+        return "reserve " + self.reservation_time.isoformat() + " " + slot + " " + self.vaccine_name
+
+    # Cancel appointment id on behalf of username, its caregiver if caregiver is set and otherwise its patient, all
+    # in one transaction: the slot and the dose are given back and the booking comes off the caregiver's load.
+    # Returns the outcome and the canceled appointment, a Repository.Appointment, or the first call's outcome and
+    # None when idempotency_key was already used. Raises ReservationError when the user may not cancel it.
+    @staticmethod
+    @retryable
+    def cancel(id, username, caregiver=False, idempotency_key=None):
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor(as_dict=True)
+        try:
+            if idempotency_key is not None:
+                # a retry of a cancel that already went through gets the same answer
+                previous_outcome = IdempotencyKeys.claim(cursor, idempotency_key, username, "cancel " + str(id))
+                if previous_outcome is not None:
+                    return previous_outcome, None
+
+            appointment = Repository.appointment.one(conn, (id,))
+            if appointment is None:
+                raise ReservationError("Appointment not found")
+            if (appointment.caregiver_name if caregiver else appointment.patient_name) != username:
+                raise ReservationError("Unauthorized action")
+
+            # unless a concurrent cancel got there first
+            if Repository.delete_appointment.execute(cursor, (id,)).rowcount == 0:
+                raise ReservationError("Appointment not found")
+            # the caregiver may have uploaded the slot again meanwhile
+            Repository.restore_slot.execute(cursor, (appointment.reservation_time, appointment.caregiver_name,
+                                                     appointment.slot, appointment.reservation_time,
+                                                     appointment.caregiver_name, appointment.slot))
+            cursor.execute(CaregiverLoad.remove_booking, (appointment.caregiver_name,
+                                                          week_of(appointment.reservation_time)))
+            cursor.execute(Vaccine.add_delta, (appointment.vaccine_name, 1, datetime.datetime.now()))
+
+            outcome = f"Appointment {id} canceled successfully"
+            if idempotency_key is not None:
+                IdempotencyKeys.record(cursor, idempotency_key, username, outcome)
+            conn.commit()
+        finally:
+            cm.close_connection()
+        slot_index.add(appointment.reservation_time, [(appointment.slot, appointment.caregiver_name)])
+        ReadCache.invalidate_vaccines()
+        Vaccine.count_ledger_writes(1)
+        return outcome, appointment
+
+    # Books the reservation on cursor, an as_dict cursor, without committing: returns "ok", or "no_caregiver" /
+    # "no_doses" after which the caller must roll the booking's writes back. Call booked() once it is committed.
+    def book(self, cursor):
+        strategy = get_assignment_strategy()
+        order_by = strategy.order_by(self.reservation_time, ConnectionManager.get_backend())
+        if ConnectionManager.get_backend().name == "mssql":
+            return self._reserve_mssql(cursor, order_by)
+        return self._reserve_sqlite(cursor, order_by)
+
+    # Brings this process's in-memory state up to date with a committed booking.
+    def booked(self):
+        get_assignment_strategy().assigned(self.reservation_time, self.caregiver_name)
+        slot_index.remove(self.reservation_time, self.slot, self.caregiver_name)
+        ReadCache.invalidate_vaccines()
+
+    # One statement batch: READPAST skips caregiver rows other bookings have already claimed,
+    # so concurrent reservations for the same date each take a different caregiver instead of queueing.
+    # {order_by} is the assignment strategy's choice among the free caregivers, see model.Assignment, and the
+    # earliest free slot of that caregiver is taken unless {slot_filter} asks for a given one.
+    reserve_mssql = """
+        SET NOCOUNT ON;
+        DECLARE @claimed TABLE (Username varchar(255), Time date, Slot int);
+        WITH candidate AS (
+            SELECT TOP (1) a.Username, a.Time, a.Slot FROM Availabilities a WITH (UPDLOCK, READPAST, ROWLOCK)
+            WHERE a.Time >= %s AND a.Time <= %s{slot_filter} {order_by}
+        )
+        DELETE FROM candidate OUTPUT deleted.Username, deleted.Time, deleted.Slot INTO @claimed;
+        IF NOT EXISTS (SELECT 1 FROM @claimed)
+            SELECT 'no_caregiver' AS Status, NULL AS ID, NULL AS Caregiver_Name, NULL AS Time, NULL AS Slot;
+        ELSE
+        BEGIN
+            {take_dose};
+            IF @@ROWCOUNT = 0
+                SELECT 'no_doses' AS Status, NULL AS ID, NULL AS Caregiver_Name, NULL AS Time, NULL AS Slot;
+            ELSE
+            BEGIN
+                INSERT INTO Reservations (Patient_Name, Caregiver_Name, Vaccine_Name, Reservation_Time, Slot)
+                SELECT %s, Username, %s, Time, Slot FROM @claimed;
+                DECLARE @id int = SCOPE_IDENTITY();
+                {add_booking};
+                SELECT 'ok' AS Status, @id AS ID, Username AS Caregiver_Name, Time, Slot FROM @claimed;
+            END
+        END
+    """
+
+    def _reserve_mssql(self, cursor, order_by):
+        now = datetime.datetime.now()
+        slot_filter, slot_params = self._slot_filter()
+        order_by_sql, order_by_params = self._order_by(order_by)
+        cursor.execute(self.reserve_mssql.format(slot_filter=slot_filter, order_by=order_by_sql,
+                                                 take_dose=Vaccine.take_doses_sql(),
+                                                 add_booking=CaregiverLoad.add_booking_mssql),
+                       (self.reservation_time, self.latest_time or self.reservation_time) + slot_params +
+                       order_by_params + (1, now, self.vaccine_name, 1, self.patient_name, self.vaccine_name))
+        row = cursor.fetchone()
+        if row['Status'] == "ok":
+            self.id = row['ID']
+            self.caregiver_name = row['Caregiver_Name']
+            self.reservation_time = row['Time']
+            self.slot = row['Slot']
+        return row['Status']
+
+    def _slot_filter(self):
+        if self.slot is None:
+            return "", ()
+        return " AND a.Slot = %d", (self.slot,)
+
+    @staticmethod
+    def _order_by(order_by):
+        # the earliest date first, then the strategy's pick among that date's caregivers, then their earliest slot
+        order_by_sql, order_by_params = order_by
+        return "ORDER BY a.Time, " + order_by_sql[len("ORDER BY "):] + ", a.Slot", order_by_params
+
+    # SQLite has a single writer, so starting the transaction with the claiming DELETE serializes bookings.
+    claim_sqlite = ("DELETE FROM Availabilities WHERE rowid = "
+                    "(SELECT a.rowid FROM Availabilities a WHERE a.Time >= %s AND a.Time <= %s{slot_filter} "
+                    "{order_by} LIMIT 1) RETURNING Username, Time, Slot")
+    insert_reservation = ("INSERT INTO Reservations (Patient_Name, Caregiver_Name, Vaccine_Name, Reservation_Time, "
+                          "Slot) VALUES (%s, %s, %s, %s, %d)")
+
+    def _reserve_sqlite(self, cursor, order_by):
+        slot_filter, slot_params = self._slot_filter()
+        order_by_sql, order_by_params = self._order_by(order_by)
+        cursor.execute(self.claim_sqlite.format(slot_filter=slot_filter, order_by=order_by_sql),
+                       (self.reservation_time, self.latest_time or self.reservation_time) + slot_params +
+                       order_by_params)
+        row = cursor.fetchone()
+        if row is None:
+            return "no_caregiver"
+        caregiver_name, reservation_time, slot = row['Username'], row['Time'], row['Slot']
+        cursor.execute(Vaccine.take_doses_sql(), (1, datetime.datetime.now(), self.vaccine_name, 1))
+        if cursor.rowcount == 0:
+            return "no_doses"
+        cursor.execute(self.insert_reservation, (self.patient_name, caregiver_name, self.vaccine_name,
+                                                 reservation_time, slot))
+        self.id = cursor.lastrowid
+        cursor.execute(CaregiverLoad.add_booking_sqlite, (caregiver_name, week_of(reservation_time)))
+        self.caregiver_name = caregiver_name
+        self.reservation_time = reservation_time
+        self.slot = slot
+        return "ok"
+
+    def get_id(self):
+        return self.id
+
+    def get_caregiver_name(self):
+        return self.caregiver_name
+
+    def get_slot(self):
+        return self.slot
+
+    def get_outcome(self):
+        if self.replayed_outcome is not None:
+            return self.replayed_outcome
+        return f"Appointment ID {self.id}, Caregiver username {self.caregiver_name}, Time {format_slot(self.slot)}"
@@ -1,27 +1,59 @@
+import datetime
+import os
+import threading
 import sys
 sys.path.append("../db/*")
-from db.ConnectionManager import ConnectionManager
-import pymssql
+from db.ConnectionManager import ConnectionManager, retryable
+from db.Backend import DBError
+import db.ReadCache as ReadCache
+import db.Repository as Repository
+from util.Metrics import metrics
+
+'''
+Dose counts are kept as an append-only ledger: every change inserts a (Name, Delta) row into
+VaccineLedger instead of rewriting Vaccines.Doses, so concurrent restocks never lose an update and
+do not lock the vaccine row. The balance of a vaccine is its Doses plus the deltas not yet
+compacted; compact_ledger() periodically folds the ledger back into Vaccines.Doses.
+'''
+
+# ledger rows written by this process since the last compaction, see compact_ledger()
+COMPACT_EVERY = int(os.getenv("LedgerCompactEvery", "1000"))
+ledger_writes = [0]
+ledger_lock = threading.Lock()
 
 
 class Vaccine:
+    __slots__ = ("vaccine_name", "available_doses")
+
+    add_delta = "INSERT INTO VaccineLedger (Name, Delta, Created_At) VALUES (%s, %d, %s)"
+    # takes num doses only if the balance covers them; on SQL Server the UPDLOCK on the vaccine row
+    # serializes takers of the same vaccine while restocks, which only insert, carry on
+    take_doses = ("INSERT INTO VaccineLedger (Name, Delta, Created_At) "
+                  "SELECT v.Name, -%d, %s FROM Vaccines v{vaccine_hint} "
+                  "WHERE v.Name = %s AND " + Repository.BALANCE + " >= %d")
+
     def __init__(self, vaccine_name, available_doses):
         self.vaccine_name = vaccine_name
         self.available_doses = available_doses
 
+    @staticmethod
+    def take_doses_sql():
+        if ConnectionManager.get_backend().name == "mssql":
+            return Vaccine.take_doses.format(vaccine_hint=" WITH (UPDLOCK, ROWLOCK)", hint=" WITH (READCOMMITTEDLOCK)")
+        return Vaccine.take_doses.format(vaccine_hint="", hint="")
+
     # getters
+    @retryable
     def get(self):
-        cm = ConnectionManager()
+        cm = ConnectionManager(read_only=True)
         conn = cm.create_connection()
-        cursor = conn.cursor()
 
-        get_vaccine = "SELECT Name, Doses FROM Vaccines WHERE Name = %s"
         try:
-            cursor.execute(get_vaccine, self.vaccine_name)
-            for row in cursor:
-                self.available_doses = row[1]
+            balance = Repository.vaccine_balance.one(conn, (self.vaccine_name,))
+            if balance is not None:
+                self.available_doses = balance.doses
                 return self
-        except pymssql.Error:
+        except DBError:
             # print("Error occurred when getting Vaccine")
             raise
         finally:
@@ -34,6 +66,7 @@ class Vaccine:
     def get_available_doses(self):
         return self.available_doses
 
+    @retryable
     def save_to_db(self):
         if self.available_doses is None or self.available_doses <= 0:
             raise ValueError("Argument cannot be negative!")
@@ -47,53 +80,126 @@ class Vaccine:
             cursor.execute(add_doses, (self.vaccine_name, self.available_doses))
             # you must call commit() to persist your data if you don't set autocommit to True
             conn.commit()
-        except pymssql.Error:
+            ReadCache.invalidate_vaccines()
+        except DBError:
             # print("Error occurred when insert Vaccines")
             raise
         finally:
             cm.close_connection()
 
     # Increment the available doses
+    @retryable
     def increase_available_doses(self, num):
         if num <= 0:
             raise ValueError("Argument cannot be negative!")
-        self.available_doses += num
 
         cm = ConnectionManager()
         conn = cm.create_connection()
         cursor = conn.cursor()
-
-        update_vaccine_availability = "UPDATE vaccines SET Doses = %d WHERE name = %s"
         try:
-            cursor.execute(update_vaccine_availability, (self.available_doses, self.vaccine_name))
+            cursor.execute(Vaccine.add_delta, (self.vaccine_name, num, datetime.datetime.now()))
             # you must call commit() to persist your data if you don't set autocommit to True
             conn.commit()
-        except pymssql.Error:
+            ReadCache.invalidate_vaccines()
+        except DBError:
             # print("Error occurred when updating vaccine availability")
             raise
         finally:
             cm.close_connection()
+        self.available_doses += num
+        Vaccine.count_ledger_writes(1)
 
     # Decrement the available doses
+    @retryable
     def decrease_available_doses(self, num):
-        if self.available_doses - num < 0:
-            ValueError("Not enough available doses!")
-        self.available_doses -= num
+        if num <= 0:
+            raise ValueError("Argument cannot be negative!")
 
         cm = ConnectionManager()
         conn = cm.create_connection()
         cursor = conn.cursor()
-
-        update_vaccine_availability = "UPDATE vaccines SET Doses = %d WHERE name = %s"
         try:
-            cursor.execute(update_vaccine_availability, (self.available_doses, self.vaccine_name))
+            cursor.execute(Vaccine.take_doses_sql(), (num, datetime.datetime.now(), self.vaccine_name, num))
+            if cursor.rowcount == 0:
+                raise ValueError("Not enough available doses!")
             # you must call commit() to persist your data if you don't set autocommit to True
             conn.commit()
-        except pymssql.Error:
+            ReadCache.invalidate_vaccines()
+        except DBError:
             # print("Error occurred when updating vaccine availability")
             raise
         finally:
             cm.close_connection()
+        self.available_doses -= num
+        Vaccine.count_ledger_writes(1)
+
+    # Record a delivery of doses for several vaccines, given as (vaccine name, doses) pairs, in one transaction.
+    # Vaccines that are not in the inventory yet are added.
+    @staticmethod
+    @retryable
+    def receive_doses(receipts):
+        for vaccine_name, num in receipts:
+            if num <= 0:
+                raise ValueError("Argument cannot be negative!")
+
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+
+        add_vaccine = "INSERT INTO Vaccines (Name, Doses) SELECT %s, 0 WHERE NOT EXISTS (SELECT 1 FROM Vaccines WHERE Name = %s)"
+        try:
+            now = datetime.datetime.now()
+            for vaccine_name in sorted({vaccine_name for vaccine_name, _ in receipts}):
+                cursor.execute(add_vaccine, (vaccine_name, vaccine_name))
+            cursor.executemany(Vaccine.add_delta, [(vaccine_name, num, now) for vaccine_name, num in receipts])
+            conn.commit()
+        finally:
+            cm.close_connection()
+        ReadCache.invalidate_vaccines()
+        Vaccine.count_ledger_writes(len(receipts))
+
+    # Fold up to max_rows of the oldest ledger rows into Vaccines.Doses. Rows are read with their IDs and
+    # deleted by ID, so a ledger row committed meanwhile is never deleted without being counted.
+    @staticmethod
+    def compact_ledger(max_rows=10000):
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+
+        if cm.get_backend().name == "mssql":
+            get_rows = "SELECT TOP (%d) ID, Name, Delta FROM VaccineLedger WITH (UPDLOCK, READPAST) ORDER BY ID"
+        else:
+            get_rows = "SELECT ID, Name, Delta FROM VaccineLedger ORDER BY ID LIMIT %d"
+        fold = "UPDATE Vaccines SET Doses = Doses + %d WHERE Name = %s"
+        delete_row = "DELETE FROM VaccineLedger WHERE ID = %d"
+        try:
+            cursor.execute(get_rows, max_rows)
+            rows = cursor.fetchall()
+            totals = {}
+            for _, vaccine_name, delta in rows:
+                totals[vaccine_name] = totals.get(vaccine_name, 0) + delta
+            if rows:
+                cursor.executemany(fold, [(total, vaccine_name) for vaccine_name, total in sorted(totals.items())])
+                cursor.executemany(delete_row, [(row[0],) for row in rows])
+            conn.commit()
+        finally:
+            cm.close_connection()
+        return len(rows)
+
+    # Compacts the ledger once every COMPACT_EVERY ledger rows written by this process.
+    @staticmethod
+    def count_ledger_writes(num):
+        with ledger_lock:
+            ledger_writes[0] += num
+            if ledger_writes[0] < COMPACT_EVERY:
+                return
+            ledger_writes[0] = 0
+        with metrics.handled_errors():
+            try:
+                Vaccine.compact_ledger()
+            except DBError:
+                # best effort, the rows are folded in by the next compaction
+                pass
 
     def __str__(self):
         return f"(Vaccine Name: {self.vaccine_name}, Available Doses: {self.available_doses})"
@@ -0,0 +1,139 @@
+import datetime
+import os
+import sys
+sys.path.append("../db/*")
+from db.ConnectionManager import ConnectionManager, retryable
+import db.Repository as Repository
+from model.Reservation import Reservation, ReservationError
+from model.Vaccine import Vaccine
+
+# waiting patients considered per match() call
+MATCH_BATCH = int(os.getenv("WaitlistBatch", "1000"))
+
+
+class Waitlist:
+    """
+    A patient waiting for a vaccine on any date from from_date to to_date.
+
+    Entries are served first come, first served: match() runs after every
+    command that creates capacity (availability uploaded, doses added, an
+    appointment canceled) and books as many of the affected waiting patients as
+    it can, in one transaction.
+    """
+
+    SAVEPOINT = "waitlist_match"
+
+    def __init__(self, patient_name, vaccine_name, from_date, to_date, id=None):
+        self.patient_name = patient_name
+        self.vaccine_name = vaccine_name
+        self.from_date = from_date
+        self.to_date = to_date
+        self.id = id
+
+    # Adds the entry to the end of the queue; returns False if the patient already waits for the same thing.
+    # Raises ReservationError for a vaccine that does not exist, which the entry would wait for forever.
+    @retryable
+    def save_to_db(self):
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+
+        add_entry = ("INSERT INTO Waitlist (Patient_Name, Vaccine_Name, From_Date, To_Date, Created_At) "
+                     "SELECT %s, %s, %s, %s, %s WHERE NOT EXISTS (SELECT 1 FROM Waitlist WHERE Patient_Name = %s "
+                     "AND Vaccine_Name = %s AND From_Date = %s AND To_Date = %s)")
+        get_id = ("SELECT ID FROM Waitlist WHERE Patient_Name = %s AND Vaccine_Name = %s AND From_Date = %s "
+                  "AND To_Date = %s")
+        try:
+            if Repository.vaccine_exists.one(conn, (self.vaccine_name,)) is None:
+                raise ReservationError("Vaccine not found")
+            cursor.execute(add_entry, (self.patient_name, self.vaccine_name, self.from_date, self.to_date,
+                                       datetime.datetime.now(), self.patient_name, self.vaccine_name,
+                                       self.from_date, self.to_date))
+            added = cursor.rowcount == 1
+            cursor.execute(get_id, (self.patient_name, self.vaccine_name, self.from_date, self.to_date))
+            self.id = cursor.fetchone()[0]
+            conn.commit()
+        finally:
+            cm.close_connection()
+        return added
+
+    def get_id(self):
+        return self.id
+
+    # The patient's waiting entries, oldest first.
+    @staticmethod
+    @retryable
+    def entries(patient_name):
+        cm = ConnectionManager(read_only=True)
+        conn = cm.create_connection()
+
+        try:
+            return [Waitlist(patient_name, entry.vaccine_name, entry.from_date, entry.to_date, id=entry.id)
+                    for entry in Repository.waitlist_entries.all(conn, (patient_name,))]
+        finally:
+            cm.close_connection()
+
+    # Books waiting patients, oldest entry first, whose date range overlaps the dates or whose vaccine is one
+    # of the vaccines that just gained capacity. Each booking runs under a savepoint, so a patient who cannot
+    # be served leaves nothing behind; once a vaccine runs out, or a date range has no free slot, later entries
+    # needing it are skipped without a query. Returns the (entry, reservation) pairs booked.
+    @staticmethod
+    @retryable
+    def match(dates=(), vaccines=()):
+        if not dates and not vaccines:
+            return []
+
+        conditions = []
+        params = ()
+        if vaccines:
+            vaccines = sorted(set(vaccines))
+            conditions.append("Vaccine_Name IN (" + ", ".join(["%s"] * len(vaccines)) + ")")
+            params += tuple(vaccines)
+        if dates:
+            conditions.append("(From_Date <= %s AND To_Date >= %s)")
+            params += (max(dates), min(dates))
+
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor(as_dict=True)
+        backend = cm.get_backend()
+
+        # on SQL Server, concurrent matchers skip the entries another one is serving
+        hint = " WITH (UPDLOCK, READPAST)" if backend.name == "mssql" else ""
+        get_waiting = ("SELECT ID, Patient_Name, Vaccine_Name, From_Date, To_Date FROM Waitlist" + hint +
+                       " WHERE " + " OR ".join(conditions) + " ORDER BY ID")
+        remove_entry = "DELETE FROM Waitlist WHERE ID = %d"
+        matched = []
+        try:
+            cursor.execute(*backend.limit(get_waiting, params, MATCH_BATCH))
+            waiting = cursor.fetchall()
+            sold_out = set()
+            fully_booked = []
+            for row in waiting:
+                if row['Vaccine_Name'] in sold_out:
+                    continue
+                if any(start <= row['From_Date'] and row['To_Date'] <= end for start, end in fully_booked):
+                    continue
+                entry = Waitlist(row['Patient_Name'], row['Vaccine_Name'], row['From_Date'], row['To_Date'],
+                                 id=row['ID'])
+                reservation = Reservation(entry.patient_name, entry.vaccine_name, entry.from_date,
+                                          latest_time=entry.to_date)
+                cursor.execute(backend.savepoint_sql % Waitlist.SAVEPOINT)
+                status = reservation.book(cursor)
+                if status == "ok":
+                    cursor.execute(remove_entry, entry.id)
+                    matched.append((entry, reservation))
+                    continue
+                cursor.execute(backend.rollback_to_savepoint_sql % Waitlist.SAVEPOINT)
+                if status == "no_doses":
+                    sold_out.add(entry.vaccine_name)
+                else:
+                    fully_booked.append((entry.from_date, entry.to_date))
+            conn.commit()
+        finally:
+            cm.close_connection()
+        for _, reservation in matched:
+            reservation.booked()
+        if matched:
+            Vaccine.count_ledger_writes(len(matched))
+        return matched
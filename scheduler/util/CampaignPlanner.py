@@ -0,0 +1,308 @@
+import csv
+import datetime
+import sys
+from collections import deque
+sys.path.append("../util/*")
+sys.path.append("../db/*")
+from db.ConnectionManager import ConnectionManager, retryable
+from db.SlotIndex import slot_index, format_slot
+import db.ReadCache as ReadCache
+import db.Repository as Repository
+from model.Vaccine import Vaccine
+from model.Assignment import CaregiverLoad, week_of
+
+# usernames looked up per query when checking the roster
+CHUNK_SIZE = 1000
+
+
+class CampaignError(Exception):
+    pass
+
+
+class FlowNetwork:
+    """A directed graph with edge capacities, for Dinic's maximum flow algorithm."""
+
+    def __init__(self, nodes):
+        # per node, the indices into to/capacity of its outgoing edges; edge i ^ 1 is the reverse of edge i
+        self.edges = [[] for _ in range(nodes)]
+        self.to = []
+        self.capacity = []
+
+    def add_edge(self, source, target, capacity):
+        self.edges[source].append(len(self.to))
+        self.to.append(target)
+        self.capacity.append(capacity)
+        self.edges[target].append(len(self.to))
+        self.to.append(source)
+        self.capacity.append(0)
+        return len(self.to) - 2
+
+    def flow(self, edge):
+        # the flow through an edge is what its reverse edge can give back
+        return self.capacity[edge ^ 1]
+
+    def max_flow(self, source, sink):
+        total = 0
+        while True:
+            level = self._levels(source)
+            if level[sink] < 0:
+                return total
+            position = [0] * len(self.edges)
+            while True:
+                pushed = self._augment(source, sink, level, position)
+                if not pushed:
+                    break
+                total += pushed
+
+    def _levels(self, source):
+        level = [-1] * len(self.edges)
+        level[source] = 0
+        queue = deque([source])
+        while queue:
+            node = queue.popleft()
+            for edge in self.edges[node]:
+                if self.capacity[edge] > 0 and level[self.to[edge]] < 0:
+                    level[self.to[edge]] = level[node] + 1
+                    queue.append(self.to[edge])
+        return level
+
+    def _augment(self, source, sink, level, position):
+        # one blocking-flow path found by iterative depth-first search, skipping dead-end edges for good
+        path = []
+        node = source
+        while node != sink:
+            edges = self.edges[node]
+            while position[node] < len(edges):
+                edge = edges[position[node]]
+                if self.capacity[edge] > 0 and level[self.to[edge]] == level[node] + 1:
+                    break
+                position[node] += 1
+            else:
+                if node == source:
+                    return 0
+                level[node] = -1
+                node = self.to[path.pop() ^ 1]
+                position[node] += 1
+                continue
+            path.append(edge)
+            node = self.to[edge]
+        pushed = min(self.capacity[edge] for edge in path)
+        for edge in path:
+            self.capacity[edge] -= pushed
+            self.capacity[edge ^ 1] += pushed
+        return pushed
+
+
+class CampaignPlanner:
+    """
+    Books a whole roster of patients into the free slots in one pass.
+
+    The roster is a CSV file of patient,vaccine,from date,to date rows (dates as
+    mm-dd-yyyy). Free slots and dose balances are read once, and the assignment
+    is solved as a maximum flow from vaccines (capped at their doses) through
+    groups of patients with the same vaccine and dates to the dates (capped at
+    their free slots), so as many patients as possible are booked. Within a
+    date, patients are dealt out to caregivers in turn.
+
+    run() writes a report of every roster row to report_path; with commit=True
+    the reservations, slot deletions, dose takes and load counters are written
+    in bulk and committed once.
+    """
+
+    def __init__(self, csv_path, report_path):
+        self.csv_path = csv_path
+        self.report_path = report_path
+        # (patient, vaccine, from date, to date) per accepted roster row, in roster order
+        self.requests = []
+        # (patient, reason) per rejected roster row
+        self.rejected = []
+        # (patient, vaccine, date, slot, caregiver) per booking
+        self.assignments = []
+        # vaccine -> dose balance
+        self.doses = {}
+
+    def run(self, commit=False):
+        self.read_roster()
+        if self.requests:
+            first = min(from_date for _, _, from_date, _ in self.requests)
+            last = max(to_date for _, _, _, to_date in self.requests)
+            self.doses = self.load_doses()
+            self.plan(self.load_slots(first, last), self.doses)
+        self.write_report()
+        if commit and self.assignments:
+            self.save()
+        return len(self.assignments), len(self.requests) - len(self.assignments), len(self.rejected)
+
+    def read_roster(self):
+        rows = []
+        seen = set()
+        with open(self.csv_path, newline="") as source:
+            for line_number, row in enumerate(csv.reader(source), 1):
+                if line_number == 1 and [col.strip().lower() for col in row][:2] == ["patient", "vaccine"]:
+                    continue
+                if len(row) != 4 or not row[0].strip():
+                    self.rejected.append((row[0] if row else "",
+                                          "line %d: expected patient,vaccine,from date,to date" % line_number))
+                    continue
+                patient, vaccine = row[0].strip(), row[1].strip()
+                try:
+                    from_date, to_date = parse_roster_date(row[2]), parse_roster_date(row[3])
+                except ValueError:
+                    self.rejected.append((patient, "line %d: invalid date" % line_number))
+                    continue
+                if to_date < from_date:
+                    self.rejected.append((patient, "line %d: the end date is before the start date" % line_number))
+                    continue
+                if patient in seen:
+                    self.rejected.append((patient, "duplicate patient in roster"))
+                    continue
+                seen.add(patient)
+                rows.append((patient, vaccine, from_date, to_date))
+
+        known = set()
+        patients = [row[0] for row in rows]
+        for i in range(0, len(patients), CHUNK_SIZE):
+            known |= self.known_patients(patients[i:i + CHUNK_SIZE])
+        for row in rows:
+            if row[0] in known:
+                self.requests.append(row)
+            else:
+                self.rejected.append((row[0], "unknown patient"))
+
+    @retryable
+    def known_patients(self, usernames):
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        try:
+            return {row[0] for row in Repository.patients_among(len(usernames)).all(conn, tuple(usernames))}
+        finally:
+            cm.close_connection()
+
+    @retryable
+    def load_slots(self, first, last):
+        # date -> free (slot, caregiver) pairs, earliest slot first
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        try:
+            slots = {}
+            for row in Repository.free_slots_between.each(conn, (first, last), size=1000):
+                slots.setdefault(row.time, []).append((row.slot, row.username))
+            return slots
+        finally:
+            cm.close_connection()
+
+    @retryable
+    def load_doses(self):
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        try:
+            return dict(Repository.vaccine_balances.all(conn))
+        finally:
+            cm.close_connection()
+
+    def plan(self, slots, doses):
+        # patients asking for the same vaccine and dates are interchangeable, so the network has a node per
+        # such group rather than per patient and stays small however long the roster is
+        groups = {}
+        for request in self.requests:
+            groups.setdefault(request[1:], []).append(request[0])
+        vaccines = sorted({vaccine for vaccine, _, _ in groups})
+        dates = sorted(slots)
+
+        source, sink = 0, 1
+        vaccine_node = {vaccine: 2 + i for i, vaccine in enumerate(vaccines)}
+        group_node = {group: 2 + len(vaccines) + i for i, group in enumerate(groups)}
+        date_node = {d: 2 + len(vaccines) + len(groups) + i for i, d in enumerate(dates)}
+        network = FlowNetwork(2 + len(vaccines) + len(groups) + len(dates))
+        for vaccine in vaccines:
+            network.add_edge(source, vaccine_node[vaccine], max(doses.get(vaccine, 0), 0))
+        group_edges = {}
+        for group, patients in groups.items():
+            vaccine, from_date, to_date = group
+            network.add_edge(vaccine_node[vaccine], group_node[group], len(patients))
+            group_edges[group] = [(d, network.add_edge(group_node[group], date_node[d], len(patients)))
+                                  for d in dates if from_date <= d <= to_date]
+        for d in dates:
+            network.add_edge(date_node[d], sink, len(slots[d]))
+        network.max_flow(source, sink)
+
+        # patients of a group take its dates in roster order; each date's patients are then dealt out to
+        # its caregivers in turn, so every caregiver gets a share of the day
+        booked = {}
+        for group, edges in group_edges.items():
+            patients = iter(groups[group])
+            for d, edge in edges:
+                for _ in range(network.flow(edge)):
+                    booked.setdefault(d, []).append((next(patients), group[0]))
+        for d, patients in sorted(booked.items()):
+            for (patient, vaccine), (slot, caregiver) in zip(patients, spread(slots[d])):
+                self.assignments.append((patient, vaccine, d, slot, caregiver))
+
+    def write_report(self):
+        booked = {assignment[0] for assignment in self.assignments}
+        with open(self.report_path, "w", newline="") as report:
+            writer = csv.writer(report)
+            writer.writerow(["patient", "vaccine", "date", "time", "caregiver", "status"])
+            for patient, vaccine, d, slot, caregiver in self.assignments:
+                writer.writerow([patient, vaccine, d.strftime("%m-%d-%Y"), format_slot(slot), caregiver, "booked"])
+            for patient, vaccine, _, _ in self.requests:
+                if patient not in booked:
+                    writer.writerow([patient, vaccine, "", "", "",
+                                     "no capacity" if vaccine in self.doses else "unknown vaccine"])
+            for patient, reason in self.rejected:
+                writer.writerow([patient, "", "", "", "", reason])
+
+    def save(self):
+        doses = {}
+        loads = {}
+        for _, vaccine, d, _, caregiver in self.assignments:
+            doses[vaccine] = doses.get(vaccine, 0) + 1
+            loads[(caregiver, week_of(d))] = loads.get((caregiver, week_of(d)), 0) + 1
+
+        remove_slot = "DELETE FROM Availabilities WHERE Time = %s AND Username = %s AND Slot = %d"
+        add_reservation = ("INSERT INTO Reservations (Patient_Name, Caregiver_Name, Vaccine_Name, Reservation_Time, "
+                           "Slot) VALUES (%s, %s, %s, %s, %d)")
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+        try:
+            # the plan only holds if every slot and dose it used is still free
+            cursor.executemany(remove_slot, [(d, caregiver, slot) for _, _, d, slot, caregiver in self.assignments])
+            if cursor.rowcount != len(self.assignments):
+                conn.rollback()
+                raise CampaignError("Availability changed while planning, please plan again")
+            now = datetime.datetime.now()
+            for vaccine, num in sorted(doses.items()):
+                cursor.execute(Vaccine.take_doses_sql(), (num, now, vaccine, num))
+                if cursor.rowcount == 0:
+                    conn.rollback()
+                    raise CampaignError("Doses of " + vaccine + " changed while planning, please plan again")
+            cursor.executemany(add_reservation, [(patient, caregiver, vaccine, d, slot)
+                                                 for patient, vaccine, d, slot, caregiver in self.assignments])
+            cursor.executemany(CaregiverLoad.add_bookings, [(num, caregiver, week)
+                                                            for (caregiver, week), num in sorted(loads.items())])
+            cursor.executemany(CaregiverLoad.insert_bookings, [(caregiver, week, num, caregiver, week)
+                                                               for (caregiver, week), num in sorted(loads.items())])
+            conn.commit()
+        finally:
+            cm.close_connection()
+        slot_index.invalidate(*{d for _, _, d, _, _ in self.assignments})
+        ReadCache.invalidate_vaccines()
+        Vaccine.count_ledger_writes(len(doses))
+
+
+def spread(slots):
+    # a date's free (slot, caregiver) pairs, each caregiver's earliest free slot first, taking caregivers in turn
+    by_caregiver = {}
+    for slot, caregiver in slots:
+        by_caregiver.setdefault(caregiver, deque()).append(slot)
+    queues = [(caregiver, by_caregiver[caregiver]) for caregiver in sorted(by_caregiver)]
+    while queues:
+        for caregiver, queue in queues:
+            yield queue.popleft(), caregiver
+        queues = [(caregiver, queue) for caregiver, queue in queues if queue]
+
+
+def parse_roster_date(date):
+    month, day, year = (int(part) for part in date.strip().split("-"))
+    return datetime.date(year, month, day)
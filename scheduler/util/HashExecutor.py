@@ -0,0 +1,89 @@
+import os
+import threading
+import time
+import sys
+from concurrent.futures import ThreadPoolExecutor
+sys.path.append("../util/*")
+from util.Util import Util
+from util.Metrics import metrics
+
+
+class HashExecutor:
+    """
+    Runs password hashing on a dedicated pool of worker threads.
+
+    hashlib releases the GIL while it computes PBKDF2, so the workers use every
+    core. At most max_queue hashes may be pending at once; further submitters
+    block until a slot frees up.
+    """
+
+    def __init__(self, workers=None, max_queue=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = max_queue or self.workers * 16
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="hash")
+        self.slots = threading.BoundedSemaphore(self.max_queue)
+        self.lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def submit(self, password, salt):
+        self.slots.acquire()
+        with self.lock:
+            self.queued += 1
+        try:
+            return self.executor.submit(self._hash, password, salt)
+        except BaseException:
+            with self.lock:
+                self.queued -= 1
+            self.slots.release()
+            raise
+
+    def generate_hash(self, password, salt):
+        started = time.perf_counter()
+        try:
+            return self.submit(password, salt).result()
+        finally:
+            metrics.observe_hash_wait(time.perf_counter() - started)
+
+    def _hash(self, password, salt):
+        with self.lock:
+            self.queued -= 1
+            self.running += 1
+        started = time.perf_counter()
+        try:
+            return Util.generate_hash(password, salt)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self.lock:
+                self.running -= 1
+                self.completed += 1
+                self.total_time += elapsed
+                self.max_time = max(self.max_time, elapsed)
+            metrics.observe_hash(elapsed)
+            self.slots.release()
+
+    def stats(self):
+        with self.lock:
+            mean = self.total_time / self.completed if self.completed else 0.0
+            return {"workers": self.workers, "max_queue": self.max_queue, "queue_depth": self.queued,
+                    "running": self.running, "completed": self.completed,
+                    "mean_hash_ms": mean * 1000, "max_hash_ms": self.max_time * 1000}
+
+
+hash_executor = None
+hash_executor_lock = threading.Lock()
+
+
+def get_hash_executor():
+    """The process-wide executor, sized by the HashWorkers and HashQueueSize environment variables."""
+    global hash_executor
+    with hash_executor_lock:
+        if hash_executor is None:
+            workers = os.getenv("HashWorkers")
+            max_queue = os.getenv("HashQueueSize")
+            hash_executor = HashExecutor(int(workers) if workers else None, int(max_queue) if max_queue else None)
+            metrics.add_source("hash_executor", hash_executor.stats)
+        return hash_executor
@@ -0,0 +1,275 @@
+import atexit
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# histogram bucket upper bounds in seconds: quarter-octave steps from 50us to about 52s, so a
+# percentile read off the buckets is within about 10% of the true value
+BUCKETS = [0.00005 * 2 ** (i / 4) for i in range(81)]
+
+
+class Histogram:
+    """Counts observations into fixed buckets, for percentiles and for Prometheus histograms."""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        # called with the registry lock held
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def percentile(self, q):
+        """The q-th percentile (0-100), interpolated within its bucket."""
+        if self.count == 0:
+            return 0.0
+        rank = q / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                low = BUCKETS[i - 1] if i > 0 else 0.0
+                high = BUCKETS[i] if i < len(BUCKETS) else self.max
+                return min(low + (high - low) * (rank - seen) / n, self.max)
+            seen += n
+        return self.max
+
+    def mean(self):
+        return self.sum / self.count if self.count else 0.0
+
+
+class CommandTimer:
+    """What one command spent, filled in by the instrumented code while the command runs."""
+
+    def __init__(self, operation):
+        self.operation = operation
+        self.round_trips = 0
+        self.db_time = 0.0
+        self.acquire_time = 0.0
+        self.hash_time = 0.0
+        # set when a database error reached the command, see db.Retry
+        self.failed = False
+        self.recorded = True
+
+    def discard(self):
+        # e.g. an unknown operation name, which would otherwise become a label of its own
+        self.recorded = False
+
+
+class CommandStats:
+    def __init__(self):
+        self.latency = Histogram()
+        self.failures = 0
+        self.round_trips = 0
+        self.db_time = 0.0
+        self.acquire_time = 0.0
+        self.hash_time = 0.0
+
+
+class Metrics:
+    """
+    Process-wide instrumentation: latency per command and where the time went.
+
+    dispatch() times every command with command(); while it runs, the database
+    cursors count round trips and time spent in the driver, ConnectionManager
+    adds the time spent waiting for a pooled connection and the hash executor
+    the time spent waiting for a password hash, all attributed to the command
+    running in the current thread. Other components register a stats()
+    callable with add_source() and are reported alongside.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.commands = {}
+        self.acquire = Histogram()
+        self.hash = Histogram()
+        self.round_trips = 0
+        self.failures = 0
+        self.sources = {}
+        self.local = threading.local()
+        self.dumper = None
+
+    @contextmanager
+    def command(self, operation):
+        timer = CommandTimer(operation)
+        outer = getattr(self.local, "command", None)
+        self.local.command = timer
+        started = time.perf_counter()
+        try:
+            yield timer
+        finally:
+            elapsed = time.perf_counter() - started
+            self.local.command = outer
+            if timer.recorded:
+                with self.lock:
+                    stats = self.commands.get(operation)
+                    if stats is None:
+                        stats = self.commands[operation] = CommandStats()
+                    stats.latency.observe(elapsed)
+                    if timer.failed:
+                        stats.failures += 1
+                        self.failures += 1
+                    stats.round_trips += timer.round_trips
+                    stats.db_time += timer.db_time
+                    stats.acquire_time += timer.acquire_time
+                    stats.hash_time += timer.hash_time
+
+    def current(self):
+        return getattr(self.local, "command", None)
+
+    def observe_round_trip(self, elapsed, trips=1):
+        timer = self.current()
+        if timer is not None:
+            timer.round_trips += trips
+            timer.db_time += elapsed
+        with self.lock:
+            self.round_trips += trips
+
+    def observe_failure(self):
+        timer = self.current()
+        if timer is not None:
+            timer.failed = True
+
+    @contextmanager
+    def handled_errors(self):
+        """Database errors inside the block do not fail the current command, unless one escapes the block."""
+        timer = self.current()
+        failed = timer.failed if timer is not None else False
+        yield
+        if timer is not None:
+            timer.failed = failed
+
+    def observe_acquire(self, elapsed):
+        timer = self.current()
+        if timer is not None:
+            timer.acquire_time += elapsed
+        with self.lock:
+            self.acquire.observe(elapsed)
+
+    def observe_hash_wait(self, elapsed):
+        # the caller's wait for a hash, queueing included
+        timer = self.current()
+        if timer is not None:
+            timer.hash_time += elapsed
+
+    def observe_hash(self, elapsed):
+        # the hash computation itself, on a worker thread
+        with self.lock:
+            self.hash.observe(elapsed)
+
+    def add_source(self, name, stats):
+        """Reports the dict returned by stats() under name."""
+        with self.lock:
+            self.sources[name] = stats
+
+    def report(self):
+        """The commands' latency percentiles and breakdown, then every source, as printable lines."""
+        with self.lock:
+            commands = sorted(self.commands.items())
+            lines = [f"{'command':<28}{'count':>8}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}{'max(ms)':>10}"
+                     f"{'failed':>8}{'trips':>8}{'db(ms)':>9}{'conn(ms)':>10}{'hash(ms)':>10}"]
+            for operation, stats in commands:
+                n = stats.latency.count
+                lines.append(f"{operation:<28}{n:>8}{stats.latency.percentile(50) * 1000:>10.2f}"
+                             f"{stats.latency.percentile(95) * 1000:>10.2f}"
+                             f"{stats.latency.percentile(99) * 1000:>10.2f}{stats.latency.max * 1000:>10.2f}"
+                             f"{stats.failures:>8}{stats.round_trips / n:>8.1f}{stats.db_time / n * 1000:>9.2f}"
+                             f"{stats.acquire_time / n * 1000:>10.2f}{stats.hash_time / n * 1000:>10.2f}")
+            lines.append("(trips, db, conn and hash are means per command)")
+            for name, histogram in (("connection acquire", self.acquire), ("password hash", self.hash)):
+                lines.append(f"{name}: {histogram.count} observed, p50 {histogram.percentile(50) * 1000:.2f} ms, "
+                             f"p99 {histogram.percentile(99) * 1000:.2f} ms, max {histogram.max * 1000:.2f} ms")
+            sources = sorted(self.sources.items())
+        for name, stats in sources:
+            lines.append(name + ": " + ", ".join(f"{key} {format_value(value)}" for key, value in stats().items()))
+        return lines
+
+    def prometheus(self):
+        """Everything in the Prometheus text exposition format."""
+        lines = []
+        with self.lock:
+            commands = sorted(self.commands.items())
+            lines.append("# TYPE scheduler_command_seconds histogram")
+            for operation, stats in commands:
+                lines += histogram_lines("scheduler_command_seconds", stats.latency, 'operation="%s",' % operation)
+            for metric, attribute in (("failures", "failures"), ("round_trips", "round_trips"),
+                                      ("db_seconds", "db_time"),
+                                      ("connection_acquire_seconds", "acquire_time"),
+                                      ("hash_wait_seconds", "hash_time")):
+                lines.append("# TYPE scheduler_command_%s_total counter" % metric)
+                for operation, stats in commands:
+                    lines.append('scheduler_command_%s_total{operation="%s"} %s'
+                                 % (metric, operation, format_value(getattr(stats, attribute))))
+            lines.append("# TYPE scheduler_round_trips_total counter")
+            lines.append("scheduler_round_trips_total %d" % self.round_trips)
+            lines.append("# TYPE scheduler_connection_acquire_seconds histogram")
+            lines += histogram_lines("scheduler_connection_acquire_seconds", self.acquire)
+            lines.append("# TYPE scheduler_hash_seconds histogram")
+            lines += histogram_lines("scheduler_hash_seconds", self.hash)
+            sources = sorted(self.sources.items())
+        for name, stats in sources:
+            for key, value in stats().items():
+                if not isinstance(value, (int, float)):
+                    continue
+                metric = "scheduler_%s_%s" % (name, key)
+                lines.append("# TYPE %s gauge" % metric)
+                lines.append("%s %s" % (metric, format_value(value)))
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path):
+        # written next to the target and renamed over it, so a scraper never reads half a file
+        temp = path + ".tmp"
+        with open(temp, "w") as f:
+            f.write(self.prometheus())
+        os.replace(temp, path)
+
+    def start_dump(self, path, interval):
+        """Writes prometheus() to path every interval seconds, and once more at exit."""
+        if self.dumper is not None:
+            return
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.dump(path)
+                except OSError:
+                    pass
+
+        self.dumper = threading.Thread(target=run, name="metrics-dump", daemon=True)
+        self.dumper.start()
+        atexit.register(self.dump, path)
+
+
+def histogram_lines(name, histogram, labels=""):
+    # cumulative buckets, with labels ending in a comma when there are any
+    lines = []
+    cumulative = 0
+    for bound, n in zip(BUCKETS, histogram.counts):
+        cumulative += n
+        lines.append('%s_bucket{%sle="%.6g"} %d' % (name, labels, bound, cumulative))
+    lines.append('%s_bucket{%sle="+Inf"} %d' % (name, labels, histogram.count))
+    labels = "{" + labels.rstrip(",") + "}" if labels else ""
+    lines.append("%s_sum%s %s" % (name, labels, format_value(histogram.sum)))
+    lines.append("%s_count%s %d" % (name, labels, histogram.count))
+    return lines
+
+
+def format_value(value):
+    return "%.6g" % value if isinstance(value, float) else str(value)
+
+
+metrics = Metrics()
+
+
+def start_dump_from_env():
+    """Starts the periodic dump if the MetricsFile environment variable names a file (every MetricsInterval s)."""
+    path = os.getenv("MetricsFile")
+    if path:
+        metrics.start_dump(path, float(os.getenv("MetricsInterval", "15")))
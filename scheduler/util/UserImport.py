@@ -0,0 +1,132 @@
+import csv
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+sys.path.append("../util/*")
+sys.path.append("../db/*")
+from util.Util import Util
+from db.ConnectionManager import ConnectionManager
+from db.UsernameIndex import patient_names, caregiver_names
+import db.Repository as Repository
+
+TABLES = {"patient": "Patients", "caregiver": "Caregivers"}
+INDEXES = {"patient": patient_names, "caregiver": caregiver_names}
+ADD_USERS = {"patient": Repository.add_patient, "caregiver": Repository.add_caregiver}
+
+
+def hash_password(args):
+    password, salt = args
+    return Util.generate_hash(password, salt)
+
+
+class UserImport:
+    """
+    Streams username,password rows from a CSV file into the Patients or Caregivers table.
+
+    Rows are processed chunk_size at a time: weak passwords and usernames that
+    are repeated in the file or already taken are written to the reject file,
+    the remaining passwords are hashed across a process pool (one worker per
+    core by default) and the chunk is inserted with one executemany and one
+    commit. The insert skips a name registered meanwhile, which is then
+    rejected too.
+    """
+
+    def __init__(self, kind, chunk_size=1000, workers=None):
+        if kind not in TABLES:
+            raise ValueError("Unknown user type " + kind + ", expected one of: " + ", ".join(TABLES))
+        self.table = TABLES[kind]
+        self.names = INDEXES[kind]
+        self.add_user = ADD_USERS[kind]
+        self.chunk_size = chunk_size
+        self.workers = workers or os.cpu_count() or 1
+        self.imported = 0
+        self.rejected = 0
+
+    def run(self, csv_path, reject_path):
+        seen = set()
+        with open(csv_path, newline="") as source, open(reject_path, "w", newline="") as rejects, \
+                ProcessPoolExecutor(max_workers=self.workers) as executor:
+            reject_writer = csv.writer(rejects)
+            reject_writer.writerow(["username", "reason"])
+            chunk = []
+            for line_number, row in enumerate(csv.reader(source), 1):
+                if line_number == 1 and [col.strip().lower() for col in row] == ["username", "password"]:
+                    continue
+                if len(row) != 2 or not row[0].strip():
+                    self.reject(reject_writer, row[0] if row else "", "line %d: expected username,password" % line_number)
+                    continue
+                username, password = row[0].strip(), row[1]
+                if username in seen:
+                    self.reject(reject_writer, username, "duplicate username in file")
+                    continue
+                seen.add(username)
+                failure = Util.check_password_strength(password)
+                if failure is not None:
+                    self.reject(reject_writer, username, failure)
+                    continue
+                chunk.append((username, password))
+                if len(chunk) >= self.chunk_size:
+                    self.import_chunk(chunk, executor, reject_writer)
+                    chunk = []
+            if chunk:
+                self.import_chunk(chunk, executor, reject_writer)
+        return self.imported, self.rejected
+
+    def reject(self, reject_writer, username, reason):
+        reject_writer.writerow([username, reason])
+        self.rejected += 1
+
+    def import_chunk(self, chunk, executor, reject_writer):
+        taken = self.taken_usernames([username for username, _ in chunk])
+        for username, _ in chunk:
+            if username in taken:
+                self.reject(reject_writer, username, "username taken")
+        chunk = [(username, password) for username, password in chunk if username not in taken]
+        if not chunk:
+            return
+
+        # hash without holding a connection
+        salts = [Util.generate_salt() for _ in chunk]
+        hashes = executor.map(hash_password, [(password, salt) for (_, password), salt in zip(chunk, salts)],
+                              chunksize=max(1, len(chunk) // (self.workers * 4)))
+        rows = [(username, salt, hash) for (username, _), salt, hash in zip(chunk, salts, hashes)]
+
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+        try:
+            # a name registered since taken_usernames() is skipped by the insert rather than failing the chunk
+            self.add_user.executemany(cursor, [(username, salt, hash, username) for username, salt, hash in rows])
+            if cursor.rowcount != len(rows):
+                # the rows that went in are the ones stored with their own salt
+                stored = {salt for _, salt in self.select_users(cursor, [username for username, _, _ in rows])}
+                for username, salt, _ in rows:
+                    if salt not in stored:
+                        self.reject(reject_writer, username, "username taken")
+                rows = [row for row in rows if row[1] in stored]
+            conn.commit()
+            self.imported += len(rows)
+        finally:
+            cm.close_connection()
+        for username, _, _ in rows:
+            self.names.add(username)
+
+    def taken_usernames(self, usernames):
+        # only the names the index may have seen are looked up
+        usernames = [username for username in usernames if self.names.might_exist(username)]
+        if not usernames:
+            return set()
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+        try:
+            return {username for username, _ in self.select_users(cursor, usernames)}
+        finally:
+            cm.close_connection()
+
+    def select_users(self, cursor, usernames):
+        # (username, salt) of the users among usernames
+        placeholders = ", ".join(["%s"] * len(usernames))
+        cursor.execute("SELECT Username, Salt FROM " + self.table + " WHERE Username IN (" + placeholders + ")",
+                       tuple(usernames))
+        return cursor.fetchall()
@@ -1,5 +1,6 @@
 import hashlib
 import os
+import re
 
 
 class Util:
@@ -15,3 +16,17 @@ class Util:
             dklen=16
         )
         return key
+
+    # returns why password is not strong enough, or None if it is
+    def check_password_strength(password):
+        if len(password) < 8:
+            return "Password length check failed. See Guideline a"
+        if not re.search("[a-z]", password):
+            return "Lowercase letter check failed. See Guideline b"
+        if not re.search("[A-Z]", password):
+            return "Uppercase letter check failed. See Guideline b"
+        if not re.search("[0-9]", password):
+            return "Number check failed. See Guideline c"
+        if not re.search("[!@#?]", password):
+            return "Special character check failed. See Guideline d"
+        return None